@@ -1,75 +1,104 @@
 #!/usr/bin/env python3
 # pi_controller.py
 
-import json
 import time
 import datetime
-import threading
 
 from flask import (
-    Flask, Response, request, redirect,
-    url_for, render_template, send_file, jsonify # Import jsonify
+    Flask, Response, request, redirect, abort,
+    url_for, render_template, send_file
 )
-from bioreactor_controller import BioreactorController
-from config import LOG_DIR
+from fleet import start_controllers
+from metrics import render as render_metrics
+from history_query import history_response
 
-app = Flask(__name__)
-controller = BioreactorController()
-controller.start()
+def create_app(controllers=None):
+    """The dashboard for controllers ({reactor id: BioreactorController}); without them, the configured
+    reactors are built and started. `flask run` and WSGI servers (gunicorn "pi_controller:create_app()")
+    call this, so importing the module starts nothing."""
+    app = Flask(__name__)
+    if controllers is None: controllers = start_controllers()
+    app.controllers = controllers
 
-@app.route('/')
-def index():
-    return render_template('index.html', setpoints=controller.setpoints)
+    def get_controller(reactor_id):
+        """Routes without a reactor id address the first configured reactor."""
+        if reactor_id is None: reactor_id = next(iter(controllers))
+        if reactor_id not in controllers: abort(404)
+        return controllers[reactor_id]
 
-# --- NEW ROUTE ---
-@app.route('/history')
-def history():
-    """Provides the entire chart history for the current session."""
-    return jsonify(controller.history)
+    @app.route('/', defaults={'reactor_id': None})
+    @app.route('/r/<reactor_id>/')
+    def index(reactor_id):
+        controller = get_controller(reactor_id)
+        return render_template('index.html', setpoints=controller.state.current.setpoints,
+                               reactor_id=reactor_id, current_reactor=controller.reactor_id, reactors=list(controllers))
 
-@app.route('/toggle', methods=['POST'])
-def toggle():
-    # ... (this route is unchanged)
-    actuator = request.form['act']
-    new_state = 0 if controller.latest_readings.get(actuator, 0) else 1
-    controller.set_manual_override(actuator, new_state)
-    time.sleep(0.1)
-    return redirect(url_for('index'))
+    # --- NEW ROUTE ---
+    @app.route('/history', defaults={'reactor_id': None})
+    @app.route('/r/<reactor_id>/history')
+    def history(reactor_id):
+        """Without arguments: the newest chart history points of the current session.
+        With ?series=t1,od&from=<ms>&to=<ms>&max_points=N&method=minmax|lttb: any time range of the
+        on-disk logs, downsampled on the server. from defaults to 24 h before to, to defaults to now.
+        ?format=columns|binary selects a compact encoding and ?since=<ms> returns only newer points;
+        see history_query.history_response."""
+        controller = get_controller(reactor_id)
+        try: status, body, headers = history_response(controller, request.args, request.headers)
+        except ValueError: abort(400)
+        return Response(body, status, headers)
 
-@app.route('/set_automation', methods=['POST'])
-def set_automation():
-    # ... (this route is unchanged)
-    controller.set_temperature_setpoint(request.form.get('temp_setpoint'))
-    controller.set_light_cycle(request.form.get('light_cycle_hours'))
-    controller.set_dilution_rate(request.form.get('dilution_percent'))
-    controller.set_od_interval(request.form.get('od_interval_hours'))
-    controller.set_aerator_interval(request.form.get('aerator_interval_hours')) # Added this line
-    controller.resume_all_automation()
-    return redirect(url_for('index'))
+    @app.route('/toggle', methods=['POST'], defaults={'reactor_id': None})
+    @app.route('/r/<reactor_id>/toggle', methods=['POST'])
+    def toggle(reactor_id):
+        controller = get_controller(reactor_id)
+        actuator = request.form['act']
+        new_state = 0 if controller.state.current.readings.get(actuator, 0) else 1
+        controller.set_manual_override(actuator, new_state)
+        time.sleep(0.1)
+        return redirect(url_for('index', reactor_id=reactor_id))
 
-@app.route('/trigger_od', methods=['POST'])
-def trigger_od():
-    # ... (this route is unchanged)
-    threading.Thread(target=controller.trigger_od_reading_sequence).start()
-    return redirect(url_for('index'))
+    @app.route('/set_automation', methods=['POST'], defaults={'reactor_id': None})
+    @app.route('/r/<reactor_id>/set_automation', methods=['POST'])
+    def set_automation(reactor_id):
+        controller = get_controller(reactor_id)
+        controller.set_temperature_setpoint(request.form.get('temp_setpoint'))
+        controller.set_light_cycle(request.form.get('light_cycle_hours'))
+        controller.set_dilution_rate(request.form.get('dilution_percent'))
+        controller.set_od_interval(request.form.get('od_interval_hours'))
+        controller.set_aerator_interval(request.form.get('aerator_interval_hours')) # Added this line
+        controller.set_target_od(request.form.get('target_od'))
+        controller.resume_all_automation()
+        return redirect(url_for('index', reactor_id=reactor_id))
 
-@app.route('/stream')
-def stream():
-    # ... (this route is unchanged)
-    def gen():
-        while True:
-            yield f"data:{json.dumps(controller.latest_readings)}\n\n"
-            time.sleep(0.2)
-    return Response(gen(), mimetype='text/event-stream')
+    @app.route('/trigger_od', methods=['POST'], defaults={'reactor_id': None})
+    @app.route('/r/<reactor_id>/trigger_od', methods=['POST'])
+    def trigger_od(reactor_id):
+        get_controller(reactor_id).trigger_od_reading_sequence()
+        return redirect(url_for('index', reactor_id=reactor_id))
 
-@app.route('/download')
-def download():
-    # ... (this route is unchanged)
-    csv_path = LOG_DIR / f"{datetime.date.today()}.csv"
-    if csv_path.exists():
-        return send_file(csv_path, as_attachment=True)
-    return "Log file not found for today.", 404
+    @app.route('/stream', defaults={'reactor_id': None})
+    @app.route('/r/<reactor_id>/stream')
+    def stream(reactor_id):
+        """Server-Sent Events pushed by the controller whenever its readings change.
+        ?delta=1 sends only the changed keys as 'delta' events after the first full snapshot."""
+        frames = get_controller(reactor_id).hub.subscribe(request.headers.get('Last-Event-ID'), delta=request.args.get('delta') == '1')
+        return Response(frames, mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+    @app.route('/metrics')
+    def metrics():
+        """Prometheus text format, for every reactor."""
+        return Response(render_metrics(controllers), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/download', defaults={'reactor_id': None})
+    @app.route('/r/<reactor_id>/download')
+    def download(reactor_id):
+        csv_path = get_controller(reactor_id).log_dir / f"{datetime.date.today()}.csv"
+        if csv_path.exists():
+            return send_file(csv_path, as_attachment=True)
+        return "Log file not found for today.", 404
+
+    return app
 
 if __name__ == '__main__':
     print(f"Dashboard -> http://0.b.0.0:5000")
-    app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
+    create_app().run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# analyze_logs.py
+"""Per-day and per-hour summaries of a log directory: temperature mean/min/max, heater duty, OD
+trend and gaps in the data. Every day file is analysed in its own worker process, and results are
+cached per file (by size and mtime) in <log dir>/analysis_cache.json, so only new or growing
+files are read again.
+
+    python analyze_logs.py                          # LOG_DIR, one line per day
+    python analyze_logs.py logs/r1 --hourly --from 2024-05-01 --csv r1.csv
+"""
+
+import os
+import csv
+import sys
+import json
+import pathlib
+import argparse
+import datetime
+import concurrent.futures
+
+import numpy as np
+from config import LOG_DIR
+from protocol import ACTUATORS
+from history_query import decode_column
+from log_writer import open_binary_log
+
+CACHE_NAME = "analysis_cache.json"
+CACHE_VERSION = 1
+HEATER_BIT = 1 << ACTUATORS.index("heater")
+
+def load_binary_log(path):
+    """(ts_ms, columns) of a binary log, read through a memmap."""
+    base_ts, records = open_binary_log(path)
+    ts = base_ts + records['dt_ms'].astype(np.int64)
+    cols = {name: decode_column(records, name) for name in ("t1", "t2", "od")}
+    cols["heater"] = ((records['actuators'] & HEATER_BIT) != 0).astype(np.float64)
+    return ts, cols
+
+def _load_csv(path):
+    """(ts_ms, columns) of a CSV log. It has no actuator states, so heater duty is NaN."""
+    with open(path) as f: next(f, None); rows = [line.rstrip("\r\n").split(",") for line in f if line.strip()]
+    if not rows: return np.empty(0, np.int64), {name: np.empty(0) for name in ("t1", "t2", "od", "heater")}
+    rows = np.array([(r + [""] * 6)[:6] for r in rows])
+    ts = rows[:, 0].astype("datetime64[ms]").astype(np.int64)
+    def column(i):
+        raw = rows[:, i]; missing = (raw == "") | (raw == "None")
+        return np.where(missing, "nan", raw).astype(np.float64)
+    return ts, {"t1": column(1), "t2": column(2), "od": column(5), "heater": np.full(len(ts), np.nan)}
+
+def _od_trend(ts, od):
+    """Count, first/last reading and the slope of ln(OD) per hour (None with fewer than 2 readings)."""
+    keep = ~np.isnan(od) & (od > 0); ts, od = ts[keep], od[keep]
+    out = {"od_readings": int(len(od)), "od_first": None, "od_last": None, "od_growth_per_h": None}
+    if not len(od): return out
+    out["od_first"] = round(float(od[0]), 4); out["od_last"] = round(float(od[-1]), 4)
+    if len(od) >= 2 and ts[-1] > ts[0]:
+        out["od_growth_per_h"] = round(float(np.polyfit((ts - ts[0]) / 3.6e6, np.log(od), 1)[0]), 4)
+    return out
+
+def _summarize(ts, cols, start_ms, end_ms, gap_ms):
+    """Aggregates of the samples in [start_ms, end_ms); ts is sorted."""
+    i0, i1 = np.searchsorted(ts, [start_ms, end_ms]); ts = ts[i0:i1]
+    out = {"samples": int(len(ts))}
+    for name in ("t1", "t2"):
+        v = cols[name][i0:i1]; v = v[~np.isnan(v)]
+        out.update({f"{name}_mean": round(float(v.mean()), 3) if len(v) else None,
+                    f"{name}_min": round(float(v.min()), 2) if len(v) else None,
+                    f"{name}_max": round(float(v.max()), 2) if len(v) else None})
+    # Heater duty is weighted by how long each state lasted, up to the gap threshold.
+    heater = cols["heater"][i0:i1]
+    if len(ts) >= 2 and not np.isnan(heater).all():
+        dt = np.minimum(np.diff(ts), gap_ms).astype(np.float64)
+        out["heater_duty"] = round(float((heater[:-1] * dt).sum() / dt.sum()), 4) if dt.sum() else None
+    else: out["heater_duty"] = None
+    out.update(_od_trend(ts, cols["od"][i0:i1]))
+    # Gaps: silences longer than gap_ms, including the ends of the window.
+    edges = np.concatenate([[start_ms], ts, [end_ms]]) if len(ts) else np.array([start_ms, end_ms])
+    silent = np.diff(edges); gaps = silent > gap_ms
+    out["gaps"] = int(gaps.sum()); out["gap_minutes"] = round(float(silent[gaps].sum()) / 60000, 1)
+    return out
+
+def analyze_file(path, gap_s):
+    """Summary of one day file, with one entry per hour of the (local) day. Runs in a worker process."""
+    path = pathlib.Path(path); day = datetime.date.fromisoformat(path.stem)
+    ts, cols = load_binary_log(path) if path.suffix == ".bin" else _load_csv(path)
+    order = np.argsort(ts, kind="stable")
+    if len(ts) and np.any(order != np.arange(len(ts))): ts = ts[order]; cols = {k: v[order] for k, v in cols.items()}
+    day_start = int(datetime.datetime.combine(day, datetime.time()).timestamp() * 1000)
+    day_end = int(datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time()).timestamp() * 1000)
+    gap_ms = gap_s * 1000
+    hourly = []
+    for start in range(day_start, day_end, 3_600_000):
+        hour = _summarize(ts, cols, start, min(start + 3_600_000, day_end), gap_ms)
+        if hour["samples"]: hourly.append({"hour": datetime.datetime.fromtimestamp(start / 1000).strftime("%H:00"), **hour})
+    return {"day": day.isoformat(), "file": path.name, **_summarize(ts, cols, day_start, day_end, gap_ms), "hourly": hourly}
+
+def day_files(log_dir, first=None, last=None):
+    """{day: path} of every daily log; a binary log wins over the CSV of the same day (it has the heater state)."""
+    days = {}
+    for path in sorted(log_dir.glob("*.csv")) + sorted(log_dir.glob("*.bin")):
+        try: day = datetime.date.fromisoformat(path.stem)
+        except ValueError: continue
+        if (first is None or day >= first) and (last is None or day <= last): days[day] = path
+    return dict(sorted(days.items()))
+
+def analyze(log_dir, first=None, last=None, gap_s=60, workers=None, use_cache=True):
+    """Summaries of every day in log_dir, oldest first; files whose size and mtime are unchanged
+    since the last run come from the cache."""
+    files = day_files(log_dir, first, last)
+    cache_path = log_dir / CACHE_NAME; cache = {}
+    if use_cache:
+        try:
+            with open(cache_path) as f: cache = json.load(f)
+            if cache.get("version") != CACHE_VERSION or cache.get("gap_s") != gap_s: cache = {}
+        except (OSError, ValueError): cache = {}
+    entries = cache.get("files", {})
+    results = {}; todo = []
+    for day, path in files.items():
+        stat = path.stat(); key = [stat.st_size, stat.st_mtime_ns]
+        entry = entries.get(path.name)
+        if entry and entry["key"] == key: results[day] = entry["summary"]
+        else: todo.append((day, path, key))
+    if todo:
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            futures = {pool.submit(analyze_file, str(path), gap_s): (day, path, key) for day, path, key in todo}
+            for fut in concurrent.futures.as_completed(futures):
+                day, path, key = futures[fut]
+                try: results[day] = fut.result()
+                except Exception as e: print(f"{path}: {e!r}", file=sys.stderr); continue
+                entries[path.name] = {"key": key, "summary": results[day]}
+        if use_cache:
+            tmp = cache_path.with_name(CACHE_NAME + ".tmp")
+            try:
+                with open(tmp, "w") as f: json.dump({"version": CACHE_VERSION, "gap_s": gap_s, "files": entries}, f)
+                os.replace(tmp, cache_path)
+            except OSError as e: print(f"Could not write {cache_path}: {e}", file=sys.stderr)
+    return [results[day] for day in sorted(results)], len(todo)
+
+COLUMNS = ("samples", "t1_mean", "t1_min", "t1_max", "t2_mean", "t2_min", "t2_max", "heater_duty",
+           "od_readings", "od_first", "od_last", "od_growth_per_h", "gaps", "gap_minutes")
+
+def _fmt(v): return "--" if v is None else f"{v:g}" if isinstance(v, float) else str(v)
+
+def print_table(days, hourly):
+    shown = ("samples", "t1_mean", "t1_min", "t1_max", "heater_duty", "od_last", "od_growth_per_h", "gaps", "gap_minutes")
+    print(f"{'day':16}" + "".join(f"{c:>16}" for c in shown))
+    for d in days:
+        print(f"{d['day']:16}" + "".join(f"{_fmt(d[c]):>16}" for c in shown))
+        if hourly:
+            for h in d["hourly"]: print(f"  {h['hour']:14}" + "".join(f"{_fmt(h[c]):>16}" for c in shown))
+
+def write_csv(days, path, hourly):
+    with open(path, "w", newline="") as f:
+        w = csv.writer(f); w.writerow(["day", "hour", *COLUMNS])
+        for d in days:
+            rows = [(h["hour"], h) for h in d["hourly"]] if hourly else [("", d)]
+            for hour, r in rows: w.writerow([d["day"], hour, *("" if r[c] is None else r[c] for c in COLUMNS)])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("log_dir", nargs="?", default=str(LOG_DIR))
+    parser.add_argument("--from", dest="first", type=datetime.date.fromisoformat, help="first day, YYYY-MM-DD")
+    parser.add_argument("--to", dest="last", type=datetime.date.fromisoformat, help="last day, YYYY-MM-DD")
+    parser.add_argument("--hourly", action="store_true", help="also show (or write) one row per hour")
+    parser.add_argument("--gap", type=float, default=60, help="seconds without a sample that count as a gap")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--csv", help="write the summaries to this CSV file")
+    parser.add_argument("--json", help="write the summaries to this JSON file")
+    args = parser.parse_args()
+
+    log_dir = pathlib.Path(args.log_dir)
+    if not log_dir.is_dir(): sys.exit(f"{log_dir}: no such directory")
+    days, analysed = analyze(log_dir, args.first, args.last, args.gap, args.workers, not args.no_cache)
+    if not days: sys.exit(f"{log_dir}: no daily logs")
+    print_table(days, args.hourly)
+    print(f"{len(days)} days, {analysed} analysed, {len(days) - analysed} from cache.", file=sys.stderr)
+    if args.csv: write_csv(days, args.csv, args.hourly)
+    if args.json:
+        with open(args.json, "w") as f: json.dump(days, f, indent=1)
+
+if __name__ == "__main__":
+    main()
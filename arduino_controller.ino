@@ -1,109 +1,212 @@
 /*
  * Bio‑reactor control firmware
- * – 2 × DS18B20 on 1‑Wire bus (pin 8)  → t1 / t2
- * – 2 × photodiodes on A0 / A1        → l1 / l2
- * – 4 × relays (heater, stir, lights, aerator)
- * – 2 × pumps, 1 × IR LED
- * JSON over Serial @115 200 baud
+ * – 2 × DS18B20 on 1‑Wire bus (pin 8)  → t1 / t2
+ * – 2 × photodiodes on A0 / A1        → l1 / l2
+ * – 4 × relays (heater, stir, lights, aerator)
+ * – 2 × pumps, 1 × IR LED
+ * JSON over Serial @115 200 baud; the Pi can switch the link to compact
+ * binary frames with {"cmd":"proto","mode":"bin","hz":N} (see protocol.py).
+ * {"cmd":"burst","samples":N,"interval_ms":M} (or a BURST frame) sends the next
+ * N samples every M ms, for OD measurements.
  *
- * Wire both DS18B20 data pins to D8 with a 4.7 kΩ pull‑up to 5 V (or 3 V).
+ * Wire both DS18B20 data pins to D8 with a 4.7 kΩ pull‑up to 5 V (or 3 V).
  */
 
  #include <ArduinoJson.h>
  #include <OneWire.h>
  #include <DallasTemperature.h>
- 
+
  /* ── pin map ───────────────────────────────────────── */
  const uint8_t ONE_WIRE_PIN = 8;     // DS18B20 data (shared bus)
  const uint8_t PUMP1_IN1    = 2;
  const uint8_t PUMP1_IN2    = 3;
  const uint8_t PUMP2_IN1    = 4;
  const uint8_t PUMP2_IN2    = 5;
- 
+
  // relays (active‑low)
  const uint8_t RELAY_HEATER  = 10;   // R1
  const uint8_t RELAY_STIR    = 11;   // R2
  const uint8_t RELAY_LIGHTS  = 12;   // R3
  const uint8_t RELAY_AERATOR = 13;   // R4
- 
+
  const uint8_t IR_LED_PIN  = A2;
  const uint8_t PHOTO1_PIN  = A0;
  const uint8_t PHOTO2_PIN  = A1;
- 
+
  /* ── DS18B20 setup ────────────────────────────────── */
  OneWire        oneWire(ONE_WIRE_PIN);
  DallasTemperature sensors(&oneWire);
- 
+ const unsigned long TEMP_CONVERSION_MS = 750;   // 12‑bit conversion time
+
  /* ── state ─────────────────────────────────────────── */
  bool heater=false, aerator=false, lights=false, stir=false;
  bool pump1=false,  pump2=false,   irled=false;
- 
+ // bit order of the actuator byte in binary frames (protocol.ACTUATORS)
+ bool* const ACTUATOR_STATE[] = { &heater, &stir, &lights, &aerator, &pump1, &pump2, &irled };
+ const uint8_t N_ACTUATORS = sizeof(ACTUATOR_STATE) / sizeof(ACTUATOR_STATE[0]);
+
+ float t1 = NAN, t2 = NAN;
+ unsigned long lastConversion = 0, lastSample = 0;
+ unsigned long samplePeriodMs = 200;             // 5 Hz on JSON
+ uint16_t burstLeft = 0;                         // samples still to send at burstPeriodMs
+ unsigned long burstPeriodMs = 50;
+
+ /* ── serial link ───────────────────────────────────── */
+ enum LinkMode { LINK_JSON, LINK_BINARY };
+ LinkMode linkMode = LINK_JSON;
+ const uint8_t FRAME_SENSOR = 0x01, FRAME_SET = 0x02, FRAME_BURST = 0x03;
+ const int16_t TEMP_MISSING = -32768;
+ uint16_t txSeq = 0;
+ char rxBuf[128];
+ uint8_t rxLen = 0;
+
  void setup() {
    /* outputs */
    pinMode(RELAY_HEATER,  OUTPUT);
    pinMode(RELAY_STIR,    OUTPUT);
    pinMode(RELAY_LIGHTS,  OUTPUT);
    pinMode(RELAY_AERATOR, OUTPUT);
- 
+
    pinMode(PUMP1_IN1, OUTPUT);  pinMode(PUMP1_IN2, OUTPUT);
    pinMode(PUMP2_IN1, OUTPUT);  pinMode(PUMP2_IN2, OUTPUT);
    pinMode(IR_LED_PIN, OUTPUT);
- 
+
    /* default OFF (relays are active‑LOW) */
    digitalWrite(RELAY_HEATER,  HIGH);
    digitalWrite(RELAY_STIR,    HIGH);
    digitalWrite(RELAY_LIGHTS,  HIGH);
    digitalWrite(RELAY_AERATOR, HIGH);
    digitalWrite(IR_LED_PIN,    LOW);
- 
+
    /* sensors */
    sensors.begin();            // start DS18B20 bus
+   sensors.setWaitForConversion(false);   // requestTemperatures() returns at once
+   sensors.requestTemperatures();
+   lastConversion = millis();
    Serial.begin(115200);
  }
- 
+
  inline void setRelay(uint8_t pin, bool on)  { digitalWrite(pin, on ? LOW : HIGH); }
  inline void setPump (uint8_t in1,uint8_t in2,bool on){ digitalWrite(in1,on); digitalWrite(in2,LOW); }
- 
- void loop() {
-   /* ── inbound commands ── */
-   if (Serial.available()) {
-     StaticJsonDocument<128> doc;
-     if (!deserializeJson(doc, Serial) && doc["cmd"] == "set") {
-       if (doc.containsKey("heater"))  heater  = doc["heater"];
-       if (doc.containsKey("stir"))    stir    = doc["stir"];
-       if (doc.containsKey("lights"))  lights  = doc["lights"];
-       if (doc.containsKey("aerator")) aerator = doc["aerator"];
-       if (doc.containsKey("pump1"))   pump1   = doc["pump1"];
-       if (doc.containsKey("pump2"))   pump2   = doc["pump2"];
-       if (doc.containsKey("irled"))   irled   = doc["irled"];
-     }
+
+ /* ── framing: CRC16‑CCITT (init 0xFFFF) + COBS, 0x00 terminated ── */
+ uint16_t crc16(const uint8_t* data, uint8_t len) {
+   uint16_t crc = 0xFFFF;
+   while (len--) {
+     crc ^= (uint16_t)(*data++) << 8;
+     for (uint8_t i = 0; i < 8; i++) crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
    }
- 
-   /* ── apply outputs ── */
-   setRelay(RELAY_HEATER,  heater);
-   setRelay(RELAY_STIR,    stir);
-   setRelay(RELAY_LIGHTS,  lights);
-   setRelay(RELAY_AERATOR, aerator);
-   setPump (PUMP1_IN1, PUMP1_IN2, pump1);
-   setPump (PUMP2_IN1, PUMP2_IN2, pump2);
-   digitalWrite(IR_LED_PIN, irled);
- 
-   /* ── read sensors ── */
-   sensors.requestTemperatures();           // non‑blocking for small sensor count
-   float t1 = sensors.getTempCByIndex(0);
-   float t2 = sensors.getTempCByIndex(1);
- 
-   int l1 = analogRead(PHOTO1_PIN);
-   int l2 = analogRead(PHOTO2_PIN);
- 
-   /* ── JSON back to Pi ── */
-   StaticJsonDocument<128> out;
-   if (isnan(t1)) out["t1"] = nullptr;
-else           out["t1"] = t1;
+   return crc;
+ }
+
+ uint8_t cobsEncode(const uint8_t* in, uint8_t len, uint8_t* out) {
+   uint8_t codeIdx = 0, code = 1, o = 1;
+   for (uint8_t i = 0; i < len; i++) {
+     if (in[i]) { out[o++] = in[i]; code++; }
+     else       { out[codeIdx] = code; codeIdx = o++; code = 1; }
+   }
+   out[codeIdx] = code;
+   return o;
+ }
+
+ // returns the decoded length, or 0 if the frame is malformed
+ uint8_t cobsDecode(const uint8_t* in, uint8_t len, uint8_t* out) {
+   uint8_t i = 0, o = 0;
+   while (i < len) {
+     uint8_t code = in[i++];
+     if (code == 0 || i + code - 1 > len) return 0;
+     for (uint8_t k = 1; k < code; k++) out[o++] = in[i++];
+     if (code < 0xFF && i < len) out[o++] = 0;
+   }
+   return o;
+ }
+
+ void sendFrame(uint8_t* payload, uint8_t len) {
+   uint16_t crc = crc16(payload, len);
+   payload[len++] = crc & 0xFF;  payload[len++] = crc >> 8;
+   uint8_t encoded[32];
+   uint8_t n = cobsEncode(payload, len, encoded);
+   encoded[n++] = 0;
+   Serial.write(encoded, n);
+ }
 
-if (isnan(t2)) out["t2"] = nullptr;
-else           out["t2"] = t2;
+ void putU16(uint8_t* p, uint16_t v) { p[0] = v & 0xFF; p[1] = v >> 8; }
 
+ uint8_t actuatorBits() {
+   uint8_t bits = 0;
+   for (uint8_t i = 0; i < N_ACTUATORS; i++) if (*ACTUATOR_STATE[i]) bits |= 1 << i;
+   return bits;
+ }
+
+ void startBurst(uint16_t samples, unsigned long periodMs) {
+   burstLeft = samples;
+   burstPeriodMs = constrain(periodMs, 5UL, 1000UL);
+   lastSample = millis() - burstPeriodMs;      // first sample right away
+ }
+
+ void handleFrame(uint8_t* frame, uint8_t len) {
+   uint8_t body[sizeof(rxBuf)];
+   uint8_t n = cobsDecode(frame, len, body);
+   if (n < 3 || crc16(body, n - 2) != (body[n - 2] | (uint16_t)body[n - 1] << 8)) return;
+   if (body[0] == FRAME_SET && n - 2 == 5) {            // type, seq(2), mask, values
+     uint8_t mask = body[3], values = body[4];
+     for (uint8_t i = 0; i < N_ACTUATORS; i++) if (mask & (1 << i)) *ACTUATOR_STATE[i] = values & (1 << i);
+   } else if (body[0] == FRAME_BURST && n - 2 == 7) {   // type, seq(2), samples(2), interval ms(2)
+     startBurst(body[3] | (uint16_t)body[4] << 8, body[5] | (uint16_t)body[6] << 8);
+   }
+ }
+
+ void handleJsonLine(const char* line) {
+   StaticJsonDocument<128> doc;
+   if (deserializeJson(doc, line)) return;
+   if (doc["cmd"] == "set") {
+     if (doc.containsKey("heater"))  heater  = doc["heater"];
+     if (doc.containsKey("stir"))    stir    = doc["stir"];
+     if (doc.containsKey("lights"))  lights  = doc["lights"];
+     if (doc.containsKey("aerator")) aerator = doc["aerator"];
+     if (doc.containsKey("pump1"))   pump1   = doc["pump1"];
+     if (doc.containsKey("pump2"))   pump2   = doc["pump2"];
+     if (doc.containsKey("irled"))   irled   = doc["irled"];
+   } else if (doc["cmd"] == "proto" && doc["mode"] == "bin") {
+     Serial.println("{\"proto\":\"bin\"}");     // ack goes out as the last JSON line
+     linkMode = LINK_BINARY;  txSeq = 0;
+     samplePeriodMs = 1000 / constrain((int)(doc["hz"] | 10), 1, 50);
+   } else if (doc["cmd"] == "burst") {
+     startBurst(doc["samples"] | 0, doc["interval_ms"] | 50);
+   }
+ }
+
+ void readSerial() {
+   while (Serial.available()) {
+     char c = Serial.read();
+     char end = linkMode == LINK_BINARY ? '\0' : '\n';
+     if (c == end) {
+       if (linkMode == LINK_BINARY) handleFrame((uint8_t*)rxBuf, rxLen);
+       else { rxBuf[rxLen] = '\0'; handleJsonLine(rxBuf); }
+       rxLen = 0;
+     } else if (rxLen < sizeof(rxBuf) - 1) rxBuf[rxLen++] = c;
+     else rxLen = 0;                           // overlong: drop it and resync on the next delimiter
+   }
+ }
+
+ void sendBinaryPacket(int l1, int l2) {
+   uint8_t p[14];                              // type, seq, t1, t2, l1, l2, actuators + room for the CRC
+   p[0] = FRAME_SENSOR;
+   putU16(p + 1, txSeq++);
+   putU16(p + 3, isnan(t1) ? TEMP_MISSING : (int16_t)lround(t1 * 100));
+   putU16(p + 5, isnan(t2) ? TEMP_MISSING : (int16_t)lround(t2 * 100));
+   putU16(p + 7, l1);
+   putU16(p + 9, l2);
+   p[11] = actuatorBits();
+   sendFrame(p, 12);
+ }
+
+ void sendJsonPacket(int l1, int l2) {
+   StaticJsonDocument<128> out;
+   if (isnan(t1)) out["t1"] = nullptr;
+   else           out["t1"] = t1;
+   if (isnan(t2)) out["t2"] = nullptr;
+   else           out["t2"] = t2;
    out["l1"]      = l1;
    out["l2"]      = l2;
    out["heater"]  = heater;
@@ -113,10 +216,38 @@ else           out["t2"] = t2;
    out["pump1"]   = pump1;
    out["pump2"]   = pump2;
    out["irled"]   = irled;
- 
    serializeJson(out, Serial);
    Serial.println();
- 
-   delay(200);      // 5 Hz update rate
  }
- 
\ No newline at end of file
+
+ void loop() {
+   /* ── inbound commands ── */
+   readSerial();
+
+   /* ── apply outputs ── */
+   setRelay(RELAY_HEATER,  heater);
+   setRelay(RELAY_STIR,    stir);
+   setRelay(RELAY_LIGHTS,  lights);
+   setRelay(RELAY_AERATOR, aerator);
+   setPump (PUMP1_IN1, PUMP1_IN2, pump1);
+   setPump (PUMP2_IN1, PUMP2_IN2, pump2);
+   digitalWrite(IR_LED_PIN, irled);
+
+   /* ── temperatures: collect the finished conversion and start the next one ── */
+   unsigned long now = millis();
+   if (now - lastConversion >= TEMP_CONVERSION_MS) {
+     t1 = sensors.getTempCByIndex(0);
+     t2 = sensors.getTempCByIndex(1);
+     sensors.requestTemperatures();
+     lastConversion = now;
+   }
+
+   /* ── report at the negotiated rate, or faster during a burst ── */
+   if (now - lastSample < (burstLeft ? burstPeriodMs : samplePeriodMs)) return;
+   lastSample = now;
+   if (burstLeft) burstLeft--;
+   int l1 = analogRead(PHOTO1_PIN);
+   int l2 = analogRead(PHOTO2_PIN);
+   if (linkMode == LINK_BINARY) sendBinaryPacket(l1, l2);
+   else                         sendJsonPacket(l1, l2);
+ }
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# asgi_app.py
+"""The dashboard of pi_controller.py as an asyncio (ASGI) app, for serving many viewers at once:
+/stream clients wait on the broadcast hub without a thread each, and nothing sleeps in a request.
+Same routes and template as pi_controller.py; needs Quart and an ASGI server:
+
+    pip install quart hypercorn
+    python asgi_app.py                 # or: hypercorn --bind 0.0.0.0:5000 asgi_app:app
+"""
+
+import asyncio
+import datetime
+
+from quart import (
+    Quart, Response, request, redirect, abort,
+    url_for, render_template, send_file
+)
+from fleet import start_controllers
+from history_query import history_response
+from metrics import render as render_metrics
+
+app = Quart(__name__)
+controllers = {}  # reactor id -> BioreactorController, filled in before serving
+
+@app.before_serving
+async def startup():
+    if not controllers: controllers.update(start_controllers())
+
+def get_controller(reactor_id):
+    """Routes without a reactor id address the first configured reactor."""
+    if reactor_id is None: reactor_id = next(iter(controllers))
+    if reactor_id not in controllers: abort(404)
+    return controllers[reactor_id]
+
+@app.route('/', defaults={'reactor_id': None})
+@app.route('/r/<reactor_id>/')
+async def index(reactor_id):
+    controller = get_controller(reactor_id)
+    return await render_template('index.html', setpoints=controller.state.current.setpoints,
+                                 reactor_id=reactor_id, current_reactor=controller.reactor_id, reactors=list(controllers))
+
+@app.route('/history', defaults={'reactor_id': None})
+@app.route('/r/<reactor_id>/history')
+async def history(reactor_id):
+    """See history_query.history_response; runs in a worker thread."""
+    controller = get_controller(reactor_id)
+    try: status, body, headers = await asyncio.to_thread(history_response, controller, request.args, request.headers)
+    except ValueError: abort(400)
+    return Response(body, status, headers)
+
+@app.route('/toggle', methods=['POST'], defaults={'reactor_id': None})
+@app.route('/r/<reactor_id>/toggle', methods=['POST'])
+async def toggle(reactor_id):
+    controller = get_controller(reactor_id)
+    actuator = (await request.form)['act']
+    new_state = 0 if controller.state.current.readings.get(actuator, 0) else 1
+    await asyncio.to_thread(controller.set_manual_override, actuator, new_state)
+    return redirect(url_for('index', reactor_id=reactor_id))
+
+@app.route('/set_automation', methods=['POST'], defaults={'reactor_id': None})
+@app.route('/r/<reactor_id>/set_automation', methods=['POST'])
+async def set_automation(reactor_id):
+    controller = get_controller(reactor_id); form = await request.form
+    def apply():
+        controller.set_temperature_setpoint(form.get('temp_setpoint'))
+        controller.set_light_cycle(form.get('light_cycle_hours'))
+        controller.set_dilution_rate(form.get('dilution_percent'))
+        controller.set_od_interval(form.get('od_interval_hours'))
+        controller.set_aerator_interval(form.get('aerator_interval_hours'))
+        controller.set_target_od(form.get('target_od'))
+        controller.resume_all_automation()
+    await asyncio.to_thread(apply)
+    return redirect(url_for('index', reactor_id=reactor_id))
+
+@app.route('/trigger_od', methods=['POST'], defaults={'reactor_id': None})
+@app.route('/r/<reactor_id>/trigger_od', methods=['POST'])
+async def trigger_od(reactor_id):
+    get_controller(reactor_id).trigger_od_reading_sequence()
+    return redirect(url_for('index', reactor_id=reactor_id))
+
+@app.route('/stream', defaults={'reactor_id': None})
+@app.route('/r/<reactor_id>/stream')
+async def stream(reactor_id):
+    """Server-Sent Events, as in pi_controller.stream."""
+    frames = get_controller(reactor_id).hub.subscribe_async(request.headers.get('Last-Event-ID'), delta=request.args.get('delta') == '1')
+    response = Response(frames, mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+    response.timeout = None  # open for as long as the client stays
+    return response
+
+@app.route('/metrics')
+async def metrics():
+    return Response(render_metrics(controllers), mimetype='text/plain; version=0.0.4')
+
+@app.route('/download', defaults={'reactor_id': None})
+@app.route('/r/<reactor_id>/download')
+async def download(reactor_id):
+    csv_path = get_controller(reactor_id).log_dir / f"{datetime.date.today()}.csv"
+    if csv_path.exists():
+        return await send_file(csv_path, as_attachment=True)
+    return "Log file not found for today.", 404
+
+if __name__ == '__main__':
+    print(f"Dashboard -> http://0.0.0.0:5000")
+    app.run(host='0.0.0.0', port=5000)
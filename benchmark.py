@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# benchmark.py
+"""End-to-end benchmarks of the controller, the serial link and the web app against the simulator.
+Results are written as JSON so runs can be compared between commits:
+
+    python benchmark.py --out before.json
+    python benchmark.py --out after.json --compare before.json
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import pathlib
+import tempfile
+import argparse
+import datetime
+import platform
+import threading
+import subprocess
+import importlib.util
+
+import numpy as np
+import protocol
+import bioreactor_controller
+from sim_engine import SimEngine
+from serial_io import SerialLink
+from log_writer import LogWriter
+from history_query import LogIndex
+from history_store import HistoryStore
+from config import HISTORY_SERIES
+from broadcast import BroadcastHub
+
+class _BufferTransport:
+    def __init__(self, data): self.data = memoryview(data); self.pos = 0
+    def readinto(self, buf):
+        n = min(len(buf), len(self.data) - self.pos)
+        buf[:n] = self.data[self.pos:self.pos + n]; self.pos += n
+        return n
+    def write(self, data): pass
+    def close(self): pass
+
+def _percentiles(values):
+    values = np.asarray(values, dtype=np.float64) * 1000
+    if not len(values): return None
+    return {"n": len(values), "p50_ms": round(float(np.percentile(values, 50)), 3),
+            "p95_ms": round(float(np.percentile(values, 95)), 3), "max_ms": round(float(values.max()), 3)}
+
+def bench_parsing(n):
+    """Packets/s the serial link decodes and dispatches, for each protocol."""
+    states = {"heater": 1, "lights": 1}
+    encoded = {
+        "json": b"".join((json.dumps({"t1": 25.12, "t2": 30.5, "l1": None, "l2": None, **states}) + "\n").encode() for _ in range(n)),
+        "binary": b"".join(protocol.encode_sensor(i, 25.12, 30.5, None, None, states) for i in range(n)),
+    }
+    results = {}
+    for mode, data in encoded.items():
+        link = SerialLink(None, transport=_BufferTransport(data), trace_dir=None)
+        link.binary = mode == "binary"; count = [0]
+        link.subscribe(lambda pkt: count.__setitem__(0, count[0] + 1))
+        started = time.perf_counter(); link.poll(); elapsed = time.perf_counter() - started
+        assert count[0] == n, f"{mode}: parsed {count[0]} of {n} packets"
+        results[mode] = {"packets_per_s": round(n / elapsed), "bytes_per_packet": round(len(data) / n, 1)}
+    return results
+
+def bench_live_rate(ctl, seconds):
+    """Packets/s the controller actually receives from the simulator."""
+    start = ctl.link_stats['packets']; time.sleep(seconds)
+    return {"packets_per_s": round((ctl.link_stats['packets'] - start) / seconds, 2), "binary_link": ctl.binary_link}
+
+def bench_command_latency(ctl, engine, n):
+    """Time from _set_actuator() enqueueing a command to the simulated board applying it."""
+    device = engine.devices[0]; received = queue.Queue(); apply = device._apply
+    def timed_apply(changes):
+        apply(changes)
+        if "stir" in changes: received.put(time.perf_counter())
+    device._apply = timed_apply
+    latencies = []
+    try:
+        for i in range(n):
+            sent = time.perf_counter(); ctl._set_actuator("stir", (i + 1) % 2)
+            try: latencies.append(received.get(timeout=5) - sent)
+            except queue.Empty: pass
+            time.sleep(0.02)
+    finally: device._apply = apply; ctl._set_actuator("stir", 0)
+    return {**_percentiles(latencies), "lost": n - len(latencies)}
+
+def bench_od_sequence(ctl):
+    started = time.perf_counter(); ctl.trigger_od_reading_sequence().wait()
+    return {"wall_s": round(time.perf_counter() - started, 3), "od": ctl.latest_readings['od'],
+            "stir_s": bioreactor_controller.OD_STIR_DURATION, "settle_s": bioreactor_controller.OD_SETTLE_DURATION}
+
+def _fill_logs(log_dir, hours):
+    """hours of 1 Hz samples ending now, written through the regular log writer."""
+    log_dir.mkdir(parents=True, exist_ok=True)
+    writer = LogWriter(flush_interval=0); writer.start()
+    now_ms = int(time.time() * 1000); n = hours * 3600
+    for i in range(n):
+        ts = now_ms - (n - i) * 1000
+        writer.log(log_dir, (ts, 25 + np.sin(i / 600), 30.0, None, None, 0.1 + i / n if i % 600 == 0 else None, 0))
+    writer.close()
+    return now_ms
+
+def bench_history(client, ctl, log_dir, hours, repeat=5):
+    # The synthetic logs get their own directory; the controller keeps logging into its own.
+    now_ms = _fill_logs(log_dir, hours); ctl.log_index = LogIndex(log_dir)
+    ctl.history = HistoryStore(HISTORY_SERIES)  # the live samples are newer than the synthetic ones
+    for i in range(hours * 3600):
+        ts = now_ms - (hours * 3600 - i) * 1000
+        ctl.history.append('t1', ts, 25.0); ctl.history.append('t2', ts, 30.0)
+    base = f"/r/{ctl.reactor_id}/history"
+    urls = {"session": base,
+            f"range_{hours}h": f"{base}?series=t1,t2,od&from={now_ms - hours * 3_600_000}&to={now_ms}"}
+    results = {}
+    for name, url in urls.items():
+        times = []
+        for _ in range(repeat):
+            started = time.perf_counter(); response = client.get(url); times.append(time.perf_counter() - started)
+            assert response.status_code == 200, f"{url}: {response.status_code}"
+        points = sum(len(series) for series in json.loads(response.data).values())
+        assert points, f"{url}: the response holds no points, so its timings would measure nothing"
+        results[name] = {**_percentiles(times), "bytes": len(response.data), "points": points}
+    return results
+
+def bench_stream(client_counts, updates):
+    """CPU time per published update with n clients consuming /stream frames."""
+    results = {}
+    for n in client_counts:
+        hub = BroadcastHub(heartbeat=60); done = threading.Barrier(n + 1); last = updates
+        def consume():
+            for frame in hub.subscribe(delta=True):
+                if f"id: {last}\n".encode() in frame: break
+            done.wait()
+        threads = [threading.Thread(target=consume, daemon=True) for _ in range(n)]
+        for t in threads: t.start()
+        while hub.subscribers < n: time.sleep(0.01)
+        cpu = time.process_time(); started = time.perf_counter()
+        for i in range(1, updates + 1):
+            hub.publish({"t1": 25 + i / 1000, "t2": 30.0, "od": None, "script_uptime": f"{i}s"})
+            time.sleep(0.001)
+        done.wait(timeout=60)
+        results[f"{n}_clients"] = {"cpu_ms_per_update": round((time.process_time() - cpu) * 1000 / updates, 3),
+                                   "wall_s": round(time.perf_counter() - started, 3)}
+    return results
+
+def load_web_app(controllers):
+    """The Flask dashboard serving only the given controllers; pi_controller.py starts none of its own."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), " pi_controller.py")
+    spec = importlib.util.spec_from_file_location("pi_controller", path)
+    module = importlib.util.module_from_spec(spec); sys.modules["pi_controller"] = module; spec.loader.exec_module(module)
+    return module.create_app(controllers)
+
+def _git_commit():
+    try: return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError: return None
+
+def _flatten(results, prefix=""):
+    for key, value in results.items():
+        if isinstance(value, dict): yield from _flatten(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool): yield f"{prefix}{key}", value
+
+def compare(old, new):
+    old = dict(_flatten(old["results"])); print(f"{'metric':55} {'before':>12} {'after':>12}")
+    for key, value in _flatten(new["results"]):
+        if key not in old: continue
+        change = f"{(value - old[key]) / old[key]:+.1%}" if old[key] else ""
+        print(f"{key:55} {old[key]:>12} {value:>12} {change}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="benchmark.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--quick", action="store_true", help="1 s OD stir/settle and smaller workloads")
+    args = parser.parse_args()
+    if args.quick: bioreactor_controller.OD_STIR_DURATION = bioreactor_controller.OD_SETTLE_DURATION = 1
+
+    results = {"parsing": bench_parsing(20_000 if args.quick else 200_000)}
+    engine = SimEngine(1); engine.start()
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = pathlib.Path(tmp)
+        ctl = bioreactor_controller.BioreactorController("bench", port=engine.ports[0], log_dir=tmp / "live", trace_dir=None)
+        ctl.start(); time.sleep(2 * bioreactor_controller.SERIAL_NEGOTIATE_INTERVAL_S)
+        client = load_web_app({"bench": ctl}).test_client()
+        results["live_link"] = bench_live_rate(ctl, 2 if args.quick else 5)
+        results["command_latency"] = bench_command_latency(ctl, engine, 20 if args.quick else 100)
+        results["od_sequence"] = bench_od_sequence(ctl)
+        results["history"] = bench_history(client, ctl, tmp / "synthetic", 6 if args.quick else 24)
+        ctl.log_writer.close()
+    results["stream"] = bench_stream((1, 10, 100), 100 if args.quick else 500)
+
+    report = {"commit": _git_commit(), "time": datetime.datetime.now().isoformat(timespec="seconds"),
+              "python": platform.python_version(), "machine": platform.machine(), "quick": args.quick, "results": results}
+    with open(args.out, "w") as f: json.dump(report, f, indent=2)
+    print(json.dumps(results, indent=2)); print(f"Results written to {args.out}")
+    if args.compare:
+        with open(args.compare) as f: compare(json.load(f), report)
+
+if __name__ == "__main__":
+    main()
@@ -6,11 +6,27 @@ import queue
 import datetime
 import threading
 import math
-import csv
 import pathlib
+import selectors
+import concurrent.futures
 
 import serial
 from config import *
+from serial_io import SerialLink
+from scheduler import DeadlineScheduler, Waker
+from history_store import HistoryStore
+from log_writer import LogWriter, sample_from_readings
+from history_query import LogIndex
+from broadcast import BroadcastHub
+from stats import Histogram
+from clock import SYSTEM_CLOCK
+from jobs import JobExecutor, WaitFor
+from snapshot import StateStore
+from growth import GrowthEstimator, turbidostat_fraction
+from versioned_state import VersionedState
+from thermal import HeaterController, load_model
+from od_burst import ODBurst, robust_od
+import protocol
 
 def _format_seconds_to_hm(seconds):
     if seconds is None or seconds < 0: return "--"
@@ -25,22 +41,40 @@ def _format_seconds_to_hms(seconds):
     return f"{hours}h {minutes}m {secs}s"
 
 class BioreactorController(threading.Thread):
-    def __init__(self):
-        super().__init__(daemon=True)
-        try:
-            self._serial_lock = threading.Lock()
-            self.ser = serial.Serial(SERIAL_PORT, BAUD, timeout=2)
+    def __init__(self, reactor_id="default", port=SERIAL_PORT, baud=BAUD, setpoints=None, log_dir=LOG_DIR,
+                 container_volume_l=CONTAINER_VOLUME_L, pump_flow_rate_ml_min=PUMP_FLOW_RATE_ML_MIN,
+                 dilutions_per_day=DILUTIONS_PER_DAY, history_series=HISTORY_SERIES,
+                 log_writer=None, clock=SYSTEM_CLOCK, transport=None, trace_dir=SERIAL_TRACE_DIR,
+                 snapshot_interval=SNAPSHOT_INTERVAL_S):
+        super().__init__(daemon=True, name=f"reactor-{reactor_id}")
+        self.reactor_id = reactor_id; self.clock = clock
+        try: self.link = SerialLink(port, baud, reactor_id, transport, clock, trace_dir)
         except serial.SerialException as e:
-            print(f"FATAL: Could not open serial port {SERIAL_PORT}: {e}"); exit(1)
-        
-        self.out_q = queue.Queue(); self._csv_lock = threading.Lock()
-        self.automation_lock = threading.Lock(); LOG_DIR.mkdir(exist_ok=True)
-
-        self.start_time_ts = time.time()
+            print(f"FATAL: Could not open serial port {port}: {e}"); exit(1)
+        self.link.subscribe(self._handle_packet); self.link.on_mode_change = self._on_link_mode_change
+        self.link_stats = self.link.stats; self.link_stats.update(command_retries=0, commands_unacked=0)
+        # JSON lines until the device accepts the binary protocol (see protocol.py).
+        self._tx_seq = 0; self._negotiate_attempts = 0; self._negotiating = SERIAL_PROTOCOL == "binary"
+        self._last_log_ms = 0
+
+        self.container_volume_l = container_volume_l
+        self.pump_flow_rate_ml_min = pump_flow_rate_ml_min
+        self.dilutions_per_day = dilutions_per_day
+
+        self.log_dir = pathlib.Path(log_dir); self.log_dir.mkdir(parents=True, exist_ok=True)
+        if log_writer is None: log_writer = LogWriter(); log_writer.start()
+        self.log_writer = log_writer; self.log_index = LogIndex(self.log_dir)
+        self.out_q = queue.Queue()
+        # Sent actuator changes awaiting their echo: name -> [value, first sent, last sent, retries]
+        self._unacked = {}; self._resend = {}
+        self.command_latency = {}  # name -> Histogram of the time from first send to echo
+        self.step_time = Histogram(Histogram.FAST_BOUNDS)  # wall time spent in step(), for /metrics
+
+        self.start_time_ts = self.clock.time()
         self.start_time_str = datetime.datetime.fromtimestamp(self.start_time_ts).strftime('%-I:%M%p')
 
-        self.HISTORY_MAX_LENGTH = 2000
-        self.history = { "t1": [], "t2": [], "od": [] }
+        self.history = HistoryStore(history_series); self.hub = BroadcastHub()
+        self.growth = GrowthEstimator()
 
         self.latest_readings = {
             "t1": None, "t2": None, "l1": None, "l2": None, "od": None,
@@ -48,57 +82,233 @@ class BioreactorController(threading.Thread):
             "pump1": 0, "pump2": 0, "irled": 0, "light_cycle_status": "--",
             "dilution_status": "--", "od_status": "--", "aerator_status": "--",
             "od_sequence_step": None, "last_od_reading_ago": "No measurements taken yet",
-            "script_start_time": self.start_time_str, "script_uptime": "0s"
+            "script_start_time": self.start_time_str, "script_uptime": "0s",
+            "growth_rate": None, "doubling_time": "--", "last_dilution_ml": None
         }
         self.setpoints = {
             'temperature': 25.0, 'light_cycle_hours': 12, 'dilution_percent': 15.0,
-            'od_interval_hours': 4.0, 'aerator_interval_hours': 2.0
+            'od_interval_hours': 4.0, 'aerator_interval_hours': 2.0,
+            'target_od': 0.0  # > 0: turbidostat, dilutions are sized to hold this OD instead of dilution_percent
         }
+        self.setpoints.update(setpoints or {})
         self.manual_overrides = {k: False for k in self.latest_readings}
-        now = time.time()
+        now = self.clock.time()
         self.schedule = {
             'light_cycle_start_time': now,
             'last_od_reading_timestamp': now,
             'last_aeration_timestamp': now,
             'last_dilution_time': now
         }
-
-    def _init_csv(self, path):
-        if not path.exists():
-            with path.open("w", newline="") as f:
-                csv.writer(f).writerow(["timestamp_utc", "t1", "t2", "l1", "l2", "od"])
+        # Work happens only when a deadline expires, serial data arrives or another thread wakes us.
+        self.scheduler = DeadlineScheduler(); self.waker = Waker()
+        self.jobs = JobExecutor(clock, self.waker.wake)  # automation sequences, one at a time
+        # The dicts above belong to the control thread; other threads hand it their changes through
+        # _calls (see _call) and read the immutable copy it publishes in `state` after every step.
+        self._calls = queue.SimpleQueue(); self._control_thread = None
+        self._timers = {
+            'light': self._on_light_timer, 'status': self._on_status_timer,
+            'dilution': self._handle_dilution_schedule, 'od': self._handle_od_schedule,
+            'aeration': self._handle_aerator_schedule, 'negotiate': self._on_negotiate_timer,
+            'jobs': lambda: None,  # the executor runs on every step anyway
+            'snapshot': self._on_snapshot_timer, 'thermal': self._on_thermal_timer
+        }
+        if SERIAL_PROTOCOL == "binary": self.scheduler.arm('negotiate', self.clock.time())
+        self._light_cycle_was_on = False; self._reschedule_requested = True
+        self._od_burst = None  # the ODBurst photodiode samples go to while an OD sequence measures
+        self.heater_control = None; self._thermal_model_mtime = None; self._on_thermal_timer()
+        # Setpoints, overrides, schedule and history are restored from the last snapshot and journal.
+        self.snapshot_interval = snapshot_interval
+        self.state_store = None
+        if snapshot_interval > 0:
+            self.state_store = StateStore(self.log_dir, {name: s.capacity for name, s in self.history.series.items()})
+            self._restore(); self.scheduler.arm('snapshot', now + snapshot_interval)
+        self._snapshot_appended = self.history.appended()  # history saved so far
+        self.state = VersionedState(**self._state_sections())
 
     def run(self):
         print("Bioreactor Controller thread started.")
+        sel = selectors.DefaultSelector()
+        sel.register(self.link.fileno(), selectors.EVENT_READ); sel.register(self.waker, selectors.EVENT_READ)
         while True:
-            with self._serial_lock: self._process_serial_inbound()
-            self._process_serial_outbound()
-            self._handle_temperature_control(); self._handle_light_cycle()
-            self._handle_dilution_schedule(); self._handle_od_schedule()
-            self._handle_aerator_schedule(); self._update_status_strings()
-            time.sleep(0.1)
+            sel.select(self.seconds_until_next_deadline())
+            self.step()
+
+    def step(self):
+        """Handles whatever is pending: inbound serial data, expired deadlines, automation jobs, then
+        the commands all of them queued. Called by run() or by a FleetManager whenever this reactor's
+        port or waker is readable or a deadline passes."""
+        started = time.perf_counter()
+        self.waker.drain(); self._control_thread = threading.get_ident()
+        self._run_calls()
+        self.link.poll()
+        if self._reschedule_requested: self._reschedule()
+        for name in self.scheduler.pop_due(self.clock.time()): self._timers[name]()
+        self.jobs.run(); self.scheduler.arm('jobs', self.jobs.next_deadline())
+        self._process_serial_outbound()
+        self.state.publish(**self._state_sections())
+        self.hub.publish(self.latest_readings)
+        self.step_time.observe(time.perf_counter() - started)
+
+    def _state_sections(self):
+        return dict(readings=self.latest_readings, setpoints=self.setpoints,
+                    manual_overrides=self.manual_overrides, schedule=self.schedule)
+
+    def _call(self, fn, *args):
+        """Runs fn(*args) on the control thread and returns its result, so the state dicts have a
+        single writer, and publishes the result before returning. Before the first step (or when
+        replaying) the caller's thread is the control thread."""
+        if self._control_thread in (None, threading.get_ident()):
+            result = fn(*args); self.state.publish(**self._state_sections()); return result
+        future = concurrent.futures.Future(); self._calls.put((future, fn, args)); self.waker.wake()
+        try: return future.result(CONTROL_CALL_TIMEOUT_S)
+        except concurrent.futures.TimeoutError:
+            print(f"Reactor {self.reactor_id}: control thread busy, {fn.__name__} will run when it catches up."); return None
+
+    def _run_calls(self):
+        while True:
+            try: future, fn, args = self._calls.get_nowait()
+            except queue.Empty: return
+            if not future.set_running_or_notify_cancel(): continue
+            try: result = fn(*args)
+            except Exception as e: future.set_exception(e); continue
+            self.state.publish(**self._state_sections()); future.set_result(result)
+
+    def seconds_until_next_deadline(self):
+        """Wall-clock seconds to wait for the next deadline (the clock may run faster, see clock.py)."""
+        deadline = self.scheduler.next_deadline()
+        return None if deadline is None else max(0.0, deadline - self.clock.time()) / self.clock.rate
+
+    def _request_reschedule(self):
+        # Deadlines are only touched on the control thread; other threads ask for a recompute.
+        self._reschedule_requested = True; self.waker.wake()
+
+    def _reschedule(self):
+        self._reschedule_requested = False
+        now = self.clock.time()
+        self.scheduler.arm('light', now); self.scheduler.arm('status', now)
+        self._arm_interval('od', 'last_od_reading_timestamp', 'od_interval_hours')
+        self._arm_interval('aeration', 'last_aeration_timestamp', 'aerator_interval_hours')
+        self._arm_dilution()
+
+    def _arm_interval(self, name, last_key, hours_key):
+        interval_sec = self.setpoints[hours_key] * 3600
+        self.scheduler.arm(name, self.schedule[last_key] + interval_sec if interval_sec > 0 else None)
+
+    def _arm_dilution(self):
+        light_cycle_duration_sec = self.setpoints['light_cycle_hours'] * 3600
+        if not self._dilution_enabled() or light_cycle_duration_sec <= 0 or self.dilutions_per_day <= 0 \
+                or not self._is_light_cycle_on():
+            self.scheduler.arm('dilution', None); return
+        self.scheduler.arm('dilution', self.schedule['last_dilution_time'] + light_cycle_duration_sec / self.dilutions_per_day)
+
+    def _on_light_timer(self):
+        now = self.clock.time(); is_on = self._is_light_cycle_on()
+        # Dilutions are spaced from the moment the lights come on.
+        if not (is_on and self._light_cycle_was_on): self._stamp_schedule('last_dilution_time')
+        self._light_cycle_was_on = is_on
+        self._handle_light_cycle(); self._arm_dilution()
+        cycle_duration = self.setpoints['light_cycle_hours'] * 3600
+        if 0 < cycle_duration < 86400:
+            time_in_day = (now - self.schedule['light_cycle_start_time']) % 86400
+            to_boundary = cycle_duration - time_in_day if time_in_day < cycle_duration else 86400 - time_in_day
+            self.scheduler.arm('light', now + to_boundary + 0.01)
+
+    def _on_status_timer(self):
+        self._update_status_strings()
+        self.scheduler.arm('status', math.floor(self.clock.time()) + 1.0)
+
+    def _restore(self):
+        loaded = self.state_store.load()
+        if loaded is None: return
+        state, series = loaded
+        self.setpoints.update(state.get('setpoints', {})); self.schedule.update(state.get('schedule', {}))
+        for name, value in state.get('manual', {}).items():
+            if name in self.manual_overrides: self.manual_overrides[name] = True; self._set_actuator(name, value)
+        if state.get('od') is not None: self.latest_readings['od'] = state['od']
+        if state.get('growth'): self.growth.load(state['growth']); self._update_growth_readings()
+        for name, (ts, values) in series.items():
+            if name in self.history.series: self.history[name].load(ts, values)
+        # Don't restart the dilution spacing if the lights were already on when the snapshot was taken.
+        if self._is_light_cycle_on():
+            now = self.clock.time(); time_in_day = (now - self.schedule['light_cycle_start_time']) % 86400
+            self._light_cycle_was_on = self.schedule['last_dilution_time'] >= now - time_in_day
+        print(f"Reactor {self.reactor_id}: restored state in {self.state_store.stats['load_ms']} ms "
+              f"({sum(len(ts) for ts, _ in series.values())} history samples).")
+
+    def _on_snapshot_timer(self):
+        self.scheduler.arm('snapshot', self.clock.time() + self.snapshot_interval)
+        seq = self.state_store.seq
+        state = {"time": self.clock.time(), "setpoints": dict(self.setpoints), "schedule": dict(self.schedule),
+                 "manual": {name: self._actuator_target(name) for name, on in self.manual_overrides.items() if on},
+                 "od": self.latest_readings['od'], "growth": self.growth.to_dict()}
+        self.state_store.save(seq, state, self.history.copy(since=self._snapshot_appended))
+        self._snapshot_appended = self.history.appended()
+
+    def _on_thermal_timer(self):
+        # The model is refitted offline (thermal.py); pick up a new one within the hour.
+        self.scheduler.arm('thermal', self.clock.time() + 3600)
+        path = self.log_dir / THERMAL_MODEL_FILE
+        try: mtime = path.stat().st_mtime_ns
+        except FileNotFoundError: mtime = None
+        if mtime == self._thermal_model_mtime: return
+        self._thermal_model_mtime = mtime; model = None if mtime is None else load_model(path)
+        self.heater_control = None if model is None else HeaterController(model)
+        if model is not None: print(f"Reactor {self.reactor_id}: heater follows the thermal model fitted {model.get('fitted')}.")
+
+    def _journal(self, kind, values):
+        # Changes are journaled after they are applied; see StateStore.seq.
+        if self.state_store is not None: self.state_store.journal(kind, values)
+
+    def _stamp_schedule(self, key):
+        self.schedule[key] = self.clock.time(); self._journal('schedule', {key: self.schedule[key]})
+
+    def fileno(self): return self.link.fileno()
+
+    @property
+    def binary_link(self): return self.link.binary
+
+    def _on_link_mode_change(self, binary):
+        if binary:
+            print(f"Reactor {self.reactor_id}: switched to the binary serial protocol at {SENSOR_RATE_HZ} Hz.")
+            self._negotiating = False; return
+        print(f"Reactor {self.reactor_id}: binary link lost sync, falling back to JSON.")
+        self._negotiate_attempts = 0
+        if SERIAL_PROTOCOL == "binary": self._negotiating = True; self.scheduler.arm('negotiate', self.clock.time())
+
+    def _on_negotiate_timer(self):
+        # Commands are held back until the device answers or the attempts run out: a JSON command
+        # that reaches the device after it switched to binary would be lost.
+        if self.binary_link: return
+        if self._negotiate_attempts >= SERIAL_NEGOTIATE_ATTEMPTS:
+            print(f"Reactor {self.reactor_id}: device did not accept the binary protocol, staying on JSON.")
+            self._negotiating = False; self.waker.wake(); return
+        self._negotiate_attempts += 1
+        self.link.write(protocol.negotiate_request(SENSOR_RATE_HZ))
+        self.scheduler.arm('negotiate', self.clock.time() + SERIAL_NEGOTIATE_INTERVAL_S)
+
+    def _dilution_enabled(self): return self.setpoints['dilution_percent'] > 0 or self.setpoints['target_od'] > 0
 
     def _is_light_cycle_on(self):
         cycle_duration = self.setpoints['light_cycle_hours'] * 3600
         if cycle_duration <= 0: return False
         if cycle_duration >= 86400: return True
-        time_in_day = (time.time() - self.schedule['light_cycle_start_time']) % 86400
-        return 0 < time_in_day < cycle_duration
+        time_in_day = (self.clock.time() - self.schedule['light_cycle_start_time']) % 86400
+        return time_in_day < cycle_duration
 
     def _update_status_strings(self):
-        now = time.time()
+        now = self.clock.time()
         self.latest_readings['script_uptime'] = _format_seconds_to_hms(now - self.start_time_ts)
 
-        dilution_rate = self.setpoints['dilution_percent']
-        if dilution_rate <= 0:
+        if not self._dilution_enabled():
             self.latest_readings['dilution_status'] = "pumping is disabled"
         elif not self._is_light_cycle_on():
             self.latest_readings['dilution_status'] = "Paused until light cycle begins"
         else:
             light_cycle_sec = self.setpoints['light_cycle_hours'] * 3600
-            interval_sec = light_cycle_sec / DILUTIONS_PER_DAY if DILUTIONS_PER_DAY > 0 else 0
+            interval_sec = light_cycle_sec / self.dilutions_per_day if self.dilutions_per_day > 0 else 0
             time_to_next = (self.schedule['last_dilution_time'] + interval_sec) - now
-            self.latest_readings['dilution_status'] = f"{DILUTIONS_PER_DAY} dilutions per light cycle. Next in {_format_seconds_to_hm(time_to_next)}"
+            mode = f"Holding OD {self.setpoints['target_od']:g}, {self.dilutions_per_day}" if self.setpoints['target_od'] > 0 else f"{self.dilutions_per_day}"
+            self.latest_readings['dilution_status'] = f"{mode} dilutions per light cycle. Next in {_format_seconds_to_hm(time_to_next)}"
         
         cycle_duration = self.setpoints['light_cycle_hours'] * 3600
         if cycle_duration <= 0: self.latest_readings['light_cycle_status'] = "lights are off"
@@ -119,192 +329,240 @@ class BioreactorController(threading.Thread):
         seconds_ago = now - self.schedule['last_od_reading_timestamp']
         self.latest_readings['last_od_reading_ago'] = f"Last measured {_format_seconds_to_hm(seconds_ago)} ago"
 
+    # The schedule handlers run when their deadline expires and queue a job; each job re-arms its
+    # schedule by stamping its start time and requesting a reschedule.
     def _handle_dilution_schedule(self):
-        if self.setpoints['dilution_percent'] <= 0: return
-        if not self._is_light_cycle_on():
-            self.schedule['last_dilution_time'] = time.time()
-            return
-        light_cycle_duration_sec = self.setpoints['light_cycle_hours'] * 3600
-        if light_cycle_duration_sec <= 0 or DILUTIONS_PER_DAY <= 0: return
-        interval_seconds = light_cycle_duration_sec / DILUTIONS_PER_DAY
-        if time.time() > self.schedule['last_dilution_time'] + interval_seconds:
-            threading.Thread(target=self._run_waste_then_feed_sequence).start()
+        if not self._is_light_cycle_on(): return
+        self.jobs.submit('dilution', self._waste_then_feed_sequence, JOB_PRIORITY_DILUTION, holds=('pump1', 'pump2'))
 
-    def _handle_od_schedule(self):
-        interval_sec = self.setpoints['od_interval_hours'] * 3600
-        if interval_sec <= 0: return
-        if time.time() > self.schedule['last_od_reading_timestamp'] + interval_sec:
-            threading.Thread(target=self.trigger_od_reading_sequence).start()
+    def _handle_od_schedule(self): self.trigger_od_reading_sequence()
 
     def _handle_aerator_schedule(self):
-        interval_sec = self.setpoints['aerator_interval_hours'] * 3600
-        if interval_sec <= 0: return
-        if time.time() > self.schedule['last_aeration_timestamp'] + interval_sec:
-            threading.Thread(target=self._run_aeration_cycle).start()
-
-    def _run_waste_then_feed_sequence(self):
-        self.schedule['last_dilution_time'] = time.time()
-        if not self.automation_lock.acquire(blocking=False):
-            print("Dilution skipped: another automated process is running.")
-            return
+        self.jobs.submit('aeration', self._aeration_sequence, JOB_PRIORITY_AERATION, preemptible=True, holds=('aerator',))
+
+    def _waste_then_feed_sequence(self):
+        self._stamp_schedule('last_dilution_time'); self._request_reschedule()
+        volume_per_event_L = self._dilution_volume_l()
+        self.latest_readings['last_dilution_ml'] = round(volume_per_event_L * 1000, 1)
+        if volume_per_event_L <= 0: return
+        pump_on_time_sec = (volume_per_event_L * 1000) / (self.pump_flow_rate_ml_min / 60)
+        print(f"Starting dilution event ({volume_per_event_L * 1000:.1f} ml, {pump_on_time_sec:.1f}s per pump)...")
         try:
-            daily_volume_L = (self.setpoints['dilution_percent'] / 100.0) * CONTAINER_VOLUME_L
-            volume_per_event_L = daily_volume_L / DILUTIONS_PER_DAY
-            if volume_per_event_L > 0:
-                pump_on_time_sec = (volume_per_event_L * 1000) / (PUMP_FLOW_RATE_ML_MIN / 60)
-                print(f"Starting dilution event ({pump_on_time_sec:.1f}s per pump)...")
-                if not self.manual_overrides['pump2']: self._set_actuator('pump2', 1)
-                time.sleep(pump_on_time_sec)
-                if not self.manual_overrides['pump2']: self._set_actuator('pump2', 0)
-                time.sleep(PUMP_INTER_DELAY_SECONDS)
-                if not self.manual_overrides['pump1']: self._set_actuator('pump1', 1)
-                time.sleep(pump_on_time_sec)
-                if not self.manual_overrides['pump1']: self._set_actuator('pump1', 0)
-                print("Dilution event finished.")
+            if not self.manual_overrides['pump2']: self._set_actuator('pump2', 1)
+            yield pump_on_time_sec
+            if not self.manual_overrides['pump2']: self._set_actuator('pump2', 0)
+            yield PUMP_INTER_DELAY_SECONDS
+            if not self.manual_overrides['pump1']: self._set_actuator('pump1', 1)
+            yield pump_on_time_sec
+            self.growth.record_dilution(volume_per_event_L / self.container_volume_l)
+            print("Dilution event finished.")
         finally:
-            self.automation_lock.release()
-
-    def _process_serial_inbound(self):
-        line = self.ser.readline().decode(errors='ignore').strip()
-        if not line: return
-        try:
-            pkt = json.loads(line)
-            ts_ms = int(time.time() * 1000)
-            pkt.pop('l1', None); pkt.pop('l2', None)
-            self.latest_readings.update(pkt)
-            if self.latest_readings['t1'] is not None:
-                self.history['t1'].append({'x': ts_ms, 'y': self.latest_readings['t1']})
-                if len(self.history['t1']) > self.HISTORY_MAX_LENGTH: self.history['t1'].pop(0)
-            if self.latest_readings['t2'] is not None:
-                self.history['t2'].append({'x': ts_ms, 'y': self.latest_readings['t2']})
-                if len(self.history['t2']) > self.HISTORY_MAX_LENGTH: self.history['t2'].pop(0)
-            csv_path = LOG_DIR / f"{datetime.date.today()}.csv"; self._init_csv(csv_path)
-            with self._csv_lock, csv_path.open("a", newline="") as f:
-                csv.writer(f).writerow([
-                    datetime.datetime.utcnow().isoformat(timespec="seconds"),
-                    self.latest_readings.get('t1'), self.latest_readings.get('t2'),
-                    self.latest_readings.get('l1'), self.latest_readings.get('l2'),
-                    self.latest_readings.get('od_for_graph')
-                ])
-            self.latest_readings['od_for_graph'] = None
-        except json.JSONDecodeError: pass
+            for pump in ('pump1', 'pump2'):
+                if not self.manual_overrides[pump]: self._set_actuator(pump, 0)
+
+    def _dilution_volume_l(self):
+        """Volume to exchange in one dilution: a fixed share of dilution_percent per day or, in
+        turbidostat mode, whatever brings the OD predicted by the growth estimate back to target_od
+        by the next dilution."""
+        target_od = self.setpoints['target_od']
+        if target_od <= 0: return (self.setpoints['dilution_percent'] / 100.0) * self.container_volume_l / self.dilutions_per_day
+        hours_to_next = self.setpoints['light_cycle_hours'] / self.dilutions_per_day
+        od_now = self.growth.predict_od(self.clock.time())
+        return turbidostat_fraction(od_now, self.growth.rate, hours_to_next, target_od) * self.container_volume_l
+
+    def _update_growth_readings(self):
+        rate = self.growth.rate; doubling = self.growth.doubling_time_s
+        self.latest_readings['growth_rate'] = None if rate is None else round(rate, 4)
+        self.latest_readings['doubling_time'] = "--" if doubling is None else _format_seconds_to_hm(doubling)
+
+    def _handle_packet(self, pkt):
+        if self._unacked: self._check_acks(pkt)
+        ts_ms = int(self.clock.time() * 1000)
+        l1 = pkt.pop('l1', None); l2 = pkt.pop('l2', None)
+        if self._od_burst is not None and pkt.get('irled') and not pkt.get('lights') and not pkt.get('stir'):
+            self._od_burst.add(l1, l2)
+        self.latest_readings.update(pkt)
+        self._handle_temperature_control()
+        if self.latest_readings['t1'] is not None: self.history.append('t1', ts_ms, self.latest_readings['t1'])
+        if self.latest_readings['t2'] is not None: self.history.append('t2', ts_ms, self.latest_readings['t2'])
+        # Fast links are thinned out for the log; OD readings are always kept.
+        if ts_ms - self._last_log_ms >= LOG_MIN_INTERVAL_S * 1000 or self.latest_readings['od_for_graph'] is not None:
+            self.log_writer.log(self.log_dir, sample_from_readings(ts_ms, self.latest_readings)); self._last_log_ms = ts_ms
+        self.hub.publish(self.latest_readings)  # before od_for_graph is cleared, so the chart gets the point
+        self.latest_readings['od_for_graph'] = None
+
+    def _check_acks(self, pkt):
+        now = self.clock.time()
+        for name, entry in list(self._unacked.items()):
+            value, first_sent, last_sent, retries = entry
+            if pkt.get(name) == value:
+                self.command_latency.setdefault(name, Histogram()).observe(now - first_sent); del self._unacked[name]
+            elif now - last_sent >= SERIAL_ACK_TIMEOUT_S:
+                if retries < SERIAL_ACK_RETRIES: self._resend[name] = value; self.link_stats['command_retries'] += 1
+                else:
+                    print(f"Reactor {self.reactor_id}: device did not confirm {name}={value} after {retries} retries.")
+                    del self._unacked[name]; self.link_stats['commands_unacked'] += 1
 
     def _process_serial_outbound(self):
-        try:
-            cmd = self.out_q.get_nowait()
-            with self._serial_lock: self.ser.write((json.dumps(cmd) + "\n").encode())
-            for key, value in cmd.items():
-                if key in self.latest_readings: self.latest_readings[key] = value
-        except queue.Empty: pass
-
-    def _set_actuator(self, name, state): self.out_q.put({"cmd": "set", name: int(state)})
+        """Drains the queue and writes every pending actuator change, plus due retries, as a
+        single set command; a later change of the same actuator wins. Other commands are written
+        in queue order, so the changes queued before one are sent ahead of it."""
+        if self._negotiating: return
+        changes = self._resend; self._resend = {}
+        while True:
+            try: cmd = self.out_q.get_nowait()
+            except queue.Empty: break
+            if cmd.get('cmd') == 'set': changes.update((k, v) for k, v in cmd.items() if k != 'cmd'); continue
+            self._send_set(changes); changes = {}
+            if cmd.get('cmd') == 'burst' and self.binary_link:
+                self.link.write(protocol.encode_burst(self._tx_seq, cmd['samples'], cmd['interval_ms'])); self._tx_seq += 1
+            else: self.link.write((json.dumps(cmd) + "\n").encode())
+        self._send_set(changes)
+
+    def _send_set(self, changes):
+        """Writes one set command for changes and tracks them until the device echoes them."""
+        if not changes: return
+        if self.binary_link: data = protocol.encode_set(self._tx_seq, changes); self._tx_seq += 1
+        else: data = (json.dumps({"cmd": "set", **changes}) + "\n").encode()
+        self.link.write(data)
+        now = self.clock.time()
+        for name, value in changes.items():
+            entry = self._unacked.get(name)
+            if entry and entry[0] == value: entry[2] = now; entry[3] += 1  # a resend keeps its first send time
+            else: self._unacked[name] = [value, now, now, 0]
+
+    def _actuator_target(self, name):
+        """The state an actuator was last commanded to, or its reported state if nothing is in flight."""
+        entry = self._unacked.get(name)
+        return entry[0] if entry else self.latest_readings[name]
+
+    def _set_actuator(self, name, state):
+        self.out_q.put({"cmd": "set", name: int(state)}); self.waker.wake()
 
     def trigger_od_reading_sequence(self):
+        """Queues an OD measurement (thread-safe) and returns its Job."""
+        return self.jobs.submit('od', self._od_reading_sequence, JOB_PRIORITY_OD, holds=('stir', 'lights', 'aerator', 'irled'))
+
+    def _od_reading_sequence(self):
         # This is the single source of truth for when a reading is initiated.
-        self.schedule['last_od_reading_timestamp'] = time.time()
-        
-        if not self.automation_lock.acquire(blocking=False):
-            print("OD sequence skipped: another process is running."); return
-        
-        initial_lights = self.latest_readings['lights']; initial_aerator = self.latest_readings['aerator']
-        l1, l2 = None, None
+        self._stamp_schedule('last_od_reading_timestamp'); self._request_reschedule()
+        manual_states = {name: self._actuator_target(name) for name in ('lights', 'aerator') if self.manual_overrides[name]}
+        burst = None
         try:
             print("Starting OD reading sequence.")
             self._set_actuator('stir', 1)
             for i in range(OD_STIR_DURATION, 0, -1):
-                self.latest_readings['od_sequence_step'] = f"Stirring... {i}s"; time.sleep(1)
-            self._set_actuator('stir', 0)
-            self._set_actuator('lights', 0); self._set_actuator('aerator', 0)
-            for i in range(OD_SETTLE_DURATION, 0, -1):
-                self.latest_readings['od_sequence_step'] = f"Settling... {i}s"; time.sleep(1)
+                self.latest_readings['od_sequence_step'] = f"Stirring... {i}s"; yield 1
+            # The device streams photodiode samples while the culture settles, and the measurement
+            # starts as soon as they are steady rather than after a fixed wait.
+            self._od_burst = burst = ODBurst()
+            self._set_actuator('stir', 0); self._set_actuator('lights', 0); self._set_actuator('aerator', 0)
+            self._set_actuator('irled', 1); self._request_burst(math.ceil((OD_SETTLE_DURATION + OD_READ_TIMEOUT) * 1000 / OD_BURST_INTERVAL_MS))
+            self.latest_readings['od_sequence_step'] = "Settling..."
+            settled_at = self.clock.time()
+            if (yield WaitFor(burst.settled, OD_SETTLE_DURATION)) is None:
+                print(f"OD: photodiodes still unsteady after {OD_SETTLE_DURATION}s (std {burst.std}), measuring anyway.")
+            settle_s = self.clock.time() - settled_at
             self.latest_readings['od_sequence_step'] = "Taking measurement..."
-            with self._serial_lock:
-                self.ser.write((json.dumps({"cmd": "set", "irled": 1}) + "\n").encode())
-                self.latest_readings['irled'] = 1
-                line = self.ser.readline().decode(errors='ignore').strip()
-                if line:
-                    try: pkt = json.loads(line); l1 = pkt.get('l1'); l2 = pkt.get('l2')
-                    except json.JSONDecodeError: print(f"OD Reading: Received bad JSON from Arduino: {line}")
+            burst.start_measuring()
+            yield WaitFor(burst.measured, OD_READ_TIMEOUT)
             recorded_od = None
-            if l1 and l2 and l1 > 0 and l2 > 0:
-                recorded_od = round(-math.log10(l2 / l1), 4)
-                self.latest_readings['od'] = recorded_od; self.latest_readings['l1'] = l1; self.latest_readings['l2'] = l2
-                self.history['od'].append({'x': int(time.time() * 1000), 'y': recorded_od})
-                if len(self.history['od']) > self.HISTORY_MAX_LENGTH: self.history['od'].pop(0)
-                print(f"OD Reading taken: {recorded_od} (l1={l1}, l2={l2})")
-            else: print(f"OD Reading failed: Did not receive valid sensor data from serial read. Got: l1={l1}, l2={l2}")
+            if burst.values:
+                od, kept = robust_od(burst.values); recorded_od = round(od, 4)
+                self.latest_readings['od'] = recorded_od
+                self.latest_readings['l1'], self.latest_readings['l2'] = burst.last_pair
+                self.history.append('od', int(self.clock.time() * 1000), recorded_od)
+                self.growth.add(self.clock.time(), recorded_od); self._update_growth_readings()
+                print(f"OD Reading taken: {recorded_od} from {kept} of {len(burst.values)} samples after settling for {settle_s:.1f}s")
+            else: print("OD Reading failed: Did not receive valid photodiode samples from the serial link.")
             self.latest_readings['od_for_graph'] = recorded_od
             self.latest_readings['od_sequence_step'] = "Finalizing..."
         finally:
+            self._od_burst = None
+            if burst is not None: self._request_burst(0)
             self._set_actuator('irled', 0)
-            if not self.manual_overrides['lights']: self._set_actuator('lights', initial_lights)
-            if not self.manual_overrides['aerator']: self._set_actuator('aerator', initial_aerator)
+            # Manually set actuators get their state back. Otherwise the lights follow the light cycle
+            # (which leaves them alone while this runs) and the aerator stays off: an aeration this
+            # sequence interrupted is queued again and switches it on itself.
+            self._set_actuator('lights', manual_states.get('lights', int(self._is_light_cycle_on())))
+            self._set_actuator('aerator', manual_states.get('aerator', 0))
             self.latest_readings['od_sequence_step'] = None
-            self.automation_lock.release()
 
-    def _run_aeration_cycle(self):
-        # This is the single source of truth for when an aeration cycle is initiated.
-        self.schedule['last_aeration_timestamp'] = time.time()
+    def _request_burst(self, samples):
+        self.out_q.put({"cmd": "burst", "samples": samples, "interval_ms": OD_BURST_INTERVAL_MS}); self.waker.wake()
 
-        if not self.automation_lock.acquire(blocking=False):
-            print("Aeration skipped: another process is running."); return
+    def _aeration_sequence(self):
+        # This is the single source of truth for when an aeration cycle is initiated.
+        self._stamp_schedule('last_aeration_timestamp'); self._request_reschedule()
+        print(f"Starting aeration cycle for {AERATOR_ON_DURATION_SECONDS}s...")
         try:
-            print(f"Starting aeration cycle for {AERATOR_ON_DURATION_SECONDS}s...")
             if not self.manual_overrides['aerator']: self._set_actuator('aerator', 1)
-            time.sleep(AERATOR_ON_DURATION_SECONDS)
-            if not self.manual_overrides['aerator']: self._set_actuator('aerator', 0)
+            yield AERATOR_ON_DURATION_SECONDS
         finally:
-            self.automation_lock.release()
+            if not self.manual_overrides['aerator']: self._set_actuator('aerator', 0)
+
+    def cancel_job(self, name):
+        """Cancels a queued or running automation job ('od', 'dilution' or 'aeration')."""
+        return self.jobs.cancel(name)
 
     def _handle_temperature_control(self):
         if self.manual_overrides['heater']: return
         internal_temp, element_temp = self.latest_readings.get('t1'), self.latest_readings.get('t2')
         setpoint = self.setpoints['temperature']
         if element_temp and element_temp >= HEATER_ELEMENT_MAX_TEMP:
-            if self.latest_readings['heater'] == 1: self._set_actuator('heater', 0)
+            if self._actuator_target('heater') == 1: self._set_actuator('heater', 0)
+            return
+        on = None  # the thermal model's decision, if there is a model and it has one
+        if internal_temp and self.heater_control is not None:
+            on = self.heater_control.update(self.clock.time(), internal_temp, setpoint, self._actuator_target('heater'))
+        if on is not None:
+            if self._actuator_target('heater') != on: self._set_actuator('heater', int(on))
         elif internal_temp:
             if internal_temp < setpoint - TEMP_HYSTERESIS / 2:
-                if self.latest_readings['heater'] == 0: self._set_actuator('heater', 1)
+                if self._actuator_target('heater') == 0: self._set_actuator('heater', 1)
             elif internal_temp > setpoint + TEMP_HYSTERESIS / 2:
-                if self.latest_readings['heater'] == 1: self._set_actuator('heater', 0)
+                if self._actuator_target('heater') == 1: self._set_actuator('heater', 0)
 
     def _handle_light_cycle(self):
-        if self.manual_overrides['lights']: return
+        if self.manual_overrides['lights'] or self.jobs.holds('lights'): return
         should_be_on = self._is_light_cycle_on()
-        if self.latest_readings['lights'] != should_be_on: self._set_actuator('lights', int(should_be_on))
+        if self._actuator_target('lights') != should_be_on: self._set_actuator('lights', int(should_be_on))
 
-    def set_manual_override(self, actuator, state):
+    def set_manual_override(self, actuator, state): self._call(self._set_manual_override, actuator, state)
+
+    def _set_manual_override(self, actuator, state):
         self.manual_overrides[actuator] = True
-        self._set_actuator(actuator, state)
+        self._set_actuator(actuator, state); self._journal('manual', {actuator: int(state)})
 
-    def set_temperature_setpoint(self, temp):
-        try: self.setpoints['temperature'] = float(temp)
-        except (ValueError, TypeError): pass
+    def _set_setpoint(self, key, value, reschedule=True):
+        try: value = float(value)
+        except (ValueError, TypeError): return
+        self._call(self._apply_setpoint, key, value, reschedule)
 
-    def set_light_cycle(self, hours):
-        try:
-            self.setpoints['light_cycle_hours'] = float(hours)
-        except (ValueError, TypeError): pass
+    def _apply_setpoint(self, key, value, reschedule):
+        if self.setpoints[key] == value: return
+        self.setpoints[key] = value; self._journal('setpoints', {key: value})
+        if reschedule: self._request_reschedule()
 
-    def set_dilution_rate(self, percent):
-        try:
-            self.setpoints['dilution_percent'] = float(percent)
-        except (ValueError, TypeError): pass
+    def set_temperature_setpoint(self, temp): self._set_setpoint('temperature', temp, reschedule=False)
 
-    def set_od_interval(self, hours):
-        try:
-            self.setpoints['od_interval_hours'] = float(hours)
-        except (ValueError, TypeError): pass
+    def set_light_cycle(self, hours): self._set_setpoint('light_cycle_hours', hours)
 
-    def set_aerator_interval(self, hours):
-        try:
-            self.setpoints['aerator_interval_hours'] = float(hours)
-        except (ValueError, TypeError): pass
+    def set_dilution_rate(self, percent): self._set_setpoint('dilution_percent', percent)
+
+    def set_od_interval(self, hours): self._set_setpoint('od_interval_hours', hours)
+
+    def set_aerator_interval(self, hours): self._set_setpoint('aerator_interval_hours', hours)
+
+    def set_target_od(self, od): self._set_setpoint('target_od', od)
+
+    def resume_all_automation(self): self._call(self._resume_all_automation)
 
-    def resume_all_automation(self):
+    def _resume_all_automation(self):
         print("Resuming all automation routines.")
         for key in self.manual_overrides:
             self.manual_overrides[key] = False
+        self._journal('resume', None)
         print("Enforcing automated states...")
         self._handle_temperature_control()
         self._handle_light_cycle()
@@ -0,0 +1,94 @@
+# broadcast.py
+
+import json
+import asyncio
+import threading
+import collections
+
+from config import *
+from metrics import ThreadCounters
+
+_MISSING = object()
+
+class BroadcastHub:
+    """Publish/subscribe for Server-Sent Events. The publisher hands over its state dict whenever it
+    may have changed; a new version is created only if something actually changed, and its full and
+    delta frames are serialized once and shared by every subscriber."""
+    def __init__(self, backlog=SSE_BACKLOG, heartbeat=SSE_HEARTBEAT_SECONDS):
+        self.heartbeat = heartbeat
+        self._cond = threading.Condition()
+        self._state = {}; self.version = 0
+        self._frames = collections.deque(maxlen=backlog)  # (version, full frame, delta frame)
+        self.subscribers = 0
+        self.sent = ThreadCounters()  # 'bytes' and 'frames', added by each client's thread
+        self._loop_events = {}  # event loop -> asyncio.Event set (and replaced) on the next publish
+
+    def publish(self, state):
+        """Called from the single publishing thread. Returns True if a new version was published."""
+        delta = {k: v for k, v in state.items() if self._state.get(k, _MISSING) != v}
+        if not delta: return False
+        self._state = dict(state); version = self.version + 1
+        full = f"id: {version}\ndata: {json.dumps(self._state)}\n\n".encode()
+        partial = f"id: {version}\nevent: delta\ndata: {json.dumps(delta)}\n\n".encode()
+        with self._cond:
+            self._frames.append((version, full, partial)); self.version = version
+            self._cond.notify_all()
+        for loop in list(self._loop_events):
+            try: loop.call_soon_threadsafe(self._wake_loop, loop)
+            except RuntimeError: self._loop_events.pop(loop, None)  # the loop was closed
+        return True
+
+    def _wake_loop(self, loop):
+        # One wakeup per event loop and publish, however many clients the loop serves.
+        event = self._loop_events[loop]; self._loop_events[loop] = asyncio.Event(); event.set()
+
+    def changed_since(self, version): return self.version != version
+
+    def _frames_after(self, version, delta):
+        """Frames that bring a client at `version` up to date: every missed delta if they are all
+        still in the backlog, otherwise the latest full snapshot."""
+        frames = self._frames
+        if not frames or version == frames[-1][0]: return []
+        if delta and version is not None and frames[0][0] <= version + 1 <= frames[-1][0]:
+            return [f[2] for f in frames if f[0] > version]
+        return [frames[-1][1]]
+
+    def subscribe(self, last_event_id=None, delta=False):
+        """Generator of SSE frames for one client. Resumes from Last-Event-ID when possible and sends a
+        comment line as heartbeat when idle so dead connections are noticed."""
+        version = _parse_event_id(last_event_id)
+        with self._cond: self.subscribers += 1
+        try:
+            while True:
+                with self._cond:
+                    if not self._cond.wait_for(lambda: self._frames and self.version != version, self.heartbeat):
+                        frames = [b": keepalive\n\n"]
+                    else: frames = self._frames_after(version, delta); version = self.version
+                data = b"".join(frames); self.sent.add('bytes', len(data)); self.sent.add('frames', len(frames))
+                yield data
+        finally:
+            with self._cond: self.subscribers -= 1
+
+    async def subscribe_async(self, last_event_id=None, delta=False):
+        """subscribe() as an async generator, for the asyncio frontend (asgi_app.py): a waiting client
+        costs no thread, only a wait on an asyncio.Event of its event loop."""
+        loop = asyncio.get_running_loop(); self._loop_events.setdefault(loop, asyncio.Event())
+        version = _parse_event_id(last_event_id)
+        with self._cond: self.subscribers += 1
+        try:
+            while True:
+                event = self._loop_events[loop]  # taken before looking, so a publish in between is not missed
+                with self._cond:
+                    ready = self._frames and self.version != version
+                    if ready: frames = self._frames_after(version, delta); version = self.version
+                if not ready:
+                    try: await asyncio.wait_for(event.wait(), self.heartbeat); continue
+                    except asyncio.TimeoutError: frames = [b": keepalive\n\n"]
+                data = b"".join(frames); self.sent.add('bytes', len(data)); self.sent.add('frames', len(frames))
+                yield data
+        finally:
+            with self._cond: self.subscribers -= 1
+
+def _parse_event_id(last_event_id):
+    try: return int(last_event_id) if last_event_id else None
+    except ValueError: return None
@@ -0,0 +1,34 @@
+# clock.py
+
+import time
+
+# Every clock has time() and rate, the clock seconds that pass per wall-clock second; a controller
+# divides by the rate to turn the wait until its next deadline into a select() timeout.
+
+class SystemClock:
+    """Wall-clock time; what the controller uses unless told otherwise."""
+    rate = 1.0
+    def time(self): return time.time()
+
+SYSTEM_CLOCK = SystemClock()
+
+class ScaledClock:
+    """Wall-clock time that runs `rate` times faster, starting from the current time: the clock of a
+    simulator running at a speed-up, so the controllers' schedules speed up with its physics."""
+    def __init__(self, rate=1.0):
+        self.rate = float(rate); self._origin = time.time(); self._started = time.monotonic()
+
+    def time(self): return self._origin + (time.monotonic() - self._started) * self.rate
+
+class VirtualClock:
+    """Time that only moves when advance_to() is called. Everything time-dependent in the controller
+    (schedules, job sleeps, timeouts) is a deadline on its clock, so a driver that steps the
+    controller at each deadline reproduces a run exactly, as fast as the CPU allows."""
+    rate = 1.0
+    def __init__(self, start=0.0): self._now = float(start)
+
+    def time(self): return self._now
+
+    def advance_to(self, t): self._now = max(self._now, float(t))
+
+    def advance(self, seconds): self.advance_to(self._now + seconds)
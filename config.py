@@ -9,6 +9,23 @@ LOG_DIR = pathlib.Path("./logs")
 SERIAL_PORT = "/dev/pts/6" # <-- EDIT THIS LINE
 #SERIAL_PORT = "/dev/ttyACM0"
 BAUD        = 115_200
+# "binary" asks the device for the compact framed protocol at startup (see protocol.py) and
+# stays on JSON lines if it doesn't answer; "json" never asks.
+SERIAL_PROTOCOL = "binary"
+SENSOR_RATE_HZ = 10              # sensor packet rate requested for the binary protocol
+SERIAL_NEGOTIATE_ATTEMPTS = 4      # outbound commands wait while the device is being asked
+SERIAL_NEGOTIATE_INTERVAL_S = 1.0
+SERIAL_MAX_FRAME_BYTES = 1024
+# Every sensor packet echoes the actuator states; a command not echoed back within this long is resent.
+SERIAL_ACK_TIMEOUT_S = 1.5
+SERIAL_ACK_RETRIES = 3
+SERIAL_TRACE_DIR = None          # e.g. pathlib.Path("./traces"): record raw serial traffic to <dir>/<reactor>.trace for replay.py
+
+# -- Fleet Mode
+# Leave empty to run a single reactor on SERIAL_PORT. Otherwise, map each reactor id
+# to its settings; every entry is passed to BioreactorController as keyword arguments,
+# e.g. {"r1": {"port": "/dev/ttyACM0"}, "r2": {"port": "/dev/ttyACM1", "setpoints": {"temperature": 30.0}}}
+REACTORS = {}
 
 # -- Physical System Parameters
 CONTAINER_VOLUME_L = 1.0
@@ -18,6 +35,41 @@ PUMP_FLOW_RATE_ML_MIN = 80.0
 TEMP_HYSTERESIS = 0.5
 HEATER_ELEMENT_MAX_TEMP = 60.0
 
+# -- Heater Control
+# With a thermal model in <log dir>/THERMAL_MODEL_FILE (fitted by thermal.py, e.g. nightly from
+# cron), the heater runs a model-based duty cycle instead of switching at +-TEMP_HYSTERESIS / 2.
+THERMAL_MODEL_FILE = "thermal_model.json"
+HEATER_PWM_PERIOD_S = 120.0   # the duty cycle is one on/off pulse per period (at most this, see thermal.py)
+HEATER_MIN_SWITCH_S = 2.0     # shorter pulses (or gaps) are rounded away, so the relay switches less
+THERMAL_FIT_STEP_S = 10.0     # thermal.py resamples the logs to this step before fitting
+THERMAL_MAX_DEAD_S = 300.0    # longest dead time tried by the fit
+THERMAL_MIN_TAU_STEPS = 5     # fits with a time constant under this many resampling steps are rejected
+
+# -- Logging
+LOG_FLUSH_INTERVAL_S = 1.0   # samples are batched for this long before being written
+LOG_FSYNC_INTERVAL_S = 60.0  # force written samples to disk at most this often (0 = every batch)
+LOG_MIN_INTERVAL_S = 0.2     # log at most one sample per interval (OD readings are always logged)
+LOG_BINARY = True            # also write fixed-width binary records to LOG_DIR/<date>.bin
+LOG_INDEX_STRIDE = 256       # binary records per block of the sparse index used by /history range queries
+
+# -- Chart History (kept in memory)
+# series -> (capacity in samples, minimum spacing between samples in seconds).
+# Each sample costs 12 bytes, so one week of 1 Hz temperature data is about 7 MB per series.
+HISTORY_SERIES = {"t1": (7 * 86400, 1.0), "t2": (7 * 86400, 1.0), "od": (8192, 0.0)}
+HISTORY_RESPONSE_POINTS = 2000  # newest points per series returned by /history
+HISTORY_GZIP_MIN_BYTES = 1024   # /history bodies at least this large are gzipped for clients that accept it
+
+# -- State Snapshots
+# Setpoints, manual overrides, schedule times and the chart history survive a restart: they are
+# snapshotted to <log dir>/state.snap this often, and changes in between are journaled to
+# <log dir>/state.journal. Each snapshot appends only the history samples added since the last
+# one to <log dir>/state.history. 0 turns all of it off; nothing is restored then either.
+SNAPSHOT_INTERVAL_S = 300
+
+# -- Dashboard Stream (/stream)
+SSE_BACKLOG = 256            # recent frames kept so reconnecting clients can resume from Last-Event-ID
+SSE_HEARTBEAT_SECONDS = 15
+
 # -- Scheduling
 # The number of times to run the dilution sequence during a single light cycle.
 # The total daily volume is divided evenly between these events.
@@ -28,6 +80,35 @@ PUMP_INTER_DELAY_SECONDS = 2.0
 
 AERATOR_ON_DURATION_SECONDS = 300    # Run aerator for 5 minutes during its cycle
 
+# How long a dashboard request waits for the control thread to apply a change before giving up
+# on waiting (the change is still applied when the thread gets to it).
+CONTROL_CALL_TIMEOUT_S = 5.0
+
+# -- Growth Estimate and Turbidostat
+# The specific growth rate is a line fitted to ln(OD) over this window, corrected for the dilutions in it.
+GROWTH_WINDOW_HOURS = 24
+GROWTH_MIN_READINGS = 3
+# With a target OD set, every dilution is sized so the culture grows back to the target by the
+# next one, instead of exchanging a fixed dilution_percent.
+TURBIDOSTAT_MAX_FRACTION = 0.5  # never exchange more than this share of the culture at once
+
+# -- Automation Jobs
+# Sequences of one reactor run one at a time; a job triggered while another runs waits in a queue,
+# lower numbers first. An OD measurement also interrupts a running aeration, which restarts afterwards.
+JOB_PRIORITY_OD = 0
+JOB_PRIORITY_DILUTION = 1
+JOB_PRIORITY_AERATION = 2
+
 # -- OD Sequence Timings (in seconds)
 OD_STIR_DURATION = 5
-OD_SETTLE_DURATION = 5
\ No newline at end of file
+OD_SETTLE_DURATION = 5   # at most; the measurement starts as soon as the photodiodes are steady
+OD_READ_TIMEOUT = 5
+
+# -- OD Burst Sampling
+# While the culture settles and is measured, the device streams photodiode samples every
+# OD_BURST_INTERVAL_MS (devices without burst support keep their usual rate).
+OD_BURST_INTERVAL_MS = 50
+OD_SETTLE_WINDOW = 10    # samples in the rolling window that is checked for settling
+OD_SETTLE_STD = 0.002    # settled once the ODs in the window have a standard deviation below this
+OD_BURST_SAMPLES = 20    # samples combined into one reading
+OD_OUTLIER_MADS = 3.5    # samples this many (normal-scaled) median absolute deviations from the median are dropped
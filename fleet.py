@@ -0,0 +1,49 @@
+# fleet.py
+
+import selectors
+import threading
+
+import serial
+from bioreactor_controller import BioreactorController
+from log_writer import LogWriter
+from config import *
+
+class FleetManager(threading.Thread):
+    """Runs any number of reactors from one thread: a selector waits on every serial port at once
+    and sleeps until the earliest deadline of any reactor."""
+    def __init__(self, controllers):
+        super().__init__(daemon=True, name="fleet")
+        self.controllers = controllers
+        self._sel = selectors.DefaultSelector()
+        for ctrl in controllers.values():
+            self._sel.register(ctrl.fileno(), selectors.EVENT_READ, ctrl)
+            self._sel.register(ctrl.waker, selectors.EVENT_READ, ctrl)
+        self._active = list(controllers.values())
+
+    def run(self):
+        print(f"Fleet manager started with {len(self.controllers)} reactors.")
+        while True:
+            timeouts = [t for ctrl in self._active if (t := ctrl.seconds_until_next_deadline()) is not None]
+            ready = {key.data for key, _ in self._sel.select(min(timeouts, default=None))}
+            for ctrl in list(self._active):
+                deadline = ctrl.scheduler.next_deadline()
+                if ctrl not in ready and (deadline is None or deadline > ctrl.clock.time()): continue
+                try: ctrl.step()
+                except (OSError, serial.SerialException) as e:
+                    print(f"Reactor {ctrl.reactor_id}: serial port lost ({e}), dropping it from the loop.")
+                    self._sel.unregister(ctrl.fileno()); self._sel.unregister(ctrl.waker); self._active.remove(ctrl)
+                except Exception as e: print(f"Reactor {ctrl.reactor_id}: control step failed: {e!r}")
+
+def build_controllers():
+    if not REACTORS: return {"default": BioreactorController()}
+    log_writer = LogWriter(); log_writer.start()  # one writer thread for the whole fleet
+    return {rid: BioreactorController(rid, **{"log_dir": LOG_DIR / rid, "log_writer": log_writer, **cfg})
+            for rid, cfg in REACTORS.items()}
+
+def start_controllers():
+    """Builds the configured reactors and starts them: one thread for a single reactor, one shared loop for a fleet."""
+    controllers = build_controllers()
+    if REACTORS: FleetManager(controllers).start()
+    else:
+        for ctrl in controllers.values(): ctrl.start()
+    return controllers
@@ -0,0 +1,72 @@
+# growth.py
+
+import math
+import collections
+
+from config import *
+
+class GrowthEstimator:
+    """Specific growth rate (per hour) from OD readings: a least-squares line through ln(OD) over a
+    sliding time window, kept as running sums so each reading costs O(1). Dilutions are recorded as
+    they happen and their log factor is added back to later readings, so the fit sees the growth
+    of the culture rather than the saw-tooth the pumps make of it."""
+    def __init__(self, window_hours=GROWTH_WINDOW_HOURS, min_readings=GROWTH_MIN_READINGS):
+        self.window_h = window_hours; self.min_readings = min_readings
+        self.dilution_log = 0.0  # sum of -ln(1 - fraction) over every recorded dilution
+        self._origin = None; self._points = collections.deque()  # (hours since _origin, ln OD + dilution_log)
+        self._sums = [0.0, 0.0, 0.0, 0.0]; self._removed = 0  # sum t, y, t*t, t*y
+        self.rate = None; self._intercept = None
+
+    def add(self, t, od):
+        """One OD reading at time t (seconds). Non-positive readings carry no log and are ignored."""
+        if od is None or od <= 0: return
+        if self._origin is None: self._origin = t
+        h = (t - self._origin) / 3600; y = math.log(od) + self.dilution_log
+        self._points.append((h, y)); self._update(h, y, 1)
+        while self._points[0][0] < h - self.window_h:
+            self._update(*self._points.popleft(), -1); self._removed += 1
+        if self._removed >= 1000: self._resum()  # removing leaves rounding error behind; start over now and then
+        self._fit()
+
+    def record_dilution(self, fraction):
+        """A fraction of the culture was just replaced by fresh medium."""
+        if 0 < fraction < 1: self.dilution_log -= math.log(1 - fraction)
+
+    def predict_od(self, t):
+        """The OD expected at time t from the fit, after the dilutions recorded so far; with too few
+        readings for a fit, the last reading. None before the first reading."""
+        if not self._points: return None
+        h = (t - self._origin) / 3600
+        y = self._points[-1][1] if self.rate is None else self._intercept + self.rate * h
+        return math.exp(y - self.dilution_log)
+
+    @property
+    def doubling_time_s(self): return math.log(2) / self.rate * 3600 if self.rate and self.rate > 0 else None
+
+    def _update(self, h, y, sign):
+        s = self._sums; s[0] += sign * h; s[1] += sign * y; s[2] += sign * h * h; s[3] += sign * h * y
+
+    def _resum(self):
+        self._sums = [0.0, 0.0, 0.0, 0.0]; self._removed = 0
+        for h, y in self._points: self._update(h, y, 1)
+
+    def _fit(self):
+        n = len(self._points); st, sy, stt, sty = self._sums
+        denom = n * stt - st * st
+        if n < self.min_readings or denom <= 1e-12 * max(1.0, n * stt): self.rate = self._intercept = None; return
+        self.rate = (n * sty - st * sy) / denom; self._intercept = (sy - self.rate * st) / n
+
+    def to_dict(self):
+        return {"origin": self._origin, "points": list(self._points), "dilution_log": self.dilution_log}
+
+    def load(self, state):
+        """Restores what to_dict() returned, e.g. from a state snapshot."""
+        self._origin = state["origin"]; self.dilution_log = state["dilution_log"]
+        self._points = collections.deque(tuple(p) for p in state["points"]); self._resum(); self._fit()
+
+def turbidostat_fraction(od_now, rate, hours_to_next, target_od, max_fraction=TURBIDOSTAT_MAX_FRACTION):
+    """Fraction of the culture to replace now so that, growing at rate (per hour), it is back at
+    target_od when the next dilution is due: od_now * (1 - f) * exp(rate * hours_to_next) = target_od."""
+    if od_now is None or od_now <= 0 or target_od <= 0: return 0.0
+    fraction = 1 - target_od * math.exp(-(rate or 0.0) * hours_to_next) / od_now
+    return min(max(fraction, 0.0), max_fraction)
@@ -0,0 +1,266 @@
+# history_query.py
+
+import csv
+import gzip
+import json
+import time
+import struct
+import hashlib
+import datetime
+import threading
+
+import numpy as np
+from config import *
+from log_writer import open_binary_log, TEMP_MISSING, LIGHT_MISSING
+
+SERIES = ("t1", "t2", "od", "l1", "l2")
+CSV_COLUMNS = {"t1": 1, "t2": 2, "l1": 3, "l2": 4, "od": 5}
+# Read raw records only while a range holds at most this many per requested point; beyond
+# that the per-block min/max summaries of the index are used instead.
+RAW_POINTS_PER_OUTPUT = 16
+
+def decode_column(records, name):
+    """Physical values of one binary log column as float64, NaN where missing."""
+    col = records[name]; out = col.astype(np.float64)
+    if name in ("t1", "t2"): out /= 100; out[col == TEMP_MISSING] = np.nan
+    elif name in ("l1", "l2"): out[col == LIGHT_MISSING] = np.nan
+    return out
+
+def minmax_decimate(ts, values, max_points):
+    """Keeps the first and last sample, so the chart spans the whole range, and the min and max of
+    each of (max_points - 2)/2 equal-count buckets in between, so spikes survive."""
+    n = len(ts)
+    if n <= max_points or max_points < 2: return ts, values
+    idx = [np.array([0, n - 1])]
+    if (buckets := (max_points - 2) // 2):
+        k = -(-n // buckets); rows = -(-n // k)
+        padded = np.full(rows * k, np.nan); padded[:n] = values
+        padded = padded.reshape(rows, k); missing = np.isnan(padded)
+        start = np.arange(rows) * k
+        idx += [start + np.where(missing, np.inf, padded).argmin(1), start + np.where(missing, -np.inf, padded).argmax(1)]
+    idx = np.unique(np.concatenate(idx)); idx = idx[idx < n]
+    return ts[idx], values[idx]
+
+def lttb_decimate(ts, values, max_points):
+    """Largest-Triangle-Three-Buckets: keeps the visually most significant point of each bucket."""
+    n = len(ts)
+    if n <= max_points or max_points < 3: return ts, values
+    x = ts.astype(np.float64); y = values
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+    keep = np.empty(max_points, dtype=np.int64); keep[0] = 0; keep[-1] = n - 1; a = 0
+    for i in range(max_points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nhi = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[hi:nhi].mean(); avg_y = y[hi:nhi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax()); keep[i + 1] = a
+    return ts[keep], values[keep]
+
+DECIMATORS = {"minmax": minmax_decimate, "lttb": lttb_decimate}
+
+class _BinaryFileIndex:
+    """Sparse index of one binary log: the timestamp of every stride-th record plus, per block of
+    stride records, the min and max of each series. Grows incrementally while the file is appended to.
+    Indexes of finished days are saved next to the log as <date>.idx.npz."""
+    def __init__(self, path, stride):
+        self.path = path; self.stride = stride; self.size = -1; self._reset(None)
+
+    def _reset(self, base_ts):
+        self.base_ts = base_ts; self.n_blocks = 0
+        self.block_ts = np.empty(0, np.int64)
+        self.summary = {name: [np.empty(0, np.int64), np.empty(0), np.empty(0, np.int64), np.empty(0)] for name in SERIES}
+
+    def _cache_path(self): return self.path.with_name(self.path.stem + ".idx.npz")
+
+    def refresh(self):
+        size = self.path.stat().st_size
+        if size == self.size: return
+        if self.size < 0 and self._load(size): return
+        base_ts, records = open_binary_log(self.path)
+        if base_ts != self.base_ts or size < self.size: self._reset(base_ts)
+        self.records = records; self.size = size
+        full = len(records) // self.stride
+        if full > self.n_blocks:
+            lo, hi = self.n_blocks * self.stride, full * self.stride
+            ts = (base_ts + records['dt_ms'][lo:hi].astype(np.int64)).reshape(-1, self.stride); rows = np.arange(len(ts))
+            self.block_ts = np.concatenate([self.block_ts, ts[:, 0]])
+            for name, parts in self.summary.items():
+                vals = decode_column(records[lo:hi], name).reshape(-1, self.stride); missing = np.isnan(vals)
+                amin = np.where(missing, np.inf, vals).argmin(1); amax = np.where(missing, -np.inf, vals).argmax(1)
+                for i, new in enumerate((ts[rows, amin], vals[rows, amin], ts[rows, amax], vals[rows, amax])):
+                    parts[i] = np.concatenate([parts[i], new])
+            self.n_blocks = full
+            if self.path.stem < datetime.date.today().isoformat(): self._save()
+
+    def _save(self):
+        arrays = {f"{name}_{i}": part for name, parts in self.summary.items() for i, part in enumerate(parts)}
+        try:
+            with open(self._cache_path(), "wb") as f:
+                np.savez(f, size=self.size, base_ts=self.base_ts, stride=self.stride, block_ts=self.block_ts, **arrays)
+        except OSError: pass  # the index is only a cache
+
+    def _load(self, size):
+        try:
+            with np.load(self._cache_path()) as z:
+                if int(z['size']) != size or int(z['stride']) != self.stride: return False
+                self._reset(int(z['base_ts'])); self.block_ts = z['block_ts']; self.n_blocks = len(self.block_ts)
+                for name in SERIES: self.summary[name] = [z[f"{name}_{i}"] for i in range(4)]
+        except (OSError, KeyError, ValueError): return False
+        _, self.records = open_binary_log(self.path); self.size = size
+        return True
+
+    def block_range(self, start_ms, end_ms):
+        """Indices of the blocks that may hold samples in [start_ms, end_ms]."""
+        b0 = max(int(np.searchsorted(self.block_ts, start_ms, 'right')) - 1, 0)
+        return b0, int(np.searchsorted(self.block_ts, end_ms, 'right'))
+
+    def raw(self, name, start_ms, end_ms):
+        # The sparse index narrows the search to the blocks overlapping the range; only those are read.
+        b0, b1 = self.block_range(start_ms, end_ms)
+        r0 = b0 * self.stride; r1 = b1 * self.stride if b1 < self.n_blocks else len(self.records)
+        ts = self.base_ts + self.records['dt_ms'][r0:r1].astype(np.int64)
+        i0, i1 = r0 + np.searchsorted(ts, start_ms, 'left'), r0 + np.searchsorted(ts, end_ms, 'right')
+        return ts[i0 - r0:i1 - r0], decode_column(self.records[i0:i1], name)
+
+    def summarized(self, name, start_ms, end_ms):
+        """Block min/max points for complete blocks, raw samples for the unfinished tail."""
+        b0, b1 = self.block_range(start_ms, end_ms)
+        tail = self.records[self.n_blocks * self.stride:]
+        min_ts, min_v, max_ts, max_v = (part[b0:b1] for part in self.summary[name])
+        distinct = max_ts != min_ts  # blocks with a single sample contribute it once
+        ts = np.concatenate([min_ts, max_ts[distinct], self.base_ts + tail['dt_ms'].astype(np.int64)])
+        vals = np.concatenate([min_v, max_v[distinct], decode_column(tail, name)])
+        inside = (ts >= start_ms) & (ts <= end_ms)
+        return ts[inside], vals[inside]
+
+class LogIndex:
+    """Answers time-range queries over every daily log in one log directory."""
+    def __init__(self, log_dir, stride=LOG_INDEX_STRIDE):
+        self.log_dir = log_dir; self.stride = stride
+        self._bin = {}; self._csv = {}; self._lock = threading.Lock()
+
+    def _day_files(self, start_ms, end_ms):
+        """(day, path) of every log that can overlap the range; binary logs win over CSVs of the same day."""
+        first = datetime.date.fromtimestamp(start_ms / 1000) - datetime.timedelta(days=1)
+        last = datetime.date.fromtimestamp(end_ms / 1000) + datetime.timedelta(days=1)
+        days = {}
+        for path in sorted(self.log_dir.glob("*.csv")) + sorted(self.log_dir.glob("*.bin")):
+            try: day = datetime.date.fromisoformat(path.stem)
+            except ValueError: continue
+            if first <= day <= last: days[day] = path
+        return sorted(days.items())
+
+    def _csv_arrays(self, path):
+        stat = path.stat(); key = (stat.st_size, stat.st_mtime_ns)
+        cached = self._csv.get(path)
+        if cached is None or cached[0] != key:
+            with path.open(newline="") as f: rows = list(csv.reader(f))[1:]
+            epoch = datetime.datetime(1970, 1, 1)
+            ts = np.array([(datetime.datetime.fromisoformat(r[0]) - epoch) // datetime.timedelta(milliseconds=1) for r in rows], np.int64)
+            cols = {name: np.array([float(r[i]) if len(r) > i and r[i] not in ("", "None") else np.nan for r in rows])
+                    for name, i in CSV_COLUMNS.items()}
+            cached = self._csv[path] = (key, ts, cols)
+        return cached[1], cached[2]
+
+    def query(self, name, start_ms, end_ms, max_points, method="minmax"):
+        """(timestamps_ms, values) of one series in [start_ms, end_ms], decimated to at most max_points."""
+        if name not in SERIES: raise KeyError(name)
+        with self._lock:
+            files = []
+            for _, path in self._day_files(start_ms, end_ms):
+                if path.suffix == ".bin":
+                    index = self._bin.get(path)
+                    if index is None: index = self._bin[path] = _BinaryFileIndex(path, self.stride)
+                    try: index.refresh()
+                    except (OSError, ValueError): continue
+                    files.append(index)
+                else: files.append(path)
+            estimate = 0
+            for f in files:
+                if isinstance(f, _BinaryFileIndex): b0, b1 = f.block_range(start_ms, end_ms); estimate += (b1 - b0 + 1) * self.stride
+            summarize = estimate > max_points * RAW_POINTS_PER_OUTPUT
+            parts = []
+            for f in files:
+                if isinstance(f, _BinaryFileIndex):
+                    parts.append(f.summarized(name, start_ms, end_ms) if summarize else f.raw(name, start_ms, end_ms))
+                else:
+                    ts, cols = self._csv_arrays(f); inside = (ts >= start_ms) & (ts <= end_ms)
+                    parts.append((ts[inside], cols[name][inside]))
+        if not parts: return np.empty(0, np.int64), np.empty(0)
+        ts = np.concatenate([p[0] for p in parts]); vals = np.concatenate([p[1] for p in parts])
+        valid = ~np.isnan(vals); ts, vals = ts[valid], vals[valid]
+        if summarize: order = np.argsort(ts, kind="stable"); ts, vals = ts[order], vals[order]
+        return DECIMATORS[method](ts, vals, max_points)
+
+    def query_points(self, name, start_ms, end_ms, max_points, method="minmax"):
+        ts, vals = self.query(name, start_ms, end_ms, max_points, method)
+        return [{'x': x, 'y': y} for x, y in zip(ts.tolist(), np.round(vals, 4).tolist())]
+
+# -- /history encodings (?format=)
+# points:  {"t1": [{"x": ms, "y": value}, ...], ...}, the original format
+# columns: {"t1": {"x": [ms, ...], "y": [value, ...]}, ...}
+# binary:  uint32 length of a JSON header {"t1": n, ...}, the header, zero padding to a multiple of
+#          8 bytes, then per series n float64 timestamps (ms), n float32 values and padding to 8
+#          bytes, so every block can be viewed as a Float64Array/Float32Array without copying.
+HISTORY_FORMATS = ("points", "columns", "binary")
+GZIP_LEVEL = 5
+
+def _pad8(n): return b"\0" * (-n % 8)
+
+def encode_history(arrays, fmt):
+    """(body, mimetype) of {name: (timestamps_ms, values)} in one of HISTORY_FORMATS."""
+    if fmt == "binary":
+        header = json.dumps({name: len(ts) for name, (ts, _) in arrays.items()}).encode()
+        parts = [struct.pack("<I", len(header)), header, _pad8(4 + len(header))]
+        for ts, values in arrays.values():
+            parts += [np.asarray(ts, '<f8').tobytes(), np.asarray(values, '<f4').tobytes(), _pad8(4 * len(values))]
+        return b"".join(parts), "application/octet-stream"
+    rounded = {name: (ts.tolist(), np.round(np.asarray(values, np.float64), 4).tolist()) for name, (ts, values) in arrays.items()}
+    if fmt == "columns": out = {name: {"x": x, "y": y} for name, (x, y) in rounded.items()}
+    else: out = {name: [{"x": a, "y": b} for a, b in zip(x, y)] for name, (x, y) in rounded.items()}
+    return json.dumps(out, separators=(",", ":")).encode(), "application/json"
+
+# Part of the session history's ETag: its version tag starts over when the process restarts.
+_PROCESS_TAG = format(time.time_ns() // 1_000_000, "x")
+
+def history_response(controller, args, headers):
+    """The /history endpoint of pi_controller.py and asgi_app.py, independent of the web framework.
+    args and headers are the request's mappings; returns (status, body, response headers) and raises
+    ValueError for a bad request.
+
+    Without series/from/to/max_points it returns the newest chart history points of the current
+    session, otherwise a downsampled time range of the on-disk logs (see LogIndex.query). since=<ms>
+    restricts either to points newer than that, so a client can fetch only what it is missing.
+    Bodies are gzipped for clients that accept it and carry an ETag; the session history's ETag is
+    known before anything is encoded, so an unchanged history costs a 304 and nothing else."""
+    fmt = args.get('format', 'points'); since = args.get('since')
+    since = None if since is None else int(since)
+    if fmt not in HISTORY_FORMATS: raise ValueError(f"unknown format {fmt!r}")
+    gzipped = 'gzip' in headers.get('Accept-Encoding', '')
+    etag = None
+    if not any(k in args for k in ('series', 'from', 'to', 'max_points')):
+        etag = f'"h{_PROCESS_TAG}-{controller.history.version_tag()}{"-gz" if gzipped else ""}"'
+        if etag in headers.get('If-None-Match', ''): return 304, b"", {'ETag': etag}
+        arrays = {}
+        for name, series in controller.history.series.items():
+            ts, values = series.arrays(HISTORY_RESPONSE_POINTS)
+            if since is not None: i = np.searchsorted(ts, since, 'right'); ts, values = ts[i:], values[i:]
+            arrays[name] = (ts, values)
+    else:
+        names = args.get('series', 't1,t2,od').split(',')
+        method = args.get('method', 'minmax')
+        end_ms = int(args.get('to', int(controller.clock.time() * 1000)))
+        start_ms = int(args.get('from', end_ms - 86_400_000))
+        if since is not None: start_ms = max(start_ms, since + 1)
+        max_points = max(2, int(args.get('max_points', HISTORY_RESPONSE_POINTS)))
+        if method not in DECIMATORS or any(name not in SERIES for name in names): raise ValueError("unknown series or method")
+        arrays = {name: controller.log_index.query(name, start_ms, end_ms, max_points, method) for name in names}
+    body, mimetype = encode_history(arrays, fmt)
+    out = {'Content-Type': mimetype, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+    if gzipped and len(body) >= HISTORY_GZIP_MIN_BYTES: body = gzip.compress(body, GZIP_LEVEL, mtime=0); out['Content-Encoding'] = 'gzip'
+    else: gzipped = False
+    if etag is None: etag = f'"r{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+    elif not gzipped: etag = etag.replace("-gz", "")
+    out['ETag'] = etag
+    if etag in headers.get('If-None-Match', ''): return 304, b"", {'ETag': etag}
+    return 200, body, out
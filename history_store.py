@@ -0,0 +1,74 @@
+# history_store.py
+
+import numpy as np
+
+class RingSeries:
+    """Fixed-capacity circular buffer of (timestamp_ms, value) samples in preallocated typed arrays.
+    One thread appends; readers get zero-copy views and never block the writer."""
+    def __init__(self, capacity, min_interval_s=0.0):
+        self.capacity = int(capacity); self.min_interval_ms = int(min_interval_s * 1000)
+        self.ts = np.zeros(self.capacity, dtype=np.int64)
+        self.values = np.zeros(self.capacity, dtype=np.float32)
+        self._state = (0, 0)  # (next write index, number of samples), swapped as one reference
+        self.appended = 0  # samples ever kept; changes whenever the contents do
+
+    def __len__(self): return self._state[1]
+
+    def append(self, ts_ms, value):
+        """O(1). Samples closer than min_interval_s to the previous one are dropped; returns whether it was kept."""
+        head, count = self._state
+        if count and ts_ms - self.ts[head - 1] < self.min_interval_ms: return False
+        self.ts[head] = ts_ms; self.values[head] = value
+        self._state = ((head + 1) % self.capacity, min(count + 1, self.capacity)); self.appended += 1
+        return True
+
+    def segments(self, last=None):
+        """Views of the newest `last` samples (default all), oldest first, as one or two (ts, values) pairs."""
+        head, count = self._state
+        n = count if last is None else min(last, count)
+        start = (head - n) % self.capacity
+        if start + n <= self.capacity: return [(self.ts[start:start + n], self.values[start:start + n])]
+        return [(self.ts[start:], self.values[start:]), (self.ts[:head], self.values[:head])]
+
+    def arrays(self, last=None):
+        """Contiguous copies of the newest `last` samples; only copies when the buffer has wrapped."""
+        segs = self.segments(last)
+        if len(segs) == 1: return segs[0]
+        return np.concatenate([s[0] for s in segs]), np.concatenate([s[1] for s in segs])
+
+    def load(self, ts, values):
+        """Replaces the contents with the given samples (oldest first); only the newest capacity are kept."""
+        n = min(len(ts), self.capacity)
+        self.ts[:n] = ts[len(ts) - n:]; self.values[:n] = values[len(values) - n:]
+        self._state = (n % self.capacity, n); self.appended += n
+
+    def to_points(self, last=None):
+        ts, values = self.arrays(last)
+        return [{'x': x, 'y': y} for x, y in zip(ts.tolist(), np.round(values.astype(np.float64), 4).tolist())]
+
+class HistoryStore:
+    """Named RingSeries built from a {name: (capacity, min_interval_s)} spec."""
+    def __init__(self, spec):
+        self.series = {name: RingSeries(capacity, interval) for name, (capacity, interval) in spec.items()}
+
+    def __getitem__(self, name): return self.series[name]
+
+    def append(self, name, ts_ms, value): return self.series[name].append(ts_ms, value)
+
+    def version_tag(self):
+        """Short string that changes whenever any series does, e.g. for an ETag."""
+        return "-".join(str(s.appended) for s in self.series.values())
+
+    def appended(self):
+        """{name: samples ever kept}, to pass to copy(since=...) later."""
+        return {name: s.appended for name, s in self.series.items()}
+
+    def copy(self, since=None):
+        """{name: (ts, values)} copies of every series, e.g. for a snapshot written by another thread.
+        With since (an earlier appended()), only of the samples kept after that."""
+        if since is None: return {name: tuple(np.array(a) for a in s.arrays()) for name, s in self.series.items()}
+        return {name: tuple(np.array(a) for a in s.arrays(min(s.appended - since.get(name, 0), s.capacity)))
+                for name, s in self.series.items()}
+
+    def to_json(self, last=None):
+        return {name: s.to_points(last) for name, s in self.series.items()}
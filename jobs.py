@@ -0,0 +1,131 @@
+# jobs.py
+
+import heapq
+import itertools
+import threading
+
+from stats import Histogram
+from metrics import ThreadCounters
+
+class WaitFor:
+    """Yielded by a job to wait for a concurrent.futures.Future; the job gets its result, or None on timeout."""
+    def __init__(self, future, timeout): self.future = future; self.timeout = timeout
+
+class Job:
+    """One run of an automation sequence. The sequence is a generator that yields the seconds it
+    wants to sleep (or a WaitFor); its finally blocks run when it is cancelled or preempted."""
+    def __init__(self, name, factory, priority, preemptible, holds):
+        self.name = name; self.factory = factory; self.priority = priority
+        self.preemptible = preemptible; self.holds = frozenset(holds)  # actuators other automation must leave alone
+        self.state = "queued"; self.done = threading.Event()
+        self._gen = None; self._wake_at = None; self._wait = None; self._stop = None
+        self._queued_at = self._started_at = None
+
+    def wait(self, timeout=None):
+        """Blocks until the job finished, was cancelled or failed; True if it did within timeout."""
+        return self.done.wait(timeout)
+
+    def __repr__(self): return f"<Job {self.name} {self.state}>"
+
+class JobExecutor:
+    """Runs the automation sequences of one reactor one at a time, by priority (lower first), as
+    cooperative generators advanced on the control thread, so pending jobs cost no threads.
+    A job submitted while another runs is queued, not dropped; one with a higher priority preempts
+    a preemptible running job, which is stopped and queued again to restart later."""
+    def __init__(self, clock, wake):
+        self.clock = clock; self.wake = wake
+        self._lock = threading.Lock(); self._queue = []; self._seq = itertools.count()
+        self.running = None
+        # Read by /metrics: counts per (name, outcome), and name -> Histogram of queued and running time.
+        self.outcomes = ThreadCounters(); self.wait_time = {}; self.run_time = {}
+
+    def submit(self, name, factory, priority, preemptible=False, holds=()):
+        """Queues factory() to run as a job; thread-safe. A job of the same name that is already
+        queued or running is returned instead of adding another."""
+        with self._lock:
+            for job in [self.running, *(entry[2] for entry in self._queue)]:
+                if job is not None and job.name == name and job._stop is None: self._count(name, "deduplicated"); return job
+            job = Job(name, factory, priority, preemptible, holds); job._queued_at = self.clock.time()
+            heapq.heappush(self._queue, (priority, next(self._seq), job))
+            running = self.running
+            if running is not None and running.preemptible and priority < running.priority and running._stop is None:
+                running._stop = "preempted"
+        self.wake()
+        return job
+
+    def cancel(self, name):
+        """Cancels the queued or running job called name; thread-safe. Returns False if there is none."""
+        with self._lock:
+            if self.running is not None and self.running.name == name and self.running._stop is None:
+                self.running._stop = "cancelled"; found = True
+            else:
+                found = any(entry[2].name == name for entry in self._queue)
+                for entry in self._queue:
+                    if entry[2].name == name: entry[2].state = "cancelled"; entry[2].done.set(); self._count(name, "cancelled")
+                self._queue = [entry for entry in self._queue if entry[2].name != name]; heapq.heapify(self._queue)
+        if found: self.wake()
+        return found
+
+    def holds(self, actuator):
+        job = self.running
+        return job is not None and actuator in job.holds
+
+    def pending(self):
+        with self._lock: return [entry[2] for entry in sorted(self._queue)]
+
+    def next_deadline(self):
+        job = self.running
+        return None if job is None else job._wake_at
+
+    def run(self):
+        """Advances whatever is due; called by the control loop on every step."""
+        now = self.clock.time()
+        while True:
+            job = self.running
+            if job is None:
+                with self._lock:
+                    if not self._queue: return
+                    job = self.running = heapq.heappop(self._queue)[2]
+                job._started_at = now; self.wait_time.setdefault(job.name, Histogram(Histogram.SLOW_BOUNDS)).observe(now - job._queued_at)
+                job.state = "running"; job._gen = job.factory(); self._advance(job, None)
+            elif job._stop is not None: self._stop(job)
+            elif job._wait is not None and job._wait.future.done():
+                self._advance(job, job._wait.future.result() if not job._wait.future.cancelled() else None)
+            elif job._wake_at is not None and job._wake_at <= now:
+                if job._wait is not None: job._wait.future.cancel()
+                self._advance(job, None)
+            else: return
+
+    def _advance(self, job, value):
+        job._wake_at = None; job._wait = None
+        try: request = job._gen.send(value)
+        except StopIteration: self._finish(job, "done"); return
+        except Exception as e:
+            print(f"Job {job.name} failed: {e!r}"); self._finish(job, "failed"); return
+        if isinstance(request, WaitFor):
+            job._wait = request; job._wake_at = self.clock.time() + request.timeout
+            request.future.add_done_callback(lambda _: self.wake())
+        else: job._wake_at = self.clock.time() + max(float(request or 0), 0.0)
+
+    def _stop(self, job):
+        if job._wait is not None: job._wait.future.cancel()
+        try: job._gen.close()  # runs the sequence's finally blocks
+        except Exception as e: print(f"Job {job.name} failed while stopping: {e!r}")
+        if job._stop == "preempted":
+            print(f"Job {job.name} preempted; it will restart later.")
+            self._count(job.name, "preempted"); self._observe_run(job)
+            with self._lock:
+                self.running = None; job.state = "queued"; job._stop = None; job._gen = None; job._wake_at = None
+                job._queued_at = self.clock.time()
+                heapq.heappush(self._queue, (job.priority, next(self._seq), job))
+        else: self._finish(job, job._stop)
+
+    def _finish(self, job, state):
+        with self._lock: self.running = None
+        job.state = state; job._gen = None; job.done.set()
+        self._count(job.name, state); self._observe_run(job)
+
+    def _count(self, name, outcome): self.outcomes.add((name, outcome))
+
+    def _observe_run(self, job):
+        self.run_time.setdefault(job.name, Histogram(Histogram.SLOW_BOUNDS)).observe(self.clock.time() - job._started_at)
@@ -0,0 +1,147 @@
+# log_writer.py
+
+import os
+import csv
+import time
+import queue
+import datetime
+import threading
+
+import numpy as np
+from config import *
+from stats import Histogram
+from protocol import TEMP_MISSING, LIGHT_MISSING, actuator_bits
+
+# -- Binary log format (LOG_DIR/<date>.bin)
+# 16-byte header: 8-byte magic + int64 base timestamp (ms since epoch), then fixed-width
+# little-endian records. Each field is stored at a fixed offset, so np.memmap exposes every
+# column as a strided view without parsing.
+BIN_MAGIC = b"BRLOG\x00\x01\x00"
+BIN_HEADER_SIZE = 16
+RECORD_DTYPE = np.dtype([
+    ('dt_ms', '<u4'),                  # ms since the header's base timestamp
+    ('t1', '<i2'), ('t2', '<i2'),      # centi-degrees C, TEMP_MISSING if absent
+    ('l1', '<u2'), ('l2', '<u2'),      # raw photodiode counts, LIGHT_MISSING if absent
+    ('od', '<f4'),                     # NaN if no OD reading in this sample
+    ('actuators', 'u1'),               # bit i set = ACTUATORS[i] on
+])
+
+def sample_from_readings(ts_ms, readings):
+    """Snapshot of the values that get logged, taken on the control thread."""
+    return (ts_ms, readings.get('t1'), readings.get('t2'), readings.get('l1'), readings.get('l2'),
+            readings.get('od_for_graph'), actuator_bits(readings))
+
+def _centi(temp): return TEMP_MISSING if temp is None or temp != temp else min(max(round(temp * 100), -32767), 32767)
+def _count(light): return LIGHT_MISSING if light is None else min(max(int(light), 0), LIGHT_MISSING - 1)
+
+def record_fields(base_ts, ts, t1, t2, l1, l2, od, bits):
+    """One RECORD_DTYPE row of a sample, every field clamped into its column (a sample from before
+    base_ts, e.g. after the clock was stepped back, gets dt_ms 0). Raises TypeError or ValueError
+    for values that aren't numbers at all."""
+    return (min(max(int(ts) - base_ts, 0), 0xFFFFFFFF), _centi(t1), _centi(t2), _count(l1), _count(l2),
+            np.nan if od is None else float(od), int(bits) & 0xFF)
+
+def open_binary_log(path):
+    """Returns (base_ts_ms, records) with records a read-only memmap of RECORD_DTYPE."""
+    with open(path, "rb") as f: header = f.read(BIN_HEADER_SIZE)
+    if len(header) < BIN_HEADER_SIZE or header[:8] != BIN_MAGIC: raise ValueError(f"{path} is not a binary log")
+    base_ts = int(np.frombuffer(header, '<i8', 1, 8)[0])
+    n = (os.path.getsize(path) - BIN_HEADER_SIZE) // RECORD_DTYPE.itemsize
+    if n == 0: return base_ts, np.empty(0, RECORD_DTYPE)
+    return base_ts, np.memmap(path, RECORD_DTYPE, "r", BIN_HEADER_SIZE, (n,))
+
+class _DayFiles:
+    """Open CSV (and binary) files for one log directory and day."""
+    def __init__(self, log_dir, day, binary):
+        self.day = day
+        self.csv_f = (log_dir / f"{day}.csv").open("a", newline="")
+        if self.csv_f.tell() == 0: csv.writer(self.csv_f).writerow(["timestamp_utc", "t1", "t2", "l1", "l2", "od"])
+        self.bin_f = None; self.base_ts = None
+        if binary:
+            self.bin_f = (log_dir / f"{day}.bin").open("a+b")
+            size = self.bin_f.seek(0, os.SEEK_END)
+            if size >= BIN_HEADER_SIZE:
+                self.bin_f.seek(0); header = self.bin_f.read(BIN_HEADER_SIZE)
+                self.base_ts = int(np.frombuffer(header, '<i8', 1, 8)[0])
+                # Drop a record left half-written by a crash.
+                partial = (size - BIN_HEADER_SIZE) % RECORD_DTYPE.itemsize
+                if partial: self.bin_f.truncate(size - partial)
+            elif size: self.bin_f.truncate(0)
+
+    def write(self, samples):
+        """Appends the samples; returns how many were dropped as malformed."""
+        if self.bin_f is not None and self.base_ts is None:
+            self.base_ts = samples[0][0]
+            self.bin_f.write(BIN_MAGIC + np.int64(self.base_ts).astype('<i8').tobytes())
+        rows = []; good = []
+        for sample in samples:
+            try: rows.append(record_fields(self.base_ts or 0, *sample)); good.append(sample)
+            except (TypeError, ValueError, OverflowError): pass
+        csv.writer(self.csv_f).writerows(
+            [datetime.datetime.fromtimestamp(s[0] / 1000, datetime.timezone.utc).replace(tzinfo=None).isoformat(timespec="seconds"),
+             *s[1:6]] for s in good)
+        if self.bin_f is not None and rows: self.bin_f.write(np.array(rows, dtype=RECORD_DTYPE).tobytes())
+        return len(samples) - len(good)
+
+    def flush(self, fsync):
+        for f in (self.csv_f, self.bin_f):
+            if f is None: continue
+            f.flush()
+            if fsync: os.fsync(f.fileno())
+
+    def close(self):
+        self.flush(fsync=True); self.csv_f.close()
+        if self.bin_f is not None: self.bin_f.close()
+
+class LogWriter(threading.Thread):
+    """Background writer: the control loop only enqueues samples; they are written in batches,
+    rotated per day and fsync'ed at most every fsync_interval seconds. One writer can serve many log directories."""
+    def __init__(self, binary=LOG_BINARY, flush_interval=LOG_FLUSH_INTERVAL_S, fsync_interval=LOG_FSYNC_INTERVAL_S):
+        super().__init__(daemon=True, name="log-writer")
+        self.binary = binary; self.flush_interval = flush_interval; self.fsync_interval = fsync_interval
+        self._q = queue.SimpleQueue(); self._files = {}; self._last_fsync = time.monotonic()
+        self.stats = {'samples': 0, 'write_errors': 0, 'bad_samples': 0}; self.write_time = Histogram()
+
+    def log(self, log_dir, sample): self._q.put((log_dir, sample))
+
+    def queue_depth(self): return self._q.qsize()
+
+    def close(self):
+        """Flushes everything queued so far and stops the writer."""
+        self._q.put(None); self.join()
+
+    def run(self):
+        while True:
+            batch = [self._q.get()]  # idle until there is something to write
+            if batch[0] is not None: time.sleep(self.flush_interval)
+            try:
+                while True: batch.append(self._q.get_nowait())
+            except queue.Empty: pass
+            stop = None in batch; started = time.perf_counter()
+            # Nothing may end this thread: logging would stop silently.
+            try: self.stats['samples'] += self._write(item for item in batch if item is not None)
+            except OSError as e: print(f"Log writer: could not write {len(batch)} samples: {e}"); self.stats['write_errors'] += 1
+            except Exception as e: print(f"Log writer: batch of {len(batch)} samples failed: {e!r}"); self.stats['write_errors'] += 1
+            self.write_time.observe(time.perf_counter() - started)
+            if stop:
+                for files in self._files.values(): files.close()
+                return
+
+    def _write(self, batch):
+        """Writes the batch and returns how many samples were written; malformed ones are counted and dropped."""
+        by_file = {}; written = 0; bad = 0
+        for log_dir, sample in batch:
+            try: day = datetime.date.fromtimestamp(sample[0] / 1000)
+            except (TypeError, ValueError, OverflowError, OSError, IndexError): bad += 1; continue
+            by_file.setdefault((log_dir, day), []).append(sample)
+        for (log_dir, day), samples in by_file.items():
+            files = self._files.get(log_dir)
+            if files is None or files.day != day:
+                if files is not None: files.close()  # day rotation
+                files = self._files[log_dir] = _DayFiles(log_dir, day, self.binary)
+            dropped = files.write(samples); bad += dropped; written += len(samples) - dropped
+        if bad: print(f"Log writer: dropped {bad} malformed samples."); self.stats['bad_samples'] += bad
+        fsync = time.monotonic() - self._last_fsync >= self.fsync_interval
+        for files in self._files.values(): files.flush(fsync)
+        if fsync: self._last_fsync = time.monotonic()
+        return written
@@ -0,0 +1,114 @@
+# metrics.py
+
+import math
+import threading
+
+class ThreadCounters:
+    """Counters that any number of threads increment without locking: each thread adds to a dict of
+    its own, and the per-thread dicts are only summed when the totals are read."""
+    def __init__(self):
+        self._local = threading.local(); self._lock = threading.Lock()
+        self._threads = []; self._retired = {}  # (thread, its counts); totals of threads that have exited
+
+    def add(self, name, n=1):
+        counts = getattr(self._local, "counts", None)
+        if counts is None:
+            counts = self._local.counts = {}
+            with self._lock: self._threads.append((threading.current_thread(), counts))
+        counts[name] = counts.get(name, 0) + n
+
+    def totals(self):
+        with self._lock:
+            for entry in [entry for entry in self._threads if not entry[0].is_alive()]:
+                self._threads.remove(entry); self._merge(self._retired, entry[1])
+            totals = dict(self._retired)
+            for _, counts in self._threads: self._merge(totals, counts.copy())  # dict.copy() is atomic under the GIL
+        return totals
+
+    @staticmethod
+    def _merge(into, counts):
+        for name, n in counts.items(): into[name] = into.get(name, 0) + n
+
+def _escape(value): return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(labels):
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}" if labels else ""
+
+class Exposition:
+    """Builds a Prometheus text exposition (format 0.0.4)."""
+    def __init__(self): self.lines = []
+
+    def add(self, name, kind, help, samples):
+        """samples: (labels, value) pairs; kind is 'counter' or 'gauge'."""
+        self.lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+        self.lines += [f"{name}{_labels(labels)} {value:g}" for labels, value in samples if value is not None]
+
+    def add_histograms(self, name, help, samples):
+        """samples: (labels, stats.Histogram) pairs."""
+        self.lines += [f"# HELP {name} {help}", f"# TYPE {name} histogram"]
+        for labels, hist in samples:
+            cumulative = 0
+            for bound, count in zip(hist.bounds + (math.inf,), list(hist.counts)):
+                cumulative += count
+                self.lines.append(f"{name}_bucket{_labels({**labels, 'le': '+Inf' if bound == math.inf else f'{bound:g}'})} {cumulative}")
+            self.lines += [f"{name}_sum{_labels(labels)} {hist.sum:g}", f"{name}_count{_labels(labels)} {cumulative}"]
+
+    def text(self): return "\n".join(self.lines) + "\n"
+
+def _items(d):
+    """Sorted items of a dict another thread may be adding to; dict.copy() is atomic under the GIL,
+    iterating the live dict is not."""
+    return sorted(d.copy().items())
+
+def render(controllers):
+    """The /metrics page for {reactor id: BioreactorController}. Everything is read here, on scrape;
+    the instrumented code only bumps plain counters and histograms owned by the thread updating them."""
+    out = Exposition(); ctls = list(controllers.values())
+    def r(ctl, **labels): return {"reactor": ctl.reactor_id, **labels}
+
+    out.add_histograms("bioreactor_step_seconds", "Duration of one control loop step.", [(r(c), c.step_time) for c in ctls])
+    out.add_histograms("bioreactor_timer_lateness_seconds", "How late each control timer fired.",
+                       [(r(c, timer=name), h) for c in ctls for name, h in _items(c.scheduler.jitter)])
+    out.add("bioreactor_serial_bytes_total", "counter", "Bytes read from and written to the device.",
+            [(r(c, direction=d), c.link_stats[f"bytes_{d}"]) for c in ctls for d in ("in", "out")])
+    out.add("bioreactor_serial_packets_total", "counter", "Sensor packets received.", [(r(c), c.link_stats["packets"]) for c in ctls])
+    out.add("bioreactor_serial_errors_total", "counter", "Frames that could not be used, by cause.",
+            [(r(c, kind=kind), c.link_stats[key]) for c in ctls for kind, key in
+             (("decode", "decode_errors"), ("crc", "crc_errors"), ("dropped", "dropped_frames"), ("resync", "resyncs"))])
+    out.add("bioreactor_serial_binary", "gauge", "1 while the binary protocol is in use.", [(r(c), int(c.binary_link)) for c in ctls])
+    out.add("bioreactor_command_retries_total", "counter", "Actuator commands resent for lack of an echo.",
+            [(r(c), c.link_stats["command_retries"]) for c in ctls])
+    out.add("bioreactor_commands_unacked_total", "counter", "Actuator commands the device never confirmed.",
+            [(r(c), c.link_stats["commands_unacked"]) for c in ctls])
+    out.add_histograms("bioreactor_command_latency_seconds", "Time from sending an actuator command to its echo.",
+                       [(r(c, actuator=name), h) for c in ctls for name, h in _items(c.command_latency)])
+    out.add("bioreactor_out_queue_depth", "gauge", "Commands waiting to be sent.", [(r(c), c.out_q.qsize()) for c in ctls])
+
+    out.add("bioreactor_jobs_queued", "gauge", "Automation jobs waiting to run.", [(r(c), len(c.jobs.pending())) for c in ctls])
+    out.add("bioreactor_jobs_total", "counter",
+            "Automation jobs by outcome; 'deduplicated' counts triggers dropped because the job was already pending.",
+            [(r(c, job=name, outcome=outcome), n) for c in ctls for (name, outcome), n in sorted(c.jobs.outcomes.totals().items())])
+    out.add_histograms("bioreactor_job_wait_seconds", "Time automation jobs spent queued before running.",
+                       [(r(c, job=name), h) for c in ctls for name, h in _items(c.jobs.wait_time)])
+    out.add_histograms("bioreactor_job_run_seconds", "Time automation jobs held their actuators.",
+                       [(r(c, job=name), h) for c in ctls for name, h in _items(c.jobs.run_time)])
+
+    sse = [(c, c.hub.sent.totals()) for c in ctls]
+    out.add("bioreactor_sse_clients", "gauge", "Connected /stream clients.", [(r(c), c.hub.subscribers) for c in ctls])
+    out.add("bioreactor_sse_bytes_total", "counter", "Bytes sent to /stream clients.", [(r(c), t.get("bytes", 0)) for c, t in sse])
+    out.add("bioreactor_sse_frames_total", "counter", "Events and heartbeats sent to /stream clients.",
+            [(r(c), t.get("frames", 0)) for c, t in sse])
+
+    stores = [(c, c.state_store.stats) for c in ctls if c.state_store is not None]
+    out.add("bioreactor_snapshots_total", "counter", "State snapshots written.", [(r(c), s["snapshots"]) for c, s in stores])
+    out.add("bioreactor_journal_entries_total", "counter", "State changes journaled.", [(r(c), s["journal_entries"]) for c, s in stores])
+
+    writers = list({id(c.log_writer): c.log_writer for c in ctls}.values())  # a fleet shares one writer
+    out.add("bioreactor_log_queue_depth", "gauge", "Samples waiting for the log writer.", [({"writer": w.name}, w.queue_depth()) for w in writers])
+    out.add("bioreactor_log_samples_total", "counter", "Samples written to the logs.", [({"writer": w.name}, w.stats["samples"]) for w in writers])
+    out.add("bioreactor_log_write_errors_total", "counter", "Log batches that failed to write.",
+            [({"writer": w.name}, w.stats["write_errors"]) for w in writers])
+    out.add("bioreactor_log_bad_samples_total", "counter", "Malformed samples the log writer dropped.",
+            [({"writer": w.name}, w.stats["bad_samples"]) for w in writers])
+    out.add_histograms("bioreactor_log_write_seconds", "Time to write one batch of log samples.", [({"writer": w.name}, w.write_time) for w in writers])
+    return out.text()
@@ -0,0 +1,46 @@
+# od_burst.py
+
+import math
+import statistics
+import collections
+from concurrent.futures import Future
+
+from config import *
+
+def sample_od(l1, l2):
+    """OD of one photodiode pair, or None if either reading is missing or not positive."""
+    return -math.log10(l2 / l1) if l1 and l2 and l1 > 0 and l2 > 0 else None
+
+def robust_od(values, cutoff=OD_OUTLIER_MADS):
+    """(mean, samples kept) of the values within cutoff scaled median absolute deviations of their
+    median; a bubble or a speck of debris passing the beam doesn't move the reading."""
+    median = statistics.median(values)
+    limit = cutoff * 1.4826 * statistics.median(abs(v - median) for v in values)
+    kept = [v for v in values if abs(v - median) <= limit]
+    return statistics.fmean(kept), len(kept)
+
+class ODBurst:
+    """The photodiode samples of one OD measurement, fed from the serial reader while the device
+    streams a burst with the IR LED on. First `settled` resolves, with the standard deviation, once
+    the ODs of the last `window` samples vary less than settle_std. After start_measuring(),
+    `measured` resolves with the next `samples` ODs. Both futures are resolved on the control thread."""
+    def __init__(self, window=OD_SETTLE_WINDOW, settle_std=OD_SETTLE_STD, samples=OD_BURST_SAMPLES):
+        self.settle_std = settle_std; self.samples = samples
+        self.recent = collections.deque(maxlen=window); self.std = None
+        self.values = None; self.last_pair = None
+        self.settled = Future(); self.measured = Future()
+
+    def add(self, l1, l2):
+        od = sample_od(l1, l2)
+        if od is None: return
+        self.last_pair = (l1, l2)
+        if self.values is not None:
+            self.values.append(od)
+            if len(self.values) >= self.samples and not self.measured.done(): self.measured.set_result(list(self.values))
+            return
+        self.recent.append(od)
+        if len(self.recent) < self.recent.maxlen: return
+        self.std = statistics.stdev(self.recent)
+        if self.std < self.settle_std and not self.settled.done(): self.settled.set_result(self.std)
+
+    def start_measuring(self): self.values = []
@@ -0,0 +1,113 @@
+# protocol.py
+"""Compact binary serial protocol, negotiated at startup as an alternative to JSON lines.
+
+The host asks for it with the JSON command {"cmd": "proto", "mode": "bin", "hz": N}. A device
+that supports it answers with the line {"proto": "bin"} and from then on both sides exchange
+COBS-encoded frames terminated by a 0x00 byte. Decoded, a frame is a type byte, a little-endian
+payload and the CRC16-CCITT (init 0xFFFF) of everything before it. Devices that don't know the
+command ignore it, and the link stays on JSON lines. A host that finds the device already sending
+binary frames (it restarted, the device didn't) switches to binary without asking.
+
+A BURST frame (or the JSON command {"cmd": "burst", "samples": N, "interval_ms": M}) asks the
+device to send its next N sensor packets every M ms instead of at the negotiated rate, for OD
+measurements; N = 0 ends a burst early.
+"""
+
+import json
+import struct
+import binascii
+
+ACTUATORS = ("heater", "stir", "lights", "aerator", "pump1", "pump2", "irled")  # bit order in frames
+
+FRAME_SENSOR = 0x01
+FRAME_SET = 0x02
+FRAME_BURST = 0x03
+SENSOR = struct.Struct('<BHhhHHB')  # type, seq, t1, t2 (centi-degrees C), l1, l2, actuator bits
+SET = struct.Struct('<BHBB')        # type, seq, mask of actuators to change, their new states
+BURST = struct.Struct('<BHHH')      # type, seq, sensor packets to send, ms between them
+CRC = struct.Struct('<H')
+TEMP_MISSING = -32768
+LIGHT_MISSING = 0xFFFF
+
+class FrameError(ValueError): pass
+
+def crc16(data):
+    """CRC16-CCITT (polynomial 0x1021, init 0xFFFF); binascii does the table lookups in C."""
+    return binascii.crc_hqx(data, 0xFFFF)
+
+def cobs_encode(data):
+    # Every zero ends a block; runs of 254 non-zero bytes are split into blocks of their own (code 0xFF).
+    out = bytearray()
+    for chunk in data.split(b"\x00"):
+        while len(chunk) >= 0xFE: out.append(0xFF); out += chunk[:0xFE]; chunk = chunk[0xFE:]
+        out.append(len(chunk) + 1); out += chunk
+    return bytes(out)
+
+def cobs_decode(data):
+    if len(data) <= 0xFF and data and data[0] == len(data):  # the common case: one block, no zeros
+        return bytes(data[1:])
+    out = bytearray(); i = 0; n = len(data)
+    while i < n:
+        code = data[i]
+        if code == 0 or i + code > n: raise FrameError("bad COBS encoding")
+        out += data[i + 1:i + code]; i += code
+        if code < 0xFF and i < n: out.append(0)
+    return bytes(out)
+
+def encode_frame(payload):
+    return cobs_encode(payload + CRC.pack(crc16(payload))) + b"\x00"
+
+def decode_frame(frame):
+    """Payload of one frame (without its 0x00 terminator); raises FrameError on corruption."""
+    body = cobs_decode(frame)
+    if len(body) < 3 or CRC.unpack_from(body, len(body) - 2)[0] != crc16(body[:-2]): raise FrameError("CRC mismatch")
+    return body[:-2]
+
+def actuator_bits(states):
+    bits = 0
+    for i, name in enumerate(ACTUATORS):
+        if states.get(name): bits |= 1 << i
+    return bits
+
+def encode_sensor(seq, t1, t2, l1, l2, states):
+    return encode_frame(SENSOR.pack(
+        FRAME_SENSOR, seq & 0xFFFF,
+        TEMP_MISSING if t1 is None else round(t1 * 100), TEMP_MISSING if t2 is None else round(t2 * 100),
+        LIGHT_MISSING if l1 is None else int(l1), LIGHT_MISSING if l2 is None else int(l2),
+        actuator_bits(states)))
+
+def encode_set(seq, changes):
+    """One SET frame carrying any number of actuator changes."""
+    mask = values = 0
+    for i, name in enumerate(ACTUATORS):
+        if name in changes:
+            mask |= 1 << i
+            if changes[name]: values |= 1 << i
+    return encode_frame(SET.pack(FRAME_SET, seq & 0xFFFF, mask, values))
+
+def encode_burst(seq, samples, interval_ms):
+    return encode_frame(BURST.pack(FRAME_BURST, seq & 0xFFFF, samples, interval_ms))
+
+# Actuator states of every possible bits byte, so decoding a sensor frame is one dict update.
+_STATES = [{name: (bits >> i) & 1 for i, name in enumerate(ACTUATORS)} for bits in range(256)]
+
+def decode_payload(payload):
+    """(frame type, seq, fields) of a decoded payload. Sensor fields use the same keys as JSON packets."""
+    if payload[0] == FRAME_SENSOR and len(payload) == SENSOR.size:
+        _, seq, t1, t2, l1, l2, bits = SENSOR.unpack(payload)
+        pkt = {"t1": None if t1 == TEMP_MISSING else t1 / 100, "t2": None if t2 == TEMP_MISSING else t2 / 100,
+               "l1": None if l1 == LIGHT_MISSING else l1, "l2": None if l2 == LIGHT_MISSING else l2}
+        pkt.update(_STATES[bits])
+        return FRAME_SENSOR, seq, pkt
+    if payload[0] == FRAME_SET and len(payload) == SET.size:
+        _, seq, mask, values = SET.unpack(payload)
+        return FRAME_SET, seq, {name: (values >> i) & 1 for i, name in enumerate(ACTUATORS) if mask >> i & 1}
+    if payload[0] == FRAME_BURST and len(payload) == BURST.size:
+        _, seq, samples, interval_ms = BURST.unpack(payload)
+        return FRAME_BURST, seq, {"samples": samples, "interval_ms": interval_ms}
+    raise FrameError(f"unknown frame type {payload[0]:#x} ({len(payload)} bytes)")
+
+def negotiate_request(hz):
+    return (json.dumps({"cmd": "proto", "mode": "bin", "hz": hz}) + "\n").encode()
+
+NEGOTIATE_ACK = {"proto": "bin"}
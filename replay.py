@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# replay.py
+
+import sys
+import time
+import json
+import pstats
+import argparse
+import cProfile
+import tempfile
+
+import protocol
+from clock import VirtualClock
+from serial_io import read_trace, TRACE_IN, TRACE_OUT
+from bioreactor_controller import BioreactorController
+
+# The replay runs every step at the exact deadline or packet time, the live controller a few ms
+# later, so replayed commands can be that much early; a command further off than this is a divergence.
+# A trace recorded on a sped-up clock (soak.py) needs this times the speed-up.
+REPLAY_WINDOW_S = 1.0
+
+class ReplayTransport:
+    """Hands recorded device traffic to the controller and keeps what the controller writes."""
+    def __init__(self, clock):
+        self.clock = clock; self._pending = bytearray(); self.written = []  # (time, data)
+
+    def feed(self, data): self._pending += data
+
+    def readinto(self, buf):
+        n = min(len(buf), len(self._pending))
+        buf[:n] = self._pending[:n]; del self._pending[:n]
+        return n
+
+    def write(self, data): self.written.append((self.clock.time(), bytes(data)))
+    def close(self): pass
+
+def decode_commands(data):
+    """Readable form of one outbound write: JSON lines as dicts, binary SET frames as {"cmd": "set", ...}."""
+    if data.endswith(b"\n"): return [json.loads(line) for line in data.splitlines() if line.strip()]
+    out = []
+    for frame in data.split(b"\0")[:-1]:
+        try: kind, _, changes = protocol.decode_payload(protocol.decode_frame(frame))
+        except protocol.FrameError: out.append({"undecodable": frame.hex()}); continue
+        if kind == protocol.FRAME_SET: out.append({"cmd": "set", **changes})
+    return out
+
+def _settled_step(ctl):
+    # A step can queue work for the next one (reschedules, commands); run until nothing is left.
+    while True:
+        ctl.step()
+        if not ctl._reschedule_requested and (ctl.out_q.empty() or ctl._negotiating): return
+
+def replay(records, **controller_args):
+    """Runs a controller against the inbound side of a trace on a virtual clock.
+    Returns the controller and the list of (time, command) it sent."""
+    records = list(records)
+    if not records: raise ValueError("empty trace")
+    clock = VirtualClock(records[0][0]); transport = ReplayTransport(clock)
+    ctl = BioreactorController("replay", clock=clock, transport=transport, trace_dir=None, snapshot_interval=0,
+                              **controller_args)
+
+    def run_until(t):
+        while (deadline := ctl.scheduler.next_deadline()) is not None and deadline <= t:
+            clock.advance_to(deadline); _settled_step(ctl)
+        clock.advance_to(t)
+
+    _settled_step(ctl)
+    for t, direction, data in records:
+        if direction != TRACE_IN: continue
+        run_until(t); transport.feed(data); _settled_step(ctl)
+    return ctl, [(t, cmd) for t, data in transport.written for cmd in decode_commands(data)]
+
+def recorded_commands(records):
+    return [(t, cmd) for t, direction, data in records if direction == TRACE_OUT for cmd in decode_commands(data)]
+
+def command_streams(commands):
+    """The commands per actuator, {name: [(time, value), ...]}, and per other command, {cmd: [(time, fields), ...]}.
+    Changes of different actuators made within a few ms of each other may be sent in either order or
+    in one set command, depending on the scheduling latency of the run, so they are compared apart."""
+    streams = {}
+    for t, cmd in commands:
+        if cmd.get("cmd") != "set": streams.setdefault(cmd.get("cmd"), []).append((t, cmd)); continue
+        for name, value in cmd.items():
+            if name != "cmd": streams.setdefault(name, []).append((t, value))
+    return streams
+
+def first_difference(recorded, replayed, window):
+    """(time, name, recorded (time, value) or None, replayed (time, value) or None) of the earliest
+    change that is missing, different or more than window seconds off in the replay; None if they match."""
+    recorded, replayed = command_streams(recorded), command_streams(replayed); found = []
+    for name in recorded.keys() | replayed.keys():
+        a, b = recorded.get(name, []), replayed.get(name, [])
+        for i in range(max(len(a), len(b))):
+            x = a[i] if i < len(a) else None; y = b[i] if i < len(b) else None
+            if x is None or y is None or x[1] != y[1] or abs(x[0] - y[0]) > window:
+                found.append((min(c[0] for c in (x, y) if c is not None), str(name), x, y)); break
+    return min(found, default=None)
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays a recorded serial trace through the controller on a virtual clock.")
+    parser.add_argument("trace")
+    parser.add_argument("--setpoints", type=json.loads, default=None, help='JSON object, e.g. \'{"temperature": 30}\'')
+    parser.add_argument("--out", help="write the replayed commands to this file as JSON lines")
+    parser.add_argument("--profile", action="store_true", help="profile the replay and print the hottest functions")
+    parser.add_argument("--window", type=float, default=REPLAY_WINDOW_S,
+                        help="seconds a replayed command may be early or late (default %(default)s, times the speed-up of a sped-up recording)")
+    args = parser.parse_args()
+
+    records = list(read_trace(args.trace))
+    if not records: sys.exit(f"{args.trace}: no records")
+    profiler = cProfile.Profile() if args.profile else None
+    with tempfile.TemporaryDirectory() as log_dir:
+        started = time.perf_counter()
+        if profiler: profiler.enable()
+        ctl, commands = replay(records, setpoints=args.setpoints, log_dir=log_dir)
+        if profiler: profiler.disable()
+        elapsed = time.perf_counter() - started
+        ctl.log_writer.close()
+    span = records[-1][0] - records[0][0]
+    print(f"Replayed {span / 3600:.2f} h of traffic ({ctl.link_stats['packets']} packets) in {elapsed:.2f} s "
+          f"({span / max(elapsed, 1e-9):.0f}x real time).")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            for t, cmd in commands: f.write(json.dumps({"t": round(t, 3), **cmd}) + "\n")
+    recorded = recorded_commands(records)
+    # Control decisions must match the recorded ones; timing may differ within the window.
+    difference = first_difference(recorded, commands, args.window)
+    if difference is None: print(f"All {len(recorded)} recorded commands match the replay ({len(commands)} replayed).")
+    else:
+        t, name, was, now = difference; t0 = records[0][0]
+        def show(change): return "nothing" if change is None else f"{json.dumps(change[1])} at {change[0] - t0:.3f}s"
+        print(f"Commands diverge at {t - t0:.3f}s for {name}: recorded {show(was)}, replayed {show(now)}.")
+    if profiler: pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+    if difference is not None: sys.exit(1)
+
+if __name__ == "__main__":
+    main()
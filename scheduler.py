@@ -0,0 +1,48 @@
+# scheduler.py
+
+import os
+import heapq
+import itertools
+
+from stats import Histogram
+
+class DeadlineScheduler:
+    """Min-heap of named deadlines. Arming a name again supersedes its previous deadline."""
+    def __init__(self):
+        self._heap = []; self._armed = {}; self._seq = itertools.count()
+        self.jitter = {}  # name -> Histogram of how late each deadline actually fired
+
+    def arm(self, name, deadline):
+        if deadline is None: self._armed.pop(name, None); return
+        entry = (deadline, next(self._seq), name)
+        self._armed[name] = entry; heapq.heappush(self._heap, entry)
+
+    def next_deadline(self):
+        # Superseded entries are discarded lazily once they reach the top of the heap.
+        while self._heap and self._armed.get(self._heap[0][2]) is not self._heap[0]: heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now):
+        due = []
+        while (deadline := self.next_deadline()) is not None and deadline <= now:
+            name = heapq.heappop(self._heap)[2]; del self._armed[name]
+            self.jitter.setdefault(name, Histogram()).observe(now - deadline)
+            due.append(name)
+        return due
+
+class Waker:
+    """Self-pipe that lets other threads interrupt a select() waiting on it."""
+    def __init__(self):
+        self._r, self._w = os.pipe()
+        os.set_blocking(self._r, False); os.set_blocking(self._w, False)
+
+    def fileno(self): return self._r
+
+    def wake(self):
+        try: os.write(self._w, b"\0")
+        except BlockingIOError: pass  # pipe already full, a wakeup is pending anyway
+
+    def drain(self):
+        try:
+            while os.read(self._r, 4096): pass
+        except BlockingIOError: pass
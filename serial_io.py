@@ -0,0 +1,163 @@
+# serial_io.py
+
+import json
+import struct
+import pathlib
+import threading
+
+import serial
+from config import *
+from clock import SYSTEM_CLOCK
+import protocol
+
+# A transport is anything with readinto(buf) -> bytes read (0 when nothing is waiting), write(data),
+# fileno() and close(); a serial.Serial opened with timeout=0 is one.
+
+class SocketTransport:
+    """Transport over a connected socket, e.g. the host end of a SimEngine socket pair."""
+    def __init__(self, sock): self.sock = sock; sock.setblocking(False)
+
+    def readinto(self, buf):
+        try: n = self.sock.recv_into(buf)
+        except BlockingIOError: return 0
+        if n == 0 and len(buf): raise ConnectionError("socket closed by the device")
+        return n
+
+    def write(self, data): self.sock.sendall(data)
+    def fileno(self): return self.sock.fileno()
+    def close(self): self.sock.close()
+
+# -- Serial traces: a sequence of records (float64 clock time, direction, uint32 length, data)
+TRACE_RECORD = struct.Struct('<dcI')
+TRACE_IN = b'<'; TRACE_OUT = b'>'
+
+def read_trace(path):
+    """Yields (time, direction, data) for every record of a trace file."""
+    with open(path, "rb") as f:
+        while len(header := f.read(TRACE_RECORD.size)) == TRACE_RECORD.size:
+            t, direction, n = TRACE_RECORD.unpack(header)
+            data = f.read(n)
+            if len(data) < n: return  # cut off by a crash
+            yield t, direction, data
+
+class RecordingTransport:
+    """Wraps a transport and appends all traffic through it, with clock timestamps, to a trace file."""
+    def __init__(self, inner, path, clock=SYSTEM_CLOCK):
+        self.inner = inner; self.clock = clock; self._f = open(path, "ab", buffering=1 << 16)
+
+    def _record(self, direction, data):
+        self._f.write(TRACE_RECORD.pack(self.clock.time(), direction, len(data))); self._f.write(data)
+
+    def readinto(self, buf):
+        n = self.inner.readinto(buf)
+        if n: self._record(TRACE_IN, buf[:n])
+        return n
+
+    def write(self, data): self._record(TRACE_OUT, data); self.inner.write(data)
+    def fileno(self): return self.inner.fileno()
+    def close(self): self._f.close(); self.inner.close()
+
+class SerialLink:
+    """The only reader of one serial port. Reads never block: whatever is waiting is read into a
+    reusable buffer, framed incrementally (JSON lines, or 0x00-terminated COBS frames once the
+    binary protocol is on) and each decoded packet is handed to the subscribers."""
+    def __init__(self, port, baud=BAUD, name="default", transport=None, clock=SYSTEM_CLOCK, trace_dir=SERIAL_TRACE_DIR):
+        self.name = name
+        if transport is None: transport = serial.Serial(port, baud, timeout=0)
+        if trace_dir is not None:
+            trace_dir = pathlib.Path(trace_dir); trace_dir.mkdir(parents=True, exist_ok=True)
+            transport = RecordingTransport(transport, trace_dir / f"{name}.trace", clock)
+        self.ser = transport
+        self._write_lock = threading.Lock()
+        self._buf = bytearray(2 * SERIAL_MAX_FRAME_BYTES); self._view = memoryview(self._buf)
+        self._start = self._end = self._scan = 0  # pending bytes are _buf[_start:_end]; _scan: next byte to search
+        self.binary = False; self._rx_seq = None
+        self.stats = {'packets': 0, 'decode_errors': 0, 'crc_errors': 0, 'dropped_frames': 0, 'resyncs': 0, 'bytes_in': 0, 'bytes_out': 0}
+        self._subscribers = []
+        self.on_mode_change = None  # called with the new mode (True = binary) from the reading thread
+
+    def fileno(self): return self.ser.fileno()
+
+    def subscribe(self, callback):
+        """callback(pkt) runs on the reading thread for every sensor packet, in arrival order."""
+        self._subscribers.append(callback)
+
+    def write(self, data):
+        with self._write_lock: self.ser.write(data); self.stats['bytes_out'] += len(data)
+
+    def poll(self):
+        """Reads and dispatches everything the port has buffered. Returns the number of bytes read."""
+        total = 0
+        while True:
+            if self._end == len(self._buf): self._compact()
+            n = self.ser.readinto(self._view[self._end:])
+            if not n: self.stats['bytes_in'] += total; return total
+            self._end += n; total += n
+            self._frame()
+
+    def _compact(self):
+        pending = self._end - self._start
+        self._buf[:pending] = bytes(self._view[self._start:self._end])
+        self._scan -= self._start; self._start = 0; self._end = pending
+
+    def _frame(self):
+        while self._start < self._end:
+            if self.binary:
+                # Binary frames can't change the mode, so everything up to the last terminator is split at once.
+                last = self._buf.rfind(b"\0", self._scan, self._end)
+                if last < 0: break
+                frames = bytes(self._view[self._start:last]).split(b"\0"); self._start = self._scan = last + 1
+                for frame in frames: self._handle_binary(frame)
+                continue
+            # A JSON line can switch the link to binary, so the delimiter is looked up again after each one.
+            end = self._buf.find(b"\n", self._scan, self._end)
+            # JSON never contains a zero byte: one before the next newline ends a binary frame, so the
+            # device is still on the binary protocol (e.g. only the host restarted).
+            zero = self._buf.find(b"\0", self._scan, self._end if end < 0 else end)
+            if zero >= 0:
+                frame = bytes(self._view[self._start:zero]); self._start = self._scan = zero + 1
+                self._adopt_binary(frame); continue
+            if end < 0: break
+            frame = bytes(self._view[self._start:end]); self._start = self._scan = end + 1
+            self._handle_line(frame)
+        self._scan = self._end
+        if self._start == self._end: self._start = self._end = self._scan = 0
+        elif self._end - self._start > SERIAL_MAX_FRAME_BYTES:
+            # No delimiter for this long: in binary mode the device most likely reset and is back on JSON.
+            self._start = self._end = self._scan = 0; self.stats['resyncs'] += 1
+            if self.binary: self._set_mode(False)
+
+    def _set_mode(self, binary):
+        self.binary = binary; self._rx_seq = None
+        if self.on_mode_change: self.on_mode_change(binary)
+
+    def _adopt_binary(self, frame):
+        try: protocol.decode_frame(frame)
+        except protocol.FrameError: self.stats['decode_errors'] += 1; return
+        # A lone terminator makes the device drop whatever JSON it buffered as one corrupt frame.
+        self.write(b"\0"); self.stats['resyncs'] += 1
+        self._set_mode(True); self._handle_binary(frame)
+
+    def _handle_binary(self, frame):
+        try: kind, seq, pkt = protocol.decode_payload(protocol.decode_frame(frame))
+        except protocol.FrameError: self.stats['crc_errors'] += 1; return
+        if self._rx_seq is not None: self.stats['dropped_frames'] += (seq - self._rx_seq - 1) & 0xFFFF
+        self._rx_seq = seq
+        if kind != protocol.FRAME_SENSOR: return
+        self.stats['packets'] += 1
+        self._dispatch(pkt)
+
+    def _handle_line(self, frame):
+        line = frame.decode(errors='ignore').strip()
+        if not line: return
+        try: pkt = json.loads(line)
+        except json.JSONDecodeError: pkt = None
+        if not isinstance(pkt, dict): self.stats['decode_errors'] += 1; return
+        if pkt == protocol.NEGOTIATE_ACK: self._set_mode(True); return
+        self.stats['packets'] += 1
+        self._dispatch(pkt)
+
+    def _dispatch(self, pkt):
+        for callback in self._subscribers: callback(pkt)
+
+    def close(self): self.ser.close()
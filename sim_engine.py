@@ -0,0 +1,217 @@
+# sim_engine.py
+
+import os
+import pty
+import json
+import socket
+import termios
+import tty
+import selectors
+import threading
+
+import numpy as np
+from config import CONTAINER_VOLUME_L, PUMP_FLOW_RATE_ML_MIN
+from clock import ScaledClock
+import protocol
+
+# -- Simulation Parameters (per simulated second)
+AMBIENT_TEMP = 20.0
+HEATING_RATE = 2.5
+COOLING_RATE = 0.05
+HEATER_MAX_TEMP = 90.0
+# The ideal, max reading of the source photodiode (l1)
+L1_INTENSITY = 950.0
+# How much culture_density increases per second. Adjust to make growth faster/slower.
+CULTURE_GROWTH_RATE = 0.00002
+MAX_CULTURE_DENSITY = 0.95
+# Stirring and aeration leave the culture turbulent, which adds photodiode noise that dies down
+# by this factor per second once they stop. Bubbles now and then dim l2 for one sample.
+TURBULENCE_DECAY = 0.4
+BUBBLE_PROBABILITY = 0.02
+# Fraction of the culture replaced per second while the feed pump runs.
+FEED_DILUTION_PER_S = PUMP_FLOW_RATE_ML_MIN / 60 / (CONTAINER_VOLUME_L * 1000)
+MAX_STEPS_PER_ITERATION = 1000
+
+class ReactorArray:
+    """Physical state of n reactors, one array element per reactor, advanced together."""
+    def __init__(self, n, seed=None):
+        self.n = n; self.rng = np.random.default_rng(seed)
+        self.internal_temp = np.full(n, 22.0); self.heater_temp = np.full(n, 22.0)
+        # Turbidity of each culture, from 0.0 (clear) to 1.0 (opaque)
+        self.culture_density = np.full(n, 0.05)
+        self.turbulence = np.zeros(n)  # 1 while stirring
+        self.actuators = np.zeros((n, len(protocol.ACTUATORS)), dtype=bool)  # columns in protocol.ACTUATORS order
+        self.sim_seconds = 0
+
+    def actuator(self, name): return self.actuators[:, protocol.ACTUATORS.index(name)]
+
+    def step(self, seconds=1):
+        """Advances every reactor by whole simulated seconds."""
+        heater = self.actuator('heater'); feed = self.actuator('pump1')
+        agitation = np.maximum(self.actuator('stir'), 0.5 * self.actuator('aerator'))
+        for _ in range(seconds):
+            self.heater_temp += heater * HEATING_RATE * self.rng.uniform(0.9, 1.1, self.n)
+            self.heater_temp -= (self.heater_temp - self.internal_temp) * COOLING_RATE
+            self.internal_temp -= (self.internal_temp - AMBIENT_TEMP) * (COOLING_RATE / 5)
+            transfer = np.maximum(self.heater_temp - self.internal_temp, 0.0) * 0.1
+            self.heater_temp -= transfer; self.internal_temp += transfer
+            np.minimum(self.heater_temp, HEATER_MAX_TEMP, out=self.heater_temp)
+            self.culture_density = np.minimum(self.culture_density + CULTURE_GROWTH_RATE, MAX_CULTURE_DENSITY)
+            self.culture_density *= 1 - feed * FEED_DILUTION_PER_S
+            self.turbulence = np.maximum(self.turbulence * TURBULENCE_DECAY, agitation)
+        self.sim_seconds += seconds
+
+    def readings(self, idx):
+        """Sensor values of the reactors in idx as (t1, t2, l1, l2) arrays; NaN = no reading."""
+        k = len(idx); noise = self.rng.uniform
+        t1 = np.round(self.internal_temp[idx] + noise(-0.05, 0.05, k), 2)
+        t2 = np.round(self.heater_temp[idx] + noise(-0.05, 0.05, k), 2)
+        irled = self.actuator('irled')[idx]; lights = self.actuator('lights')[idx]
+        # Photodiodes only read with the IR LED on; the main lights saturate l2 and turbulence adds noise.
+        l1 = L1_INTENSITY + noise(-5, 5, k)
+        bubbles = np.where(self.rng.random(k) < BUBBLE_PROBABILITY * (1 + 5 * self.turbulence[idx]), noise(0.85, 0.95, k), 1.0)
+        l2 = np.where(lights, 980.0 + noise(-5, 5, k),
+                      l1 * (1 - self.culture_density[idx]) * bubbles + self.turbulence[idx] * noise(-20, 20, k))
+        l1[~irled] = np.nan; l2[~irled] = np.nan
+        return t1, t2, l1, l2
+
+class SimDevice:
+    """Firmware-side serial protocol of one simulated reactor: JSON lines until the host negotiates
+    the binary protocol. No I/O of its own; the engine feeds it bytes and sends what it returns."""
+    def __init__(self, reactors, index, verbose=False):
+        self.reactors = reactors; self.index = index; self.verbose = verbose
+        self.binary = False; self.packet_rate_hz = 1.0; self.tx_seq = 0
+        self.burst_left = 0; self.burst_interval = 0.05; self.burst_started = False
+        self._buf = bytearray()
+
+    def receive(self, data):
+        """Handles incoming bytes; returns bytes to send back (negotiation acks)."""
+        self._buf += data; out = b""
+        while (end := self._buf.find(b"\0" if self.binary else b"\n")) >= 0:
+            frame = bytes(self._buf[:end]); del self._buf[:end + 1]
+            if self.binary: self._handle_frame(frame)
+            elif frame.strip(): out += self._handle_line(frame.decode(errors="ignore").strip())
+        return out
+
+    def packet_interval(self):
+        """Seconds until the next sensor packet, counting down a running burst."""
+        if not self.burst_left: return 1.0 / self.packet_rate_hz
+        self.burst_left -= 1; return self.burst_interval
+
+    def _start_burst(self, samples, interval_ms):
+        self.burst_left = max(int(samples), 0); self.burst_interval = min(max(float(interval_ms), 5.0), 1000.0) / 1000
+        self.burst_started = True  # the engine sends the first sample right away
+        if self.verbose: print(f"SIM[{self.index}]: Burst of {self.burst_left} samples every {interval_ms} ms")
+
+    def _apply(self, changes):
+        for key, value in changes.items():
+            if key in protocol.ACTUATORS:
+                self.reactors.actuators[self.index, protocol.ACTUATORS.index(key)] = bool(value)
+                if self.verbose: print(f"SIM[{self.index}]: Received command -> {key} = {value}")
+
+    def _handle_line(self, line):
+        try: cmd = json.loads(line)
+        except json.JSONDecodeError:
+            if self.verbose: print(f"SIM[{self.index}]: Received non-JSON data: {line}")
+            return b""
+        if not isinstance(cmd, dict): return b""
+        if cmd.get("cmd") == "set": self._apply(cmd)
+        elif cmd.get("cmd") == "burst": self._start_burst(cmd.get("samples", 0), cmd.get("interval_ms", 50))
+        elif cmd.get("cmd") == "proto" and cmd.get("mode") == "bin":
+            self.binary = True; self.tx_seq = 0
+            self.packet_rate_hz = min(max(float(cmd.get("hz", 10)), 1.0), 50.0)
+            if self.verbose: print(f"SIM[{self.index}]: Switched to binary protocol at {self.packet_rate_hz:g} Hz")
+            return (json.dumps(protocol.NEGOTIATE_ACK) + "\n").encode()
+        return b""
+
+    def _handle_frame(self, frame):
+        try: kind, _, changes = protocol.decode_payload(protocol.decode_frame(frame))
+        except protocol.FrameError as e:
+            if self.verbose: print(f"SIM[{self.index}]: Dropped corrupt frame ({e})")
+            return
+        if kind == protocol.FRAME_SET: self._apply(changes)
+        elif kind == protocol.FRAME_BURST: self._start_burst(changes["samples"], changes["interval_ms"])
+
+    def packet(self, t1, t2, l1, l2):
+        states = dict(zip(protocol.ACTUATORS, self.reactors.actuators[self.index].astype(int).tolist()))
+        l1 = None if np.isnan(l1) else int(l1); l2 = None if np.isnan(l2) else int(l2)
+        if self.binary:
+            self.tx_seq += 1
+            return protocol.encode_sensor(self.tx_seq, t1, t2, l1, l2, states)
+        return (json.dumps({"t1": t1, "t2": t2, "l1": l1, "l2": l2, **states}) + "\n").encode()
+
+def _open_pty():
+    master, slave = pty.openpty()
+    attrs = termios.tcgetattr(master)
+    attrs[3] &= ~(termios.ICANON | termios.ECHO)
+    termios.tcsetattr(master, termios.TCSANOW, attrs)
+    tty.setraw(slave)  # no echo of our own packets before the host opens the port
+    os.set_blocking(master, False)
+    return master, slave, os.ttyname(slave)
+
+class SimEngine(threading.Thread):
+    """Simulates n reactors from one thread, `speedup` times faster than wall-clock time. Everything
+    runs on `clock`, a ScaledClock: the physics advances in one vectorized update for all reactors
+    and sensor packets go out at each device's negotiated rate in simulated time. Controllers
+    running on the same clock see their schedules pass at the same speed (see soak.py).
+
+    transport="pty" exposes every reactor as a pseudo-terminal (`ports` holds the device paths);
+    transport="socket" keeps everything in-process and `ports` holds the host ends of socket pairs."""
+    def __init__(self, n, speedup=1.0, transport="pty", seed=None, verbose=False):
+        super().__init__(daemon=True, name="sim-engine")
+        self.reactors = ReactorArray(n, seed); self.speedup = speedup; self.clock = ScaledClock(speedup)
+        self.devices = [SimDevice(self.reactors, i, verbose) for i in range(n)]
+        self.ports = []; self._fds = []; self._keep = []
+        for _ in range(n):
+            if transport == "pty":
+                master, slave, name = _open_pty(); self._fds.append(master); self._keep.append(slave); self.ports.append(name)
+            elif transport == "socket":
+                host, dev = socket.socketpair(); dev.setblocking(False)
+                self._fds.append(dev.fileno()); self._keep.append(dev); self.ports.append(host)
+            else: raise ValueError(f"unknown transport {transport!r}")
+        self.dropped_packets = np.zeros(n, dtype=np.int64)  # packets the host was too slow to take
+        self._stopping = threading.Event()
+
+    def sim_time(self):
+        """Simulated seconds since the engine started."""
+        return self.reactors.sim_seconds
+
+    def stop(self): self._stopping.set()
+
+    def run(self):
+        sel = selectors.DefaultSelector()
+        for i, fd in enumerate(self._fds): sel.register(fd, selectors.EVENT_READ, i)
+        n = self.reactors.n; clock = self.clock; start = clock.time()
+        next_packet = np.full(n, start)  # clock times
+        try:
+            while not self._stopping.is_set():
+                now = clock.time()
+                # Catch-up is done in bounded chunks so serial traffic keeps flowing at very high speed-ups.
+                behind = int(now - start) - self.reactors.sim_seconds
+                if behind > 0: self.reactors.step(min(behind, MAX_STEPS_PER_ITERATION))
+                due = np.flatnonzero(next_packet <= now)
+                if len(due):
+                    t1, t2, l1, l2 = self.reactors.readings(due)
+                    for k, i in enumerate(due.tolist()):
+                        device = self.devices[i]
+                        self._send(i, device.packet(float(t1[k]), float(t2[k]), l1[k], l2[k]))
+                        next_packet[i] = max(next_packet[i] + device.packet_interval(), now)
+                next_tick = start + self.reactors.sim_seconds + 1
+                timeout = max(0.0, min(next_packet.min(), next_tick) - clock.time()) / self.speedup
+                for key, _ in sel.select(timeout):
+                    i = key.data
+                    try: data = os.read(self._fds[i], 4096)
+                    except (BlockingIOError, InterruptedError): continue
+                    except OSError: sel.unregister(self._fds[i]); continue  # host side closed
+                    if data and (reply := self.devices[i].receive(data)): self._send(i, reply)
+                    if self.devices[i].burst_started: self.devices[i].burst_started = False; next_packet[i] = clock.time()
+        finally:
+            sel.close()
+            for fd, keep in zip(self._fds, self._keep):
+                if isinstance(keep, socket.socket): keep.close()
+                else: os.close(fd); os.close(keep)
+
+    def _send(self, i, data):
+        try: os.write(self._fds[i], data)
+        except BlockingIOError: self.dropped_packets[i] += 1
+        except OSError: pass
@@ -0,0 +1,245 @@
+# snapshot.py
+
+import os
+import json
+import mmap
+import time
+import zlib
+import struct
+import pathlib
+import threading
+
+import numpy as np
+
+# -- Snapshot format (<dir>/state.snap)
+# 16-byte header: 8-byte magic, uint32 length of the JSON state that follows and uint32 CRC-32 of
+# everything after the header. Then, for each series listed in the state, int64 timestamps followed
+# by float32 values, each block padded to 8 bytes, so a restore is a few copies out of an mmap.
+SNAP_MAGIC = b"BRSNAP\x00\x01"
+SNAP_HEADER = struct.Struct("<8sII")
+
+# -- History file (<dir>/state.history)
+# The chart history is too big to rewrite with every snapshot, so each snapshot appends only the
+# samples added since the previous one, as chunks: 16-byte header (4-byte magic, uint16 length of
+# the series name, 2 reserved bytes, uint32 sample count, uint32 CRC-32 of the rest of the chunk),
+# the name, then int64 timestamps and float32 values, each padded to 8 bytes. Once the file holds
+# more than HISTORY_REWRITE_FACTOR times what the series can keep, it is rewritten with only that.
+HIST_MAGIC = b"BRHC"
+HIST_CHUNK = struct.Struct("<4sHHII")
+HISTORY_REWRITE_FACTOR = 2
+
+def _pad(n): return b"\0" * (-n % 8)
+
+def _chunk(name, ts, values):
+    name = name.encode()
+    parts = [name, _pad(len(name)), ts, values, _pad(values.nbytes)]
+    crc = 0
+    for part in parts: crc = zlib.crc32(part, crc)
+    return [HIST_CHUNK.pack(HIST_MAGIC, len(name), 0, len(ts), crc)] + parts
+
+def _concat(*parts):
+    """Merges {name: (ts, values)} dicts, concatenating the samples of a series in the given order."""
+    merged = {}
+    for part in parts:
+        for name, arrays in part.items(): merged.setdefault(name, []).append(arrays)
+    return {name: tuple(np.concatenate(a) for a in zip(*arrays)) for name, arrays in merged.items()}
+
+class StateStore:
+    """Crash-safe persistence of one controller's state. Snapshots are written in the background to a
+    temporary file that replaces the previous one, so a complete snapshot is always on disk. Changes
+    made between snapshots are appended to a journal (one JSON line each, numbered) and load()
+    replays the entries newer than the snapshot on top of it. All file I/O happens on the writer
+    thread: journal() only queues the entry, and the writer appends whatever has queued up with a
+    single fsync, so a burst of changes costs one. History samples are appended
+    to the history file; history_limits ({series: samples kept}) bounds what a rewrite keeps."""
+    def __init__(self, directory, history_limits=None):
+        self.directory = pathlib.Path(directory)
+        self.snap_path = self.directory / "state.snap"; self.journal_path = self.directory / "state.journal"
+        self.history_path = self.directory / "state.history"; self.history_limits = dict(history_limits or {})
+        self._lock = threading.Condition(); self._seq = 0; self._journal_f = None
+        self._pending = None; self._entries = []; self._busy = False; self._thread = None
+        self._unsaved = {}  # history samples of a failed write, retried with the next one
+        self._history_size = None  # bytes of complete chunks in the history file, once known
+        self.stats = {"snapshots": 0, "snapshot_ms": None, "load_ms": None, "journal_entries": 0, "history_bytes": 0}
+
+    @property
+    def seq(self):
+        """Number of the newest journal entry. Read it before capturing the state to snapshot, so
+        that anything journaled concurrently is replayed rather than lost."""
+        with self._lock: return self._seq
+
+    def journal(self, kind, values):
+        """Queues one change for the journal; kind is 'setpoints', 'schedule', 'manual' or 'resume'."""
+        with self._lock:
+            self._seq += 1
+            self._entries.append(json.dumps({"seq": self._seq, "kind": kind, "values": values}) + "\n")
+            self._wake_writer()
+
+    def save(self, seq, state, series):
+        """Queues a snapshot of state (a JSON-able dict) covering the journal up to seq, and the history
+        samples added since the last save, as {name: (ts, values)} arrays the caller no longer touches.
+        Only the newest queued state is written; the samples of all queued saves are."""
+        with self._lock:
+            if self._pending is not None: series = _concat(self._pending[2], series)
+            self._pending = (seq, state, series); self._wake_writer()
+
+    def flush(self, timeout=None):
+        """Waits until everything queued so far is on disk; False if that took longer than timeout."""
+        with self._lock: return self._lock.wait_for(lambda: not (self._entries or self._pending or self._busy), timeout)
+
+    def _wake_writer(self):
+        self._lock.notify_all()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name=f"snapshot-{self.directory.name}")
+            self._thread.start()
+
+    def load(self):
+        """The last snapshot with the newer journal entries applied, as (state, series), or None if
+        nothing was saved yet. A damaged snapshot is ignored; a torn journal line or history chunk is dropped."""
+        started = time.perf_counter()
+        state, series = None, {}
+        try: state, series = self._read_snapshot()
+        except FileNotFoundError: pass
+        except (ValueError, OSError) as e: print(f"Ignoring unusable state snapshot {self.snap_path}: {e}")
+        series = _concat(series, self._read_history())  # snapshots used to carry the history themselves
+        entries = self._read_journal()
+        if state is None and not entries and not series: return None
+        state = state or {"seq": 0}
+        for entry in entries:
+            if entry["seq"] <= state["seq"]: continue
+            if entry["kind"] == "resume": state["manual"] = {}
+            else: state.setdefault(entry["kind"], {}).update(entry["values"])
+        with self._lock: self._seq = max([state["seq"]] + [entry["seq"] for entry in entries])
+        self.stats["load_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        return state, series
+
+    def _read_snapshot(self):
+        with open(self.snap_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if len(mm) < SNAP_HEADER.size: raise ValueError("truncated")
+            magic, state_len, crc = SNAP_HEADER.unpack_from(mm)
+            if magic != SNAP_MAGIC: raise ValueError("not a state snapshot")
+            with memoryview(mm) as view:
+                if zlib.crc32(view[SNAP_HEADER.size:]) != crc: raise ValueError("checksum mismatch")
+            offset = SNAP_HEADER.size
+            state = json.loads(mm[offset:offset + state_len]); offset += state_len + len(_pad(state_len))
+            series = {}
+            for name, n in state.pop("series").items():
+                ts = np.frombuffer(mm, '<i8', n, offset).copy(); offset += 8 * n
+                values = np.frombuffer(mm, '<f4', n, offset).copy(); offset += 4 * n + len(_pad(4 * n))
+                series[name] = (ts, values)
+        return state, series
+
+    def _read_history(self):
+        try: f = open(self.history_path, "rb")
+        except FileNotFoundError: self._history_size = 0; return {}
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if not size: self._history_size = 0; return {}
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        chunks = []; offset = 0
+        with mm:
+            while offset + HIST_CHUNK.size <= size:
+                magic, name_len, _, n, crc = HIST_CHUNK.unpack_from(mm, offset)
+                start = offset + HIST_CHUNK.size; ts_at = start + name_len + len(_pad(name_len))
+                end = ts_at + 12 * n + len(_pad(4 * n))
+                if magic != HIST_MAGIC or end > size: break
+                with memoryview(mm) as view:
+                    if zlib.crc32(view[start:end]) != crc: break
+                name = bytes(mm[start:start + name_len]).decode()
+                chunks.append({name: (np.frombuffer(mm, '<i8', n, ts_at).copy(), np.frombuffer(mm, '<f4', n, ts_at + 8 * n).copy())})
+                offset = end
+        if offset < size:
+            print(f"Dropping a torn chunk at the end of {self.history_path}.")
+            with open(self.history_path, "r+b") as f: f.truncate(offset)
+        self._history_size = self.stats["history_bytes"] = offset
+        return _concat(*chunks)
+
+    def _read_journal(self):
+        try: data = self.journal_path.read_bytes()
+        except FileNotFoundError: return []
+        entries = []; good = 0
+        for line in data.splitlines(keepends=True):
+            try: entry = json.loads(line)
+            except ValueError: break
+            if not line.endswith(b"\n"): break
+            entries.append(entry); good += len(line)
+        if good < len(data):
+            print(f"Dropping a torn entry at the end of {self.journal_path}.")
+            with open(self.journal_path, "r+b") as f: f.truncate(good)
+        return entries
+
+    def _run(self):
+        while True:
+            with self._lock:
+                self._busy = False; self._lock.notify_all()
+                while self._pending is None and not self._entries: self._lock.wait()
+                entries = self._entries; self._entries = []
+                pending = self._pending; self._pending = None; self._busy = True
+            # Queued entries go first: the snapshot's journal truncation expects them on disk.
+            if entries:
+                try: self._append_journal(entries)
+                except OSError as e: print(f"Could not append {len(entries)} entries to {self.journal_path}: {e}")
+            if pending is None: continue
+            seq, state, series = pending; started = time.perf_counter()
+            series = _concat(self._unsaved, series); self._unsaved = {}
+            try: self._append_history(series)
+            except OSError as e: print(f"Could not append to {self.history_path}: {e}"); self._unsaved = series
+            try: self._write(seq, state)
+            except OSError as e: print(f"Could not write state snapshot {self.snap_path}: {e}"); continue
+            self.stats["snapshots"] += 1; self.stats["snapshot_ms"] = round((time.perf_counter() - started) * 1000, 3)
+
+    def _append_journal(self, entries):
+        if self._journal_f is None: self._journal_f = open(self.journal_path, "a")
+        self._journal_f.writelines(entries); self._journal_f.flush(); os.fsync(self._journal_f.fileno())
+        self.stats["journal_entries"] += len(entries)
+
+    def _append_history(self, series):
+        series = {name: (np.ascontiguousarray(ts, '<i8'), np.ascontiguousarray(values, '<f4'))
+                  for name, (ts, values) in series.items() if len(ts)}
+        if not series: return
+        if self._history_size is None: self._read_history()
+        if self.history_limits and self._history_size > 12 * sum(self.history_limits.values()) * HISTORY_REWRITE_FACTOR:
+            # Rewrite with only what the series can keep; a crash meanwhile leaves the old file.
+            series = _concat(self._read_history(), series)
+            series = {name: (ts[-self.history_limits.get(name, len(ts)):], values[-self.history_limits.get(name, len(ts)):])
+                      for name, (ts, values) in series.items()}
+            tmp = self.history_path.with_name(self.history_path.name + ".tmp")
+            with open(tmp, "wb") as f: size = self._write_chunks(f, series)
+            os.replace(tmp, self.history_path); self._fsync_dir()
+        else:
+            with open(self.history_path, "ab") as f:
+                f.truncate(self._history_size)  # drops what a failed append left behind
+                size = self._history_size + self._write_chunks(f, series)
+        self._history_size = self.stats["history_bytes"] = size
+
+    @staticmethod
+    def _write_chunks(f, series):
+        written = 0
+        for name, (ts, values) in series.items():
+            for part in _chunk(name, ts, values): written += f.write(part)
+        f.flush(); os.fsync(f.fileno())
+        return written
+
+    def _write(self, seq, state):
+        blob = json.dumps({**state, "seq": seq, "series": {}}).encode()
+        parts = [blob, _pad(len(blob))]
+        crc = 0
+        for part in parts: crc = zlib.crc32(part, crc)
+        tmp = self.snap_path.with_name(self.snap_path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(SNAP_HEADER.pack(SNAP_MAGIC, len(blob), crc))
+            for part in parts: f.write(part)
+            f.flush(); os.fsync(f.fileno())
+        os.replace(tmp, self.snap_path); self._fsync_dir()
+        # The journal only needs the entries the snapshot does not cover yet.
+        keep = [entry for entry in self._read_journal() if entry["seq"] > seq]
+        if self._journal_f is not None: self._journal_f.close(); self._journal_f = None
+        tmp = self.journal_path.with_name(self.journal_path.name + ".tmp")
+        with open(tmp, "w") as f:
+            f.writelines(json.dumps(entry) + "\n" for entry in keep); f.flush(); os.fsync(f.fileno())
+        os.replace(tmp, self.journal_path); self._fsync_dir()
+
+    def _fsync_dir(self):
+        fd = os.open(self.directory, os.O_RDONLY)
+        try: os.fsync(fd)
+        finally: os.close(fd)
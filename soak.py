@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# soak.py
+"""Runs a rack of simulated reactors through their schedules faster than real time. A SimEngine at
+a speed-up and a FleetManager share the engine's clock, so light cycles, dilutions, OD
+measurements, job sleeps and command timeouts all pass `speedup` times faster than on the wall
+clock, and days of operation take minutes:
+
+    python soak.py -n 8 --speedup 500 --hours 48
+    python soak.py --setpoints '{"od_interval_hours": 1}' --log-dir soak-logs
+"""
+
+import time
+import json
+import pathlib
+import argparse
+import tempfile
+
+import bioreactor_controller
+from fleet import FleetManager
+from sim_engine import SimEngine
+from serial_io import SocketTransport
+from log_writer import LogWriter
+from bioreactor_controller import BioreactorController
+
+def build_rack(engine, log_dir, setpoints=None):
+    """One controller per simulated reactor, on the engine's clock and one shared log writer."""
+    log_writer = LogWriter(); log_writer.start()
+    return {f"sim{i}": BioreactorController(f"sim{i}", setpoints=setpoints, log_dir=pathlib.Path(log_dir) / f"sim{i}",
+                                            log_writer=log_writer, clock=engine.clock, transport=SocketTransport(port),
+                                            trace_dir=None)
+            for i, port in enumerate(engine.ports)}
+
+def summary(controllers, engine):
+    lines = []
+    for i, (rid, ctl) in enumerate(controllers.items()):
+        jobs = {}
+        for (name, outcome), n in ctl.jobs.outcomes.totals().items():
+            if outcome == "done": jobs[name] = n
+        r = ctl.latest_readings
+        lines.append(f"{rid}: {ctl.link_stats['packets']} packets ({engine.dropped_packets[i]} dropped), "
+                     f"t1 {r['t1']} C, OD {r['od']}, jobs done {json.dumps(jobs, sort_keys=True)}, "
+                     f"{ctl.link_stats['commands_unacked']} commands unconfirmed")
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--reactors", type=int, default=4)
+    parser.add_argument("--speedup", type=float, default=100.0, help="simulated seconds per wall-clock second")
+    parser.add_argument("--hours", type=float, default=24.0, help="simulated hours to run")
+    parser.add_argument("--rate-hz", type=float, default=1.0,
+                        help="sensor packets per simulated second on the binary protocol (the host must keep up with rate x speedup)")
+    parser.add_argument("--setpoints", type=json.loads, default=None, help='JSON object, e.g. \'{"temperature": 30}\'')
+    parser.add_argument("--log-dir", help="keep the logs here (default: a temporary directory)")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    bioreactor_controller.SENSOR_RATE_HZ = args.rate_hz
+
+    engine = SimEngine(args.reactors, speedup=args.speedup, transport="socket", seed=args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        controllers = build_rack(engine, args.log_dir or tmp, args.setpoints)
+        engine.start(); FleetManager(controllers).start()
+        started = time.perf_counter(); start = engine.clock.time(); end = start + args.hours * 3600
+        print(f"Soaking {args.reactors} reactors for {args.hours:g} simulated hours at {args.speedup:g}x.")
+        while (now := engine.clock.time()) < end:
+            print(f"{(now - start) / 3600:.1f} h simulated in {time.perf_counter() - started:.0f} s", flush=True)
+            time.sleep(min((end - now) / args.speedup, 10.0))
+        print(summary(controllers, engine))
+        engine.stop(); engine.join()
+        next(iter(controllers.values())).log_writer.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+# stats.py
+
+import bisect
+
+class Histogram:
+    """Fixed-bucket histogram of durations in seconds; cheap enough to update on every event."""
+    DEFAULT_BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+    FAST_BOUNDS = (0.00005, 0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1)
+    SLOW_BOUNDS = (0.1, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # last bucket is +Inf
+        self.count = 0; self.sum = 0.0; self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1; self.sum += value
+        if value > self.max: self.max = value
+
+    def summary(self):
+        return {"count": self.count, "mean": self.sum / self.count if self.count else None, "max": self.max}
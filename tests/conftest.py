@@ -0,0 +1,36 @@
+# conftest.py
+# The modules live at the top level of the repository rather than in a package.
+
+import sys
+import pathlib
+
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from clock import VirtualClock
+from log_writer import LogWriter
+from bioreactor_controller import BioreactorController
+
+class BufferTransport:
+    """Hands out the given chunks, one per readinto() call, and records what is written."""
+    def __init__(self, *chunks): self.chunks = list(chunks); self.written = []
+    def readinto(self, buf):
+        if not self.chunks: return 0
+        data = self.chunks.pop(0); buf[:len(data)] = data; return len(data)
+    def write(self, data): self.written.append(bytes(data))
+    def fileno(self): return -1
+    def close(self): pass
+
+@pytest.fixture
+def make_controller(tmp_path):
+    """Builds controllers on a BufferTransport and a VirtualClock, already past the protocol negotiation."""
+    writers = []
+    def make(reactor_id="test", binary=False, **kwargs):
+        writer = LogWriter(flush_interval=0); writer.start(); writers.append(writer)
+        ctl = BioreactorController(reactor_id, **{"transport": BufferTransport(), "clock": VirtualClock(), "log_dir": tmp_path / reactor_id,
+                                                  "trace_dir": None, "snapshot_interval": 0, "log_writer": writer, **kwargs})
+        ctl._negotiating = False; ctl.link.binary = binary; ctl.scheduler.arm('negotiate', None)
+        return ctl
+    yield make
+    for writer in writers: writer.close()
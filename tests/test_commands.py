@@ -0,0 +1,50 @@
+# test_commands.py
+
+import json
+
+import pytest
+import protocol
+from config import SERIAL_ACK_TIMEOUT_S, SERIAL_ACK_RETRIES
+
+def packet(**states):
+    """A sensor packet without readings, echoing the given actuator states (the rest off)."""
+    return {"t1": None, "t2": None, "l1": None, "l2": None, **{name: 0 for name in protocol.ACTUATORS}, **states}
+
+def sent(ctl):
+    return [json.loads(line) for line in ctl.link.ser.written]
+
+def test_unconfirmed_set_is_retried_then_given_up(make_controller):
+    ctl = make_controller()
+    ctl._set_actuator("stir", 1); ctl._process_serial_outbound()
+    ctl.clock.advance(SERIAL_ACK_TIMEOUT_S / 2); ctl._handle_packet(packet()); ctl._process_serial_outbound()
+    assert len(sent(ctl)) == 1  # not resent before the timeout
+    for retry in range(1, SERIAL_ACK_RETRIES + 1):
+        ctl.clock.advance(SERIAL_ACK_TIMEOUT_S); ctl._handle_packet(packet()); ctl._process_serial_outbound()
+        assert sent(ctl)[-1] == {"cmd": "set", "stir": 1} and ctl.link_stats["command_retries"] == retry
+    ctl.clock.advance(SERIAL_ACK_TIMEOUT_S); ctl._handle_packet(packet()); ctl._process_serial_outbound()
+    assert len(sent(ctl)) == 1 + SERIAL_ACK_RETRIES
+    assert ctl.link_stats["commands_unacked"] == 1 and "stir" not in ctl._unacked
+    assert ctl._actuator_target("stir") == 0  # the reported state again
+
+def test_echoed_set_is_cleared_and_its_latency_recorded(make_controller):
+    ctl = make_controller()
+    ctl._set_actuator("stir", 1); ctl._set_actuator("aerator", 1); ctl._process_serial_outbound()
+    assert sent(ctl) == [{"cmd": "set", "stir": 1, "aerator": 1}] and ctl._actuator_target("stir") == 1
+    ctl.clock.advance(0.25); ctl._handle_packet(packet(stir=1))
+    assert "stir" not in ctl._unacked and "aerator" in ctl._unacked
+    assert ctl.command_latency["stir"].count == 1 and ctl.command_latency["stir"].sum == pytest.approx(0.25)
+    # A retry keeps the first send time, so the latency covers the whole wait.
+    ctl.clock.advance(SERIAL_ACK_TIMEOUT_S); ctl._handle_packet(packet(stir=1)); ctl._process_serial_outbound()
+    assert sent(ctl)[-1] == {"cmd": "set", "aerator": 1}
+    ctl.clock.advance(0.5); ctl._handle_packet(packet(stir=1, aerator=1))
+    assert not ctl._unacked and ctl.link_stats["command_retries"] == 1
+    assert ctl.command_latency["aerator"].sum == pytest.approx(0.25 + SERIAL_ACK_TIMEOUT_S + 0.5)
+
+def test_a_newer_value_replaces_the_one_in_flight(make_controller):
+    ctl = make_controller()
+    ctl._set_actuator("stir", 1); ctl._process_serial_outbound()
+    ctl._set_actuator("stir", 0); ctl._process_serial_outbound()
+    ctl.clock.advance(0.1); ctl._handle_packet(packet(stir=1))  # the echo of the first command
+    assert ctl._unacked["stir"][0] == 0 and not ctl.command_latency
+    ctl.clock.advance(0.1); ctl._handle_packet(packet(stir=0))
+    assert not ctl._unacked and ctl.command_latency["stir"].count == 1
@@ -0,0 +1,26 @@
+# test_dashboard.py
+
+import json
+import pathlib
+import importlib.util
+
+import pytest
+import fleet
+
+@pytest.fixture
+def dashboard(monkeypatch):
+    """pi_controller.py, loaded by path (its file name starts with a space); nothing may start on import."""
+    monkeypatch.setattr(fleet, "start_controllers", lambda: pytest.fail("controllers started on import"))
+    path = pathlib.Path(__file__).resolve().parent.parent / " pi_controller.py"
+    spec = importlib.util.spec_from_file_location("pi_controller", path)
+    module = importlib.util.module_from_spec(spec); spec.loader.exec_module(module)
+    return module
+
+def test_app_serves_the_injected_controllers(dashboard, make_controller):
+    first, second = make_controller("a"), make_controller("b")
+    second.history.append("t1", 1000, 30.0)
+    client = dashboard.create_app({"a": first, "b": second}).test_client()
+    assert json.loads(client.get("/history").data)["t1"] == []  # unprefixed routes address the first reactor
+    assert json.loads(client.get("/r/b/history").data)["t1"] == [{"x": 1000, "y": 30.0}]
+    assert client.get("/r/c/history").status_code == 404
+    assert 'reactor="b"' in client.get("/metrics").get_data(as_text=True)
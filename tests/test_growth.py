@@ -0,0 +1,56 @@
+# test_growth.py
+
+import math
+
+import pytest
+from growth import GrowthEstimator, turbidostat_fraction
+
+RATE = 0.2  # per hour
+
+def exponential(estimator, hours, od0=0.1, step_h=0.5, start=1_700_000_000):
+    for i in range(int(hours / step_h) + 1):
+        estimator.add(start + i * step_h * 3600, od0 * math.exp(RATE * i * step_h))
+    return start + hours * 3600
+
+def test_needs_min_readings_before_a_rate():
+    g = GrowthEstimator(min_readings=3)
+    g.add(0, 0.1); g.add(3600, 0.12)
+    assert g.rate is None and g.doubling_time_s is None and g.predict_od(3600) == pytest.approx(0.12)
+    g.add(7200, 0.144)
+    assert g.rate == pytest.approx(math.log(1.2))
+
+def test_exponential_growth_rate_and_doubling_time():
+    g = GrowthEstimator(); end = exponential(g, 12)
+    assert g.rate == pytest.approx(RATE, rel=1e-9)
+    assert g.doubling_time_s == pytest.approx(math.log(2) / RATE * 3600)
+    assert g.predict_od(end + 3600) == pytest.approx(0.1 * math.exp(RATE * 13))
+
+def test_non_positive_readings_are_ignored():
+    g = GrowthEstimator(); g.add(0, 0.0); g.add(10, -0.1); g.add(20, None)
+    assert g.predict_od(20) is None
+
+def test_dilutions_do_not_bend_the_fit():
+    g = GrowthEstimator(); t = 1_700_000_000; od = 0.2
+    for i in range(48):
+        if i and i % 6 == 0: od *= 0.7; g.record_dilution(0.3)
+        g.add(t + i * 1800, od); od *= math.exp(RATE * 0.5)
+    assert g.rate == pytest.approx(RATE, rel=1e-6)
+    assert g.predict_od(t + 47 * 1800) == pytest.approx(od / math.exp(RATE * 0.5), rel=1e-6)
+
+def test_window_drops_old_readings():
+    g = GrowthEstimator(window_hours=6); start = 1_700_000_000
+    for i in range(13): g.add(start + i * 3600, 0.5)  # flat for 12 hours
+    end = exponential(g, 6, od0=0.5, start=start + 13 * 3600)
+    assert g.rate == pytest.approx(RATE, rel=1e-6) and g.predict_od(end) == pytest.approx(0.5 * math.exp(RATE * 6))
+
+def test_to_dict_round_trip():
+    g = GrowthEstimator(); exponential(g, 6); g.record_dilution(0.25)
+    restored = GrowthEstimator(); restored.load(g.to_dict())
+    assert restored.rate == pytest.approx(g.rate) and restored.predict_od(1_700_050_000) == pytest.approx(g.predict_od(1_700_050_000))
+
+def test_turbidostat_fraction():
+    # Growing 2x until the next dilution, a culture at 1.2x the target needs 1 - 1 / 2.4 replaced.
+    assert turbidostat_fraction(0.6, math.log(2) / 4, 4, 0.5, max_fraction=1.0) == pytest.approx(1 - 1 / 2.4)
+    assert turbidostat_fraction(0.6, math.log(2) / 4, 4, 0.5, max_fraction=0.5) == 0.5
+    assert turbidostat_fraction(0.2, 0.0, 4, 0.5) == 0.0
+    assert turbidostat_fraction(None, 0.1, 4, 0.5) == 0.0 and turbidostat_fraction(0.6, None, 4, 0.5) == pytest.approx(1 - 0.5 / 0.6)
@@ -0,0 +1,90 @@
+# test_history.py
+
+import json
+import struct
+import datetime
+
+import numpy as np
+import pytest
+from log_writer import LogWriter, open_binary_log
+from history_query import LogIndex, decode_column, minmax_decimate, lttb_decimate, encode_history
+
+STRIDE = 8
+
+def noisy(n, seed=0):
+    values = np.random.default_rng(seed).normal(25, 0.5, n); values[n // 3] = 40.0  # one spike
+    return np.arange(n, dtype=np.int64) * 1000, values
+
+@pytest.mark.parametrize("decimate", [minmax_decimate, lttb_decimate])
+@pytest.mark.parametrize("max_points", [4, 5, 100, 101])
+def test_decimators_keep_the_endpoints_within_max_points(decimate, max_points):
+    ts, values = noisy(10_000)
+    out_ts, out_values = decimate(ts, values, max_points)
+    assert max_points - 1 <= len(out_ts) <= max_points
+    assert out_ts[0] == ts[0] and out_ts[-1] == ts[-1]
+    assert np.all(np.diff(out_ts) > 0) and np.array_equal(out_values, values[out_ts // 1000])
+
+def test_minmax_keeps_spikes_and_short_series_are_left_alone():
+    ts, values = noisy(10_000)
+    assert 40.0 in minmax_decimate(ts, values, 20)[1]
+    assert len(minmax_decimate(ts, values, 2)[0]) == 2
+    for decimate in (minmax_decimate, lttb_decimate): assert len(decimate(ts[:50], values[:50], 100)[0]) == 50
+
+def one_am(days_ago=0):
+    """ms timestamp of 01:00 local time, a day that many days back."""
+    day = datetime.date.today() - datetime.timedelta(days=days_ago)
+    return int(datetime.datetime.combine(day, datetime.time(1)).timestamp() * 1000)
+
+def write_log(log_dir, start_ms, t1):
+    """One sample per second from start_ms through the regular log writer."""
+    writer = LogWriter(flush_interval=0); writer.start()
+    for i, value in enumerate(t1): writer.log(log_dir, (start_ms + i * 1000, float(value), 30.0, None, None, None, 0))
+    writer.close()
+
+def test_block_summaries_follow_a_growing_day_file(tmp_path):
+    start_ms = one_am()  # today's file, whose index is kept in memory only
+    index = LogIndex(tmp_path, stride=STRIDE)
+    _, first = noisy(3 * STRIDE + 5, seed=1)
+    write_log(tmp_path, start_ms, first)
+    ts, values = index.query("t1", start_ms, start_ms + 10**7, 10**6)  # raw: every sample
+    assert len(ts) == len(first) and np.allclose(values, np.round(first, 2))
+
+    [file_index] = index._bin.values()
+    _, records = open_binary_log(file_index.path)
+    assert file_index.n_blocks == 3 and list(file_index.block_ts) == [start_ms + b * STRIDE * 1000 for b in range(3)]
+    blocks = decode_column(records, "t1")[:3 * STRIDE].reshape(3, STRIDE)
+    min_ts, min_v, max_ts, max_v = file_index.summary["t1"]
+    assert np.array_equal(min_v, blocks.min(1)) and np.array_equal(max_v, blocks.max(1))
+    assert list(max_ts) == [start_ms + (b * STRIDE + int(blocks[b].argmax())) * 1000 for b in range(3)]
+
+    _, more = noisy(40 * STRIDE, seed=2); more[-1] = 45.0
+    write_log(tmp_path, start_ms + len(first) * 1000, more)
+    # 43 blocks are far more than 16 raw samples per point: block min/max points, then decimated
+    ts, values = index.query("t1", start_ms, start_ms + 10**7, 6)
+    assert file_index.n_blocks == (len(first) + len(more)) // STRIDE
+    assert ts[-1] == start_ms + (len(first) + len(more) - 1) * 1000  # from the raw tail of the unfinished block
+    assert 40.0 in values and 45.0 in values and len(ts) <= 6
+
+def test_finished_days_are_indexed_once_and_reloaded(tmp_path):
+    start_ms = one_am(days_ago=3)
+    write_log(tmp_path, start_ms, noisy(2 * STRIDE)[1])
+    ts, _ = LogIndex(tmp_path, stride=STRIDE).query("t1", start_ms, start_ms + 10**6, 100)
+    assert len(list(tmp_path.glob("*.idx.npz"))) == 1
+    reloaded = LogIndex(tmp_path, stride=STRIDE)
+    assert np.array_equal(reloaded.query("t1", start_ms, start_ms + 10**6, 100)[0], ts)
+    [file_index] = reloaded._bin.values()
+    assert file_index.n_blocks == 2
+
+def test_history_encodings_carry_the_same_points():
+    arrays = {"t1": (np.array([1000, 2000], np.int64), np.array([25.5, 25.25])), "od": (np.empty(0, np.int64), np.empty(0))}
+    points, _ = encode_history(arrays, "points")
+    assert json.loads(points) == {"t1": [{"x": 1000, "y": 25.5}, {"x": 2000, "y": 25.25}], "od": []}
+    columns, _ = encode_history(arrays, "columns")
+    assert json.loads(columns) == {"t1": {"x": [1000, 2000], "y": [25.5, 25.25]}, "od": {"x": [], "y": []}}
+    body, mimetype = encode_history(arrays, "binary")
+    assert mimetype == "application/octet-stream" and len(body) % 8 == 0
+    (n,) = struct.unpack_from("<I", body); header = json.loads(body[4:4 + n])
+    assert header == {"t1": 2, "od": 0}
+    offset = 4 + n + (-(4 + n) % 8)
+    assert list(np.frombuffer(body, "<f8", 2, offset)) == [1000, 2000]
+    assert list(np.frombuffer(body, "<f4", 2, offset + 16)) == [25.5, 25.25]
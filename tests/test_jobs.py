@@ -0,0 +1,81 @@
+# test_jobs.py
+
+from concurrent.futures import Future
+
+from clock import VirtualClock
+from jobs import JobExecutor, WaitFor
+
+def make_executor():
+    clock = VirtualClock(1000.0); wakes = []
+    return clock, JobExecutor(clock, lambda: wakes.append(clock.time()))
+
+def sleeper(log, name, seconds=5):
+    def sequence():
+        log.append(f"{name} start")
+        try: yield seconds
+        finally: log.append(f"{name} end")
+    return sequence
+
+def run_until_idle(clock, jobs, limit=100):
+    for _ in range(limit):
+        jobs.run()
+        deadline = jobs.next_deadline()
+        if deadline is None: return
+        clock.advance_to(deadline)
+
+def test_job_sleeps_on_the_clock():
+    clock, jobs = make_executor(); log = []
+    job = jobs.submit("a", sleeper(log, "a"), 1)
+    jobs.run()
+    assert job.state == "running" and jobs.next_deadline() == 1005.0
+    clock.advance(4.9); jobs.run(); assert job.state == "running"
+    clock.advance(0.1); jobs.run()
+    assert job.state == "done" and job.wait(0) and log == ["a start", "a end"]
+
+def test_queued_jobs_run_one_at_a_time_by_priority():
+    clock, jobs = make_executor(); log = []
+    jobs.submit("low", sleeper(log, "low"), 2); jobs.submit("high", sleeper(log, "high"), 0)
+    run_until_idle(clock, jobs)
+    assert log == ["high start", "high end", "low start", "low end"]
+
+def test_duplicate_submission_returns_the_pending_job():
+    clock, jobs = make_executor(); log = []
+    first = jobs.submit("od", sleeper(log, "od"), 0)
+    assert jobs.submit("od", sleeper(log, "od"), 0) is first
+    assert jobs.outcomes.totals() == {("od", "deduplicated"): 1}
+
+def test_preempted_job_is_stopped_and_restarts_later():
+    clock, jobs = make_executor(); log = []
+    aeration = jobs.submit("aeration", sleeper(log, "aeration", 300), 2, preemptible=True, holds=("aerator",))
+    jobs.run(); assert jobs.holds("aerator")
+    jobs.submit("od", sleeper(log, "od"), 0)
+    run_until_idle(clock, jobs)
+    assert log == ["aeration start", "aeration end", "od start", "od end", "aeration start", "aeration end"]
+    assert aeration.state == "done" and jobs.outcomes.totals()[("aeration", "preempted")] == 1
+
+def test_cancel_running_and_queued_jobs():
+    clock, jobs = make_executor(); log = []
+    running = jobs.submit("a", sleeper(log, "a"), 0); jobs.run()
+    queued = jobs.submit("b", sleeper(log, "b"), 1)
+    assert jobs.cancel("b") and queued.state == "cancelled" and queued.wait(0)
+    assert jobs.cancel("a"); jobs.run()
+    assert running.state == "cancelled" and log == ["a start", "a end"]
+    assert not jobs.cancel("a") and jobs.running is None
+
+def test_wait_for_gets_the_result_or_none_on_timeout():
+    clock, jobs = make_executor(); results = []; futures = [Future(), Future()]
+    def sequence():
+        for future in futures: results.append((yield WaitFor(future, 10)))
+    jobs.submit("w", sequence, 0); jobs.run()
+    futures[0].set_result(42); jobs.run()
+    assert results == [42]
+    clock.advance(10); jobs.run()
+    assert results == [42, None] and futures[1].cancelled()
+
+def test_failing_job_is_recorded_and_the_next_one_runs():
+    clock, jobs = make_executor(); log = []
+    def broken():
+        yield 1; raise RuntimeError("pump jammed")
+    failed = jobs.submit("broken", broken, 0); jobs.submit("next", sleeper(log, "next"), 1)
+    run_until_idle(clock, jobs)
+    assert failed.state == "failed" and log == ["next start", "next end"]
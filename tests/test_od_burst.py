@@ -0,0 +1,84 @@
+# test_od_burst.py
+
+import numpy as np
+import pytest
+import protocol
+from od_burst import ODBurst, robust_od, sample_od
+from config import OD_SETTLE_DURATION, OD_STIR_DURATION, OD_BURST_SAMPLES
+
+L1 = 950.0
+
+def l2_for(od): return L1 * 10 ** -od
+
+def settling_ramp(n, od=0.3, seed=0):
+    """ODs drifting towards od while the turbulence noise on them dies down, as after stirring."""
+    rng = np.random.default_rng(seed); i = np.arange(n)
+    return od + 0.05 * np.exp(-i / 15) + 0.02 * np.exp(-i / 10) * rng.normal(size=n) + 0.0003 * rng.normal(size=n)
+
+def test_burst_settles_once_the_window_is_steady():
+    burst = ODBurst(window=10, settle_std=0.002, samples=5)
+    ods = settling_ramp(200)
+    for i, od in enumerate(ods):
+        burst.add(L1, l2_for(od))
+        if burst.settled.done(): break
+    assert 20 < i < 150 and burst.settled.result() < 0.002
+    assert np.std(ods[i - 9:i + 1], ddof=1) == pytest.approx(burst.settled.result(), rel=1e-3)
+    burst.start_measuring()
+    for od in ods[i + 1:i + 6]: burst.add(L1, l2_for(od))
+    assert burst.measured.result() == pytest.approx(list(ods[i + 1:i + 6]), abs=1e-9)
+
+def test_burst_that_never_steadies_does_not_settle():
+    burst = ODBurst(window=10, settle_std=0.002)
+    rng = np.random.default_rng(1)
+    for od in 0.3 + 0.01 * rng.normal(size=500): burst.add(L1, l2_for(od))
+    assert not burst.settled.done() and burst.std > 0.002
+
+def test_missing_or_dark_samples_are_skipped():
+    burst = ODBurst(window=3)
+    for l1, l2 in ((None, 500), (L1, None), (L1, 0), (0, 500)): burst.add(l1, l2)
+    assert not burst.recent and burst.last_pair is None
+    assert sample_od(L1, l2_for(0.25)) == pytest.approx(0.25)
+
+def test_robust_od_rejects_spikes():
+    rng = np.random.default_rng(2)
+    values = list(0.3 + 0.001 * rng.normal(size=40))
+    spiked = values[:10] + [0.42] + values[10:25] + [0.05, 0.61] + values[25:]  # bubbles and debris
+    od, kept = robust_od(spiked)
+    assert kept == len(values) and od == pytest.approx(np.mean(values))
+    assert robust_od([0.3] * 5) == (0.3, 5)  # no spread at all: nothing is an outlier
+
+def burst_packet(od):
+    """A sensor packet sampled with the IR LED on and everything else off."""
+    return {"t1": None, "t2": None, "l1": L1, "l2": l2_for(od), **{name: 0 for name in protocol.ACTUATORS}, "irled": 1}
+
+def run_od_sequence(ctl, ods, interval=0.05):
+    """Runs the OD sequence on the virtual clock, feeding ods[i] as the i-th burst sample.
+    Returns the seconds spent settling and the index of the first sample measured."""
+    job = ctl.trigger_od_reading_sequence(); fed = 0; settle_started = measuring_at = first_measured = None
+    while not job.done.is_set():
+        ctl.clock.advance(interval)
+        burst = ctl._od_burst
+        if burst is not None:
+            if settle_started is None: settle_started = ctl.clock.time() - interval
+            if burst.values is not None and measuring_at is None: measuring_at = ctl.clock.time() - interval; first_measured = fed
+            ctl._handle_packet(burst_packet(ods[fed])); fed += 1
+        ctl.step()
+        assert ctl.clock.time() < 60, "the OD sequence did not finish"
+    return measuring_at - settle_started, first_measured
+
+def test_od_sequence_measures_as_soon_as_the_culture_settles(make_controller):
+    ctl = make_controller()
+    ods = settling_ramp(400)
+    settle_s, first = run_od_sequence(ctl, ods)
+    assert settle_s < OD_SETTLE_DURATION
+    assert ctl.latest_readings['od'] == pytest.approx(np.mean(ods[first:first + OD_BURST_SAMPLES]), abs=1e-4)
+    assert ctl.clock.time() < OD_STIR_DURATION + settle_s + OD_BURST_SAMPLES * 0.05 + 1
+
+def test_od_sequence_times_out_settling_and_measures_anyway(make_controller):
+    ctl = make_controller()
+    rng = np.random.default_rng(3)
+    ods = 0.3 + 0.01 * rng.normal(size=1000); ods[::7] += 0.2  # never steady, with bubbles
+    settle_s, _ = run_od_sequence(ctl, ods)
+    assert settle_s == pytest.approx(OD_SETTLE_DURATION, abs=0.1)
+    assert ctl.latest_readings['od'] == pytest.approx(0.3, abs=0.01)  # the bubbles were rejected
+    assert ctl.history.series['od'].arrays()[1][-1] == pytest.approx(ctl.latest_readings['od'], abs=1e-4)
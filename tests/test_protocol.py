@@ -0,0 +1,105 @@
+# test_protocol.py
+
+import json
+
+import pytest
+import protocol
+from serial_io import SerialLink
+from conftest import BufferTransport
+
+STATES = {"heater": 1, "stir": 0, "lights": 1, "aerator": 0, "pump1": 0, "pump2": 1, "irled": 1}
+
+def make_link(*chunks, binary=False):
+    link = SerialLink(None, transport=BufferTransport(*chunks), trace_dir=None); link.binary = binary
+    packets = []; link.subscribe(packets.append)
+    return link, packets
+
+def test_crc16_is_ccitt_false():
+    assert protocol.crc16(b"123456789") == 0x29B1
+    assert protocol.crc16(b"") == 0xFFFF
+
+@pytest.mark.parametrize("data", [b"", b"\x00", b"\x00\x00", b"\x11\x22\x00\x33", b"\x01" * 253, b"\x01" * 254,
+                                  b"\x01" * 255, b"\x01" * 254 + b"\x00", bytes(range(256)) * 3])
+def test_cobs_round_trip(data):
+    encoded = protocol.cobs_encode(data)
+    assert b"\x00" not in encoded
+    assert protocol.cobs_decode(encoded) == data
+
+def test_sensor_frame_round_trip():
+    frame = protocol.encode_sensor(70000, 25.12, -3.5, 812, None, STATES)
+    assert frame.endswith(b"\x00") and b"\x00" not in frame[:-1]
+    kind, seq, pkt = protocol.decode_payload(protocol.decode_frame(frame[:-1]))
+    assert (kind, seq) == (protocol.FRAME_SENSOR, 70000 & 0xFFFF)
+    assert pkt == {"t1": 25.12, "t2": -3.5, "l1": 812, "l2": None, **STATES}
+
+def test_missing_temperatures():
+    frame = protocol.encode_sensor(1, None, None, None, None, {})
+    _, _, pkt = protocol.decode_payload(protocol.decode_frame(frame[:-1]))
+    assert pkt["t1"] is None and pkt["t2"] is None and not any(pkt[name] for name in protocol.ACTUATORS)
+
+def test_set_and_burst_round_trip():
+    kind, seq, changes = protocol.decode_payload(protocol.decode_frame(protocol.encode_set(5, {"heater": 1, "pump1": 0})[:-1]))
+    assert (kind, seq, changes) == (protocol.FRAME_SET, 5, {"heater": 1, "pump1": 0})
+    kind, seq, burst = protocol.decode_payload(protocol.decode_frame(protocol.encode_burst(6, 200, 50)[:-1]))
+    assert (kind, seq, burst) == (protocol.FRAME_BURST, 6, {"samples": 200, "interval_ms": 50})
+
+def test_corrupted_frame_fails_the_crc():
+    frame = bytearray(protocol.encode_sensor(1, 25.0, 30.0, 1, 2, STATES)[:-1])
+    frame[3] ^= 0x04
+    with pytest.raises(protocol.FrameError): protocol.decode_frame(bytes(frame))
+
+def test_bad_cobs_and_unknown_frames_are_rejected():
+    with pytest.raises(protocol.FrameError): protocol.cobs_decode(b"\x05\x01")
+    with pytest.raises(protocol.FrameError): protocol.decode_payload(b"\x7f\x00\x00")
+
+def test_link_decodes_binary_frames_split_across_reads():
+    data = b"".join(protocol.encode_sensor(i, 20 + i, 30.0, None, None, STATES) for i in range(1, 4))
+    link, packets = make_link(data[:7], data[7:20], data[20:], binary=True)
+    link.poll()
+    assert [pkt["t1"] for pkt in packets] == [21, 22, 23]
+    assert link.stats["packets"] == 3 and link.stats["dropped_frames"] == 0
+
+def test_link_counts_crc_errors_and_dropped_frames():
+    bad = bytearray(protocol.encode_sensor(2, 25.0, 30.0, None, None, STATES)); bad[2] ^= 0x10
+    data = protocol.encode_sensor(1, 25.0, 30.0, None, None, STATES) + bytes(bad) + protocol.encode_sensor(3, 25.0, 30.0, None, None, STATES)
+    link, packets = make_link(data, binary=True)
+    link.poll()
+    assert len(packets) == 2
+    assert link.stats["crc_errors"] == 1 and link.stats["dropped_frames"] == 1
+
+def test_link_switches_to_binary_on_the_negotiation_ack():
+    ack = (json.dumps(protocol.NEGOTIATE_ACK) + "\n").encode()
+    line = (json.dumps({"t1": 24.0, **STATES}) + "\n").encode()
+    link, packets = make_link(line + ack + protocol.encode_sensor(1, 25.0, 30.0, None, None, STATES))
+    modes = []; link.on_mode_change = modes.append
+    link.poll()
+    assert modes == [True] and link.binary
+    assert [pkt["t1"] for pkt in packets] == [24.0, 25.0]
+
+def test_link_picks_up_a_device_already_on_binary():
+    data = b"".join(protocol.encode_sensor(i, 25.0, 30.0, None, None, STATES) for i in range(1, 30))
+    link, packets = make_link(data[5:])  # joined mid-frame, as after a host restart
+    modes = []; link.on_mode_change = modes.append
+    link.poll()
+    assert modes == [True] and link.binary
+    assert len(packets) >= 27 and link.stats["resyncs"] == 1
+    assert link.ser.written == [b"\0"]
+
+def sent_commands(link):
+    """What the link wrote, as (command, fields) pairs in either protocol."""
+    if not link.binary:
+        return [(cmd.pop("cmd"), cmd) for cmd in map(json.loads, link.ser.written)]
+    kinds = {protocol.FRAME_SET: "set", protocol.FRAME_BURST: "burst"}
+    return [(kinds[kind], fields) for kind, _, fields in
+            (protocol.decode_payload(protocol.decode_frame(frame[:-1])) for frame in link.ser.written)]
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_sets_queued_before_a_burst_are_written_ahead_of_it(make_controller, binary):
+    ctl = make_controller(binary=binary)
+    for cmd in ({"cmd": "set", "stir": 1}, {"cmd": "set", "irled": 1},
+                {"cmd": "burst", "samples": 20, "interval_ms": 50}, {"cmd": "set", "stir": 0}):
+        ctl.out_q.put(cmd)
+    ctl._process_serial_outbound()
+    assert sent_commands(ctl.link) == [("set", {"stir": 1, "irled": 1}), ("burst", {"samples": 20, "interval_ms": 50}),
+                                       ("set", {"stir": 0})]
+    assert ctl._unacked["stir"][0] == 0 and ctl._unacked["irled"][0] == 1
@@ -0,0 +1,41 @@
+# test_replay.py
+
+import time
+
+import replay
+from fleet import FleetManager
+from sim_engine import SimEngine
+from serial_io import SocketTransport, read_trace
+from log_writer import LogWriter
+from bioreactor_controller import BioreactorController
+
+def test_first_difference_ignores_order_and_grouping_across_actuators():
+    recorded = [(10.0, {"cmd": "set", "heater": 1, "stir": 1}), (20.0, {"cmd": "set", "stir": 0})]
+    assert replay.first_difference(recorded, [(9.99, {"cmd": "set", "stir": 1}), (10.0, {"cmd": "set", "heater": 1}),
+                                              (20.0, {"cmd": "set", "stir": 0})], 1.0) is None
+    assert replay.first_difference(recorded, [(10.0, {"cmd": "set", "heater": 1, "stir": 1}), (20.0, {"cmd": "set", "stir": 1})],
+                                   1.0) == (20.0, "stir", (20.0, 0), (20.0, 1))
+    assert replay.first_difference(recorded, [(10.0, {"cmd": "set", "heater": 1, "stir": 1}), (25.0, {"cmd": "set", "stir": 0})],
+                                   1.0) == (20.0, "stir", (20.0, 0), (25.0, 0))
+    assert replay.first_difference(recorded, recorded[:1], 1.0) == (20.0, "stir", (20.0, 0), None)
+
+def test_a_run_recorded_against_the_simulator_replays_to_the_same_commands(tmp_path):
+    # The heater cycles around 22.3 C while OD measurements (stir, settle, burst) every 18 s interrupt
+    # aeration cycles. At 40x the control thread's latency is 40 times longer in simulated time, so
+    # changes of different actuators often swap places or merge between the run and its replay.
+    setpoints = {"temperature": 22.3, "od_interval_hours": 0.005, "aerator_interval_hours": 0.004}
+    engine = SimEngine(1, speedup=40, transport="socket", seed=3); writer = LogWriter(); writer.start()
+    ctl = BioreactorController("rec", setpoints=setpoints, log_dir=tmp_path / "live", log_writer=writer, clock=engine.clock,
+                               transport=SocketTransport(engine.ports[0]), trace_dir=tmp_path, snapshot_interval=0)
+    engine.start(); FleetManager({"rec": ctl}).start(); started = time.monotonic()
+    while ctl.jobs.outcomes.totals().get(("od", "done"), 0) < 6:
+        assert time.monotonic() - started < 30, "the recorded run did not finish its OD measurements"
+        time.sleep(0.05)
+    engine.stop(); engine.join(); ctl.link.ser._f.flush(); writer.close()
+
+    records = list(read_trace(tmp_path / "rec.trace"))
+    replayed, commands = replay.replay(records, setpoints=setpoints, log_dir=tmp_path / "replay")
+    replayed.log_writer.close()
+    recorded = replay.recorded_commands(records)
+    assert {"heater", "stir", "irled", "aerator"} <= replay.command_streams(recorded).keys()
+    assert replay.first_difference(recorded, commands, engine.speedup * replay.REPLAY_WINDOW_S) is None
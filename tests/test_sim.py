@@ -0,0 +1,39 @@
+# test_sim.py
+
+import time
+
+import pytest
+from clock import ScaledClock
+from fleet import FleetManager
+from sim_engine import SimEngine
+from soak import build_rack
+
+@pytest.fixture
+def engine():
+    engine = SimEngine(1, speedup=200, transport="socket", seed=1)
+    yield engine
+    engine.stop(); engine.join()
+
+def test_packets_are_paced_in_simulated_time(engine):
+    sock = engine.ports[0]; sock.settimeout(1.0); received = b""
+    engine.start(); started = time.monotonic()
+    while received.count(b"\n") < 20: received += sock.recv(4096)  # JSON lines, one per simulated second
+    assert time.monotonic() - started < 20 / engine.speedup + 1.0
+    assert engine.reactors.sim_seconds >= 19
+
+def test_deadlines_are_waited_for_in_wall_clock_seconds(make_controller):
+    ctl = make_controller(clock=ScaledClock(100))
+    for name in ctl._timers: ctl.scheduler.arm(name, None)
+    ctl.scheduler.arm('status', ctl.clock.time() + 50)
+    assert 0.4 < ctl.seconds_until_next_deadline() <= 0.5
+
+def test_fleet_on_the_engine_clock_runs_its_schedules_sped_up(engine, tmp_path):
+    controllers = build_rack(engine, tmp_path, {"aerator_interval_hours": 0.05})  # every 3 simulated minutes
+    ctl = controllers["sim0"]
+    engine.start(); FleetManager(controllers).start(); started = time.monotonic()
+    while ctl.jobs.outcomes.totals().get(("aeration", "done"), 0) < 1:
+        assert time.monotonic() - started < 20, "no aeration cycle finished"
+        time.sleep(0.05)
+    # 3 minutes until the first cycle and 5 minutes of aeration: 8 simulated minutes in a few seconds
+    assert time.monotonic() - started < 480 / engine.speedup + 5
+    ctl.log_writer.close()
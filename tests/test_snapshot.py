@@ -0,0 +1,83 @@
+# test_snapshot.py
+
+import os
+import time
+import threading
+
+import numpy as np
+from snapshot import StateStore
+from history_store import HistoryStore
+
+def wait_for_snapshots(store, n, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while store.stats["snapshots"] < n:
+        assert time.monotonic() < deadline, "snapshot was not written"
+        time.sleep(0.005)
+
+def fill(history, name, start, n):
+    for i in range(start, start + n): history.append(name, i * 1000, i / 10)
+
+def test_state_and_journal_round_trip(tmp_path):
+    store = StateStore(tmp_path)
+    store.save(store.seq, {"setpoints": {"temperature": 30.0}, "manual": {"stir": 1}}, {})
+    wait_for_snapshots(store, 1)
+    store.journal("setpoints", {"temperature": 31.0}); store.journal("resume", None); store.flush()
+    state, series = StateStore(tmp_path).load()
+    assert state["setpoints"] == {"temperature": 31.0} and state["manual"] == {} and series == {}
+
+def test_torn_journal_entry_is_dropped(tmp_path):
+    store = StateStore(tmp_path); store.journal("setpoints", {"temperature": 28.0}); store.flush()
+    with open(tmp_path / "state.journal", "a") as f: f.write('{"seq": 2, "kind": "setp')
+    state, _ = StateStore(tmp_path).load()
+    assert state["setpoints"] == {"temperature": 28.0}
+    assert (tmp_path / "state.journal").read_text().count("\n") == 1
+
+def test_snapshots_append_only_new_history(tmp_path):
+    history = HistoryStore({"t1": (1000, 0.0), "od": (100, 0.0)})
+    store = StateStore(tmp_path, {"t1": 1000, "od": 100}); saved = history.appended()
+    fill(history, "t1", 0, 500)
+    store.save(store.seq, {}, history.copy(since=saved)); saved = history.appended(); wait_for_snapshots(store, 1)
+    first = (tmp_path / "state.history").stat().st_size
+    fill(history, "t1", 500, 10); history.append("od", 505_000, 0.4)
+    store.save(store.seq, {}, history.copy(since=saved)); wait_for_snapshots(store, 2)
+    assert (tmp_path / "state.history").stat().st_size - first < 300  # 11 samples, not the whole series
+    _, series = StateStore(tmp_path).load()
+    assert np.array_equal(series["t1"][0], np.arange(510) * 1000) and series["od"][1].tolist() == [np.float32(0.4)]
+
+def test_history_file_is_rewritten_to_the_limits(tmp_path):
+    history = HistoryStore({"t1": (100, 0.0)})
+    store = StateStore(tmp_path, {"t1": 100}); saved = history.appended()
+    for k in range(12):
+        fill(history, "t1", k * 50, 50)
+        store.save(store.seq, {}, history.copy(since=saved)); saved = history.appended(); wait_for_snapshots(store, k + 1)
+    assert store.stats["history_bytes"] <= 2 * 12 * 100 + 200
+    ts, _ = StateStore(tmp_path).load()[1]["t1"]
+    assert ts[-1] == 599_000 and len(ts) >= 100 and np.all(np.diff(ts) == 1000)
+
+def test_torn_history_chunk_is_dropped(tmp_path):
+    store = StateStore(tmp_path)
+    store.save(store.seq, {}, {"t1": (np.arange(5, dtype=np.int64), np.ones(5, np.float32))}); wait_for_snapshots(store, 1)
+    with open(tmp_path / "state.history", "ab") as f: f.write(b"BRHC\x02\x00")
+    _, series = StateStore(tmp_path).load()
+    assert len(series["t1"][0]) == 5
+    store = StateStore(tmp_path); store.load()
+    store.save(store.seq, {}, {"t1": (np.arange(5, 8, dtype=np.int64), np.ones(3, np.float32))}); wait_for_snapshots(store, 1)
+    assert StateStore(tmp_path).load()[1]["t1"][0].tolist() == list(range(8))
+
+def test_damaged_snapshot_is_ignored(tmp_path):
+    store = StateStore(tmp_path)
+    store.save(store.seq, {"setpoints": {"temperature": 30.0}}, {}); wait_for_snapshots(store, 1)
+    store.journal("setpoints", {"light_cycle_hours": 16}); store.flush()
+    data = bytearray((tmp_path / "state.snap").read_bytes()); data[20] ^= 0xFF; (tmp_path / "state.snap").write_bytes(data)
+    state, _ = StateStore(tmp_path).load()
+    assert state["setpoints"] == {"light_cycle_hours": 16}
+
+def test_journal_writes_happen_on_the_writer_thread(tmp_path, monkeypatch):
+    fsyncs = []; fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: (fsyncs.append(threading.current_thread()), fsync(fd)))
+    store = StateStore(tmp_path)
+    for i in range(7): store.journal("setpoints", {"temperature": 20.0 + i})
+    assert store.flush(5)
+    assert fsyncs and threading.current_thread() not in fsyncs
+    assert store.stats["journal_entries"] == 7
+    assert StateStore(tmp_path).load()[0]["setpoints"] == {"temperature": 26.0}
@@ -0,0 +1,104 @@
+# test_thermal.py
+
+import json
+import math
+
+import numpy as np
+import pytest
+import thermal
+
+PLANT = {"gain": 40.0, "tau_s": 600.0, "dead_s": 30.0, "ambient": 20.0}
+
+class Plant:
+    """A first-order-plus-dead-time reactor advanced in 1 s steps."""
+    def __init__(self, gain, tau_s, dead_s, ambient, start=None):
+        self.gain = gain; self.decay = math.exp(-1 / tau_s); self.ambient = ambient
+        self.temp = ambient if start is None else start; self.delayed = [0] * int(dead_s)
+
+    def step(self, heater_on):
+        self.delayed.append(heater_on); u = self.delayed.pop(0)
+        self.temp = self.ambient + self.gain * u + (self.temp - self.ambient - self.gain * u) * self.decay
+        return self.temp
+
+def logged(plant, seconds, seed=0):
+    """(temperatures, heater states) at 1 s of a plant driven by random pulses of 1 to 5 minutes."""
+    rng = np.random.default_rng(seed); temps = []; heater = []; on = 0; until = 0
+    for s in range(seconds):
+        if s >= until: on = int(rng.random() < 0.4); until = s + int(rng.integers(60, 300))
+        temps.append(plant.step(on) + rng.normal(0, 0.02)); heater.append(on)
+    return np.array(temps), np.array(heater, dtype=float)
+
+def fit(temps, heater, step_s=10.0, max_dead_s=300.0):
+    ts = np.arange(len(temps), dtype=np.int64) * 1000
+    return thermal.fit_fopdt(thermal.resample(ts, temps, step_s), thermal.resample(ts, heater, step_s), step_s, max_dead_s)
+
+def test_fit_recovers_the_plant():
+    model = fit(*logged(Plant(**PLANT), 12 * 3600))
+    assert model["gain"] == pytest.approx(PLANT["gain"], rel=0.05)
+    assert model["tau_s"] == pytest.approx(PLANT["tau_s"], rel=0.1)  # the 10 s bin means blur it a little
+    assert model["ambient"] == pytest.approx(PLANT["ambient"], abs=1.0)
+    assert abs(model["dead_s"] - PLANT["dead_s"]) <= 10
+
+def test_fit_needs_the_heater_to_switch():
+    temps = 25 + np.random.default_rng(1).normal(0, 0.05, 6 * 3600)
+    assert fit(temps, np.zeros(len(temps))) is None
+
+def test_fit_rejects_a_time_constant_of_a_few_steps():
+    assert fit(*logged(Plant(5.0, 20.0, 0, 25.0), 6 * 3600)) is None
+
+def test_fit_rejects_a_dead_time_at_the_longest_tried():
+    assert fit(*logged(Plant(**{**PLANT, "dead_s": 200.0}), 12 * 3600), max_dead_s=60.0) is None
+
+def test_implausible():
+    assert thermal.implausible(PLANT, 10.0, 300.0, highest=45.0) is None
+    assert "ambient" in thermal.implausible(PLANT, 10.0, 300.0, highest=19.0)
+    assert "time constant" in thermal.implausible({**PLANT, "tau_s": 19.25}, 10.0, 300.0)
+    assert "dead time" in thermal.implausible({**PLANT, "dead_s": 300.0}, 10.0, 300.0)
+
+def test_load_model_ignores_implausible_models(tmp_path):
+    path = tmp_path / "thermal_model.json"
+    assert thermal.load_model(path) is None
+    path.write_text(json.dumps({"step_s": 10.0, "t1": PLANT, "t2": None}))
+    assert thermal.load_model(path)["t1"] == PLANT
+    path.write_text(json.dumps({"step_s": 10.0, "t1": {**PLANT, "tau_s": 19.25}, "t2": None}))
+    assert thermal.load_model(path) is None
+
+def run(controller, plant, setpoint, seconds):
+    """Closed loop with hysteresis as the fallback, as in BioreactorController. Returns temperatures, switches and fallbacks."""
+    temps = []; on = 0; switches = 0; fallbacks = 0
+    for s in range(seconds):
+        t1 = plant.temp; decision = controller.update(float(s), t1, setpoint, on)
+        if decision is None:
+            fallbacks += 1; decision = 1 if t1 < setpoint - 0.25 else 0 if t1 > setpoint + 0.25 else on
+        switches += int(decision) != on; on = int(decision); temps.append(plant.step(on))
+    return np.array(temps), switches, fallbacks
+
+def test_controller_holds_the_setpoint_of_its_plant():
+    controller = thermal.HeaterController({"t1": PLANT})
+    temps, switches, _ = run(controller, Plant(**PLANT, start=25.0), 30.0, 4 * 3600)
+    assert abs(temps[-3600:].mean() - 30.0) < 0.05 and np.abs(temps[-3600:] - 30.0).max() < 0.5
+    assert 0 < controller.duty < 1 and switches < 4 * 3600 / controller.period * 2 + 2
+
+def test_period_leaves_room_for_the_minimum_switch_time():
+    # A fast model, e.g. fitted from a few hours at a fixed setpoint, used to make the period
+    # shorter than min_switch_s, so every pulse rounded to nothing and the heater never came on.
+    fast = {"gain": 12.8, "tau_s": 19.25, "dead_s": 0.0, "ambient": 25.2}
+    controller = thermal.HeaterController({"t1": fast}, min_switch_s=2.0)
+    assert controller.period >= controller.MIN_PERIOD_SWITCHES * 2.0
+    temps, switches, _ = run(controller, Plant(**fast, start=20.0), 30.0, 3600)
+    assert switches > 0 and abs(temps[-600:].mean() - 30.0) < 0.5
+
+def test_controller_defers_to_hysteresis_when_it_has_no_answer():
+    controller = thermal.HeaterController({"t1": PLANT})
+    assert controller.update(0.0, 18.0, 19.0, 0) is None  # setpoint below the model's ambient
+    controller = thermal.HeaterController({"t1": PLANT})
+    assert controller.update(0.0, 20.0, 70.0, 0) is None  # beyond what the heater can reach
+    _, _, fallbacks = run(thermal.HeaterController({"t1": PLANT}), Plant(**PLANT, start=30.0), 30.0, 3600)
+    assert fallbacks == 0
+
+def test_pulses_respect_the_element_limit():
+    model = {"t1": PLANT, "t2": {"gain": 80.0, "tau_s": 120.0, "dead_s": 0.0, "ambient": 20.0}}
+    controller = thermal.HeaterController(model, element_max=60.0)
+    assert controller.max_duty == pytest.approx(0.5)
+    controller.update(0.0, 20.0, 40.0, 0)
+    assert controller.duty <= 0.5
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# thermal.py
+"""First-order-plus-dead-time (FOPDT) models of the reactor temperatures and the heater controller
+that uses them. The models are fitted from the binary logs, which record the heater state with
+every sample; run this nightly (e.g. from cron) and the controller picks up the new model:
+
+    python thermal.py                   # LOG_DIR, the last 30 days -> LOG_DIR/thermal_model.json
+    python thermal.py logs/r1 --days 7 --dry-run
+"""
+
+import os
+import sys
+import json
+import math
+import pathlib
+import argparse
+import datetime
+
+import numpy as np
+from config import *
+from analyze_logs import day_files, load_binary_log
+
+def resample(ts_ms, values, step_s):
+    """Means of values over consecutive step_s bins from ts_ms[0]; NaN for bins without samples."""
+    k = (ts_ms - ts_ms[0]) // int(step_s * 1000); ok = ~np.isnan(values)
+    counts = np.bincount(k[ok], minlength=k[-1] + 1)
+    sums = np.bincount(k[ok], values[ok], minlength=k[-1] + 1)
+    return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+def fit_fopdt(temp, duty, step_s=THERMAL_FIT_STEP_S, max_dead_s=THERMAL_MAX_DEAD_S):
+    """Fits tau * dT/dt = ambient + gain * duty(t - dead) - T to a temperature and the heater duty
+    (0..1), both sampled every step_s (NaN = no data), as the linear recurrence
+    T[k+1] - T[k] = alpha * T[k] + beta * duty[k - d] + gamma. Every dead time d up to max_dead_s is
+    solved in one batch of normal equations and the one with the smallest residual is kept.
+    Returns a dict of gain (degC at full duty), tau_s, dead_s, ambient and rmse (degC per step),
+    or None if the data cannot support a model (e.g. the heater never changed state) or the best
+    fit is implausible (see implausible())."""
+    delays = int(max_dead_s // step_s) + 1; n = len(temp) - 1
+    if n < 2 * delays: return None
+    dt = temp[1:] - temp[:-1]; ok = ~np.isnan(dt)
+    mean = float(np.nanmean(temp)); level = np.nan_to_num(temp[:-1] - mean)  # centred, for conditioning
+    padded = np.concatenate([np.full(delays - 1, np.nan), duty[:-1]])
+    xtx = np.empty((delays, 3, 3)); xty = np.empty((delays, 3)); yy = np.empty(delays); rows = np.empty(delays)
+    for d in range(delays):
+        lagged = padded[delays - 1 - d:delays - 1 - d + n]; m = ok & ~np.isnan(lagged)
+        x = np.column_stack([level[m], lagged[m], np.ones(int(m.sum()))]); y = dt[m]
+        xtx[d] = x.T @ x; xty[d] = x.T @ y; yy[d] = y @ y; rows[d] = len(y)
+    usable = (rows > 3) & (np.abs(np.linalg.det(xtx)) > 1e-9 * np.maximum(rows, 1) ** 3)
+    if not usable.any(): return None
+    coef = np.full((delays, 3), np.nan)
+    coef[usable] = np.linalg.solve(xtx[usable], xty[usable][..., None])[..., 0]
+    rss = yy - 2 * np.einsum('di,di->d', coef, xty) + np.einsum('di,dij,dj->d', coef, xtx, coef)
+    alpha, beta = coef[:, 0], coef[:, 1]
+    stable = usable & (alpha < 0) & (alpha > -1) & (beta > 0)
+    if not stable.any(): return None
+    d = int(np.argmin(np.where(stable, rss / np.maximum(rows, 1), np.inf)))
+    alpha, beta, gamma = coef[d]; gamma -= alpha * mean
+    fit = {"gain": round(float(beta / -alpha), 4), "tau_s": round(float(-step_s / math.log1p(alpha)), 2),
+           "dead_s": d * step_s, "ambient": round(float(gamma / -alpha), 3),
+           "rmse": round(float(math.sqrt(max(rss[d], 0.0) / rows[d])), 5)}
+    reason = implausible(fit, step_s, max_dead_s, float(np.nanmax(temp)))
+    if reason: print(f"Rejecting thermal fit {fit}: {reason}"); return None
+    return fit
+
+def implausible(fit, step_s=THERMAL_FIT_STEP_S, max_dead_s=THERMAL_MAX_DEAD_S, highest=None):
+    """Why a fitted model can't be right, or None. A time constant of a few sampling steps or a dead
+    time at the longest one tried means the fit explained noise rather than the heating; an ambient
+    above the highest temperature seen (`highest`) means it never saw the reactor cool."""
+    if fit["tau_s"] < THERMAL_MIN_TAU_STEPS * step_s: return f"time constant under {THERMAL_MIN_TAU_STEPS} steps of {step_s:g}s"
+    if fit["dead_s"] >= max_dead_s: return f"dead time at the longest tried ({max_dead_s:g}s)"
+    if highest is not None and fit["ambient"] >= highest: return f"ambient at or above the highest temperature seen ({highest:g})"
+    return None
+
+def fit_logs(log_dir, days=30, step_s=THERMAL_FIT_STEP_S, max_dead_s=THERMAL_MAX_DEAD_S):
+    """Models of t1 and t2 (each None if it could not be fitted) from the last `days` days of binary logs."""
+    first = datetime.date.today() - datetime.timedelta(days=days - 1)
+    files = [p for p in day_files(log_dir, first).values() if p.suffix == ".bin"]
+    if not files: return None
+    loaded = [load_binary_log(p) for p in files]
+    ts = np.concatenate([t for t, _ in loaded]); order = np.argsort(ts, kind="stable"); ts = ts[order]
+    cols = {name: np.concatenate([c[name] for _, c in loaded])[order] for name in ("t1", "t2", "heater")}
+    if not len(ts): return None
+    duty = resample(ts, cols["heater"], step_s)
+    return {"fitted": datetime.datetime.now().isoformat(timespec="seconds"), "files": [p.name for p in files],
+            "samples": int(len(ts)), "step_s": step_s, "max_dead_s": max_dead_s,
+            **{name: fit_fopdt(resample(ts, cols[name], step_s), duty, step_s, max_dead_s) for name in ("t1", "t2")}}
+
+def load_model(path):
+    """The model written by this script, or None if there is none, it has no t1 model or that is implausible."""
+    try:
+        with open(path) as f: model = json.load(f)
+    except FileNotFoundError: return None
+    except (OSError, ValueError) as e: print(f"Ignoring thermal model {path}: {e}"); return None
+    if not model.get("t1"): return None
+    reason = implausible(model["t1"], model.get("step_s", THERMAL_FIT_STEP_S), model.get("max_dead_s", THERMAL_MAX_DEAD_S))
+    if reason: print(f"Ignoring thermal model {path}: {reason}"); return None
+    return model
+
+class HeaterController:
+    """Model-predictive heater control. At the start of every period it predicts the temperature one
+    dead time ahead, since the heat already in the element still has to arrive. It then solves in
+    closed form for how long to keep the heater on so that the model ends the period at the setpoint.
+    The period is a twentieth of the model's time constant, so one pulse only nudges the temperature,
+    but at most period_s and at least MIN_PERIOD_SWITCHES * min_switch_s. The mean error of each
+    period is integrated into a correction of the model's ambient temperature, which removes the
+    offset a wrong gain or a draught would leave. The integral is held while the previous pulse was
+    saturated, so heat-up does not wind it up. Pulses are capped so that the element settles below
+    HEATER_ELEMENT_MAX_TEMP. A pulse or gap shorter than min_switch_s is rounded away, so the relay
+    never clicks twice in quick succession. update() is called with every reading and costs O(1)."""
+    INTEGRAL_GAIN = 0.3  # degC of ambient correction per degC of mean error per period
+    MIN_PERIOD_SWITCHES = 5  # so a partial pulse is never shorter than min_switch_s by construction
+
+    def __init__(self, model, period_s=HEATER_PWM_PERIOD_S, min_switch_s=HEATER_MIN_SWITCH_S,
+                 element_max=HEATER_ELEMENT_MAX_TEMP):
+        t1 = model["t1"]; self.gain, self.tau, self.dead, self.ambient = t1["gain"], t1["tau_s"], t1["dead_s"], t1["ambient"]
+        self.period = max(min(period_s, self.tau / 20), self.MIN_PERIOD_SWITCHES * min_switch_s); self.min_switch = min_switch_s
+        self._decay = math.exp(-self.period / self.tau)
+        t2 = model.get("t2")
+        self.max_duty = 1.0 if not t2 else min(max((element_max - t2["ambient"]) / t2["gain"], 0.0), 1.0)
+        self.duty = 0.0; self.offset = 0.0; self._on_s = 0.0; self._saturated = True; self._short = False
+        self._period_start = None; self._sum = 0.0; self._count = 0  # readings of the current period
+        self._last = None; self._recent_duty = 0.0  # heater duty over the last dead time
+
+    def update(self, now, t1, setpoint, heater_on):
+        """Whether the heater should be on now, given the current reading and heater state. None when
+        the model has no useful answer and the caller should fall back to hysteresis: the setpoint is
+        at or below the model's ambient, or even the longest pulse allowed falls short this period."""
+        if self._last is None or self.dead <= 0: self._recent_duty = float(heater_on)
+        else: self._recent_duty += (heater_on - self._recent_duty) * min(1.0, (now - self._last) / self.dead)
+        self._last = now
+        if self._period_start is None or now - self._period_start >= self.period: self._start_period(now, t1, setpoint)
+        self._sum += t1; self._count += 1
+        if self._short or setpoint <= self.ambient: return None
+        return now - self._period_start < self._on_s
+
+    def _start_period(self, now, t1, setpoint):
+        if self._count and not self._saturated:
+            self.offset += self.INTEGRAL_GAIN * (self._sum / self._count - setpoint)
+            self.offset = min(max(self.offset, -self.gain), self.gain)
+        self._period_start = now; self._sum = 0.0; self._count = 0
+        ambient = self.ambient + self.offset
+        drive = ambient + self.gain * self._recent_duty
+        start = drive + (t1 - drive) * math.exp(-self.dead / self.tau)
+        # Heating for `on` seconds, then coasting, ends the period at
+        # ambient + gain * (exp(-(period - on) / tau) - decay) + (start - ambient) * decay.
+        x = (setpoint - ambient - (start - ambient) * self._decay) / self.gain + self._decay
+        wanted = self.period + self.tau * math.log(x) if x > self._decay else 0.0
+        on = min(max(wanted, 0.0), self.max_duty * self.period)
+        self._saturated = on != wanted; self._short = wanted > on
+        if on < self.min_switch: on = 0.0
+        elif on > self.period - self.min_switch: on = self.period
+        self._on_s = on; self.duty = on / self.period
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("log_dir", nargs="?", default=str(LOG_DIR))
+    parser.add_argument("--days", type=int, default=30, help="fit the last this many days")
+    parser.add_argument("--step", type=float, default=THERMAL_FIT_STEP_S, help="resampling step in seconds")
+    parser.add_argument("--max-dead", type=float, default=THERMAL_MAX_DEAD_S, help="longest dead time to try, in seconds")
+    parser.add_argument("--dry-run", action="store_true", help="print the model without writing it")
+    args = parser.parse_args()
+
+    log_dir = pathlib.Path(args.log_dir)
+    if not log_dir.is_dir(): sys.exit(f"{log_dir}: no such directory")
+    model = fit_logs(log_dir, args.days, args.step, args.max_dead)
+    if model is None: sys.exit(f"{log_dir}: no binary logs in the last {args.days} days")
+    for name in ("t1", "t2"): print(f"{name}: {model[name] or 'could not be fitted'}")
+    if not model["t1"]: sys.exit("Not writing a model without t1 (did the heater switch at all?)")
+    if args.dry_run: return
+    path = log_dir / THERMAL_MODEL_FILE; tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w") as f: json.dump(model, f, indent=1)
+    os.replace(tmp, path); print(f"Wrote {path}")
+
+if __name__ == "__main__":
+    main()
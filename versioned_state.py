@@ -0,0 +1,38 @@
+# versioned_state.py
+
+from types import MappingProxyType
+from typing import NamedTuple
+
+class StateSnapshot(NamedTuple):
+    """One version of a controller's state. The sections are read-only mappings that never change."""
+    version: int
+    readings: MappingProxyType
+    setpoints: MappingProxyType
+    manual_overrides: MappingProxyType
+    schedule: MappingProxyType
+
+SECTIONS = StateSnapshot._fields[1:]
+
+class VersionedState:
+    """Copy-on-write publication of state that one thread owns and mutates in plain dicts.
+    publish() compares the working dicts with the current snapshot and, if anything differs, makes
+    the next version, copying only the sections that changed and sharing the others. Readers take
+    `current`, a single reference read: they never wait for the writer and never see a section
+    half-updated, and `version` tells them cheaply whether anything changed since they last looked."""
+    def __init__(self, **sections):
+        self.current = StateSnapshot(0, *(MappingProxyType(dict(sections[name])) for name in SECTIONS))
+
+    @property
+    def version(self): return self.current.version
+
+    def changed_since(self, version): return self.current.version != version
+
+    def publish(self, **sections):
+        """Called by the owning thread with the current working dicts; returns the (new) current snapshot."""
+        current = self.current; parts = []
+        for name in SECTIONS:
+            old = getattr(current, name); new = sections[name]
+            parts.append(old if new == old else MappingProxyType(dict(new)))
+        if any(new is not old for new, old in zip(parts, current[1:])):
+            self.current = StateSnapshot(current.version + 1, *parts)
+        return self.current